@@ -4,12 +4,15 @@ from flask_migrate import Migrate
 from flask_login import LoginManager # Import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from config import Config, TestingConfig
+from .rate_limit import LoginRateLimiter
+from . import db_routing
 import os
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': db_routing.RoutingSession}) # Sends read-only requests to replicas
 migrate = Migrate()
 login_manager = LoginManager() # Instantiate LoginManager
 csrf = CSRFProtect() # Initialize CSRF protection
+login_limiter = LoginRateLimiter() # Throttles failed logins per IP and username
 login_manager.login_view = 'auth.login' # Route name (Blueprint.view_function) for login page
 login_manager.login_message_category = 'info' # Optional: category for flash messages
 
@@ -38,10 +41,18 @@ def create_app(config_class=Config):
         pass
 
     # Initialize extensions
+    from . import logs # Request ids on every request + opt-in JSON logs; first, so other hooks' logs carry the id
+    logs.init_app(app)
+    from . import profiling # Opt-in request profiles; registered early so its hooks wrap the others
+    profiling.init_app(app)
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app) # Initialize LoginManager
     csrf.init_app(app) # Initialize CSRF protection
+    login_limiter.init_app(app)
+    db_routing.init_app(app)
+    from . import slow_queries # Opt-in slow statement log + `flask slow-queries report`
+    slow_queries.init_app(app)
 
     # Register Blueprints
     from .routes import main as main_blueprint
@@ -54,6 +65,39 @@ def create_app(config_class=Config):
     from .products import products_bp # Import products blueprint
     app.register_blueprint(products_bp, url_prefix='/products') # Register it
 
+    from .api import api_bp # JSON API
+    app.register_blueprint(api_bp, url_prefix='/api')
+
     from . import models
 
+    from . import audit # Registers the audit flush listeners
+    audit.init_app(app)
+
+    from . import jobs # Outbox + `flask worker`
+    jobs.init_app(app)
+
+    from . import backfills # Batched, resumable data backfills + `flask backfill`
+    backfills.init_app(app)
+
+    from . import reporting # Stock movement ledger, rollups + `flask reports`
+    reporting.init_app(app)
+
+    from . import archive # Long-inactive products move to archive tables (`flask products archive|restore`)
+    archive.init_app(app)
+
+    from . import inventory # Per-location stock behind Product.stock_quantity + `flask inventory`
+    inventory.init_app(app)
+
+    from . import images # Stored product images, thumbnails (process pool) + `flask images`
+    images.init_app(app)
+
+    from . import fragment_cache # {% cache %} for templates, invalidated on product changes
+    fragment_cache.init_app(app)
+
+    from . import catalog # Optional in-memory snapshot of active products for read paths
+    catalog.init_app(app)
+
+    from . import compression # gzip/brotli for text responses
+    compression.init_app(app)
+
     return app
\ No newline at end of file
@@ -0,0 +1,283 @@
+from datetime import datetime, timedelta, timezone
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from flask_login import login_required
+from .bulk_update import BulkUpdate, BulkUpdateError, read_sku_file
+from .facets import category_facets
+from .audit import query_audit_log
+from .low_stock import low_stock_query
+from .price_history import prices_as_of, price_history
+from .reporting import ReportError, METRICS, activity_report, stock_turnover, iter_csv
+from .models import utcnow
+from .db_routing import read_only
+from .catalog import catalog_snapshot, snapshot_page
+from .change_feed import CursorExpired, changes_since
+from .inventory import InventoryError, allocate, location_stock
+from .product_reads import (ProductQueryError, product_page_query, product_by_sku_query, sku_lookup_query,
+                            product_dict, page_result, lookup_result)
+from . import db, csrf
+
+api_bp = Blueprint('api', __name__)
+
+
+class ApiArgumentError(ValueError):
+    """Raised for missing or malformed request arguments that no feature module checks."""
+
+
+@api_bp.errorhandler(ApiArgumentError)
+def api_argument_error(e):
+    return jsonify(error=str(e)), 400
+
+
+@api_bp.errorhandler(BulkUpdateError)
+def bulk_update_error(e):
+    return jsonify(error=str(e)), 400
+
+
+@api_bp.errorhandler(ReportError)
+def report_error(e):
+    return jsonify(error=str(e)), 400
+
+
+@api_bp.errorhandler(InventoryError)
+def inventory_error(e):
+    return jsonify(error=str(e)), 400
+
+
+@api_bp.errorhandler(ProductQueryError)
+def product_query_error(e):
+    return jsonify(error=str(e)), 400
+
+
+# Product reads; app/async_api.py serves the same endpoints under /api/async
+
+@api_bp.route('/products')
+@login_required
+def list_products():
+    """A page of products by id: ?after=<last id>&limit=&category=&active=."""
+    args = request.args
+    snapshot = catalog_snapshot()
+    if snapshot is not None:
+        result = snapshot_page(snapshot, after_id=args.get('after'), limit=args.get('limit'),
+                               category=args.get('category'), active=args.get('active'))
+        if result is not None:
+            return jsonify(result)
+    statement = product_page_query(after_id=args.get('after'), limit=args.get('limit'),
+                                   category=args.get('category'), active=args.get('active'))
+    return jsonify(page_result(db.session.execute(statement)))
+
+
+@api_bp.route('/products/<sku>')
+@login_required
+def get_product(sku):
+    snapshot = catalog_snapshot()
+    product = snapshot.get_by_sku(sku) if snapshot is not None else None
+    if product is not None:
+        return jsonify(product=product.to_dict())
+    row = db.session.execute(product_by_sku_query(sku)).first()
+    if row is None:
+        return jsonify(error='Product not found'), 404
+    return jsonify(product=product_dict(row))
+
+
+@api_bp.route('/products/lookup', methods=['POST'])
+@csrf.exempt # A read: the POST only carries the SKU list
+@login_required
+@read_only
+def lookup_products():
+    """Many products in one query: {"skus": [...]}."""
+    data = request.get_json(silent=True)
+    skus = data.get('skus') if isinstance(data, dict) else None
+    statement = sku_lookup_query(skus)
+    snapshot = catalog_snapshot()
+    if snapshot is None:
+        return jsonify(lookup_result(skus, db.session.execute(statement)))
+    found = snapshot.lookup(skus) # Only inactive or unknown SKUs go to the database
+    remaining = [sku for sku in skus if sku.lower() not in found]
+    rows = db.session.execute(sku_lookup_query(remaining)) if remaining else ()
+    return jsonify(lookup_result(skus, rows, found))
+
+
+@api_bp.route('/products/changes')
+@login_required
+def product_changes():
+    """Products changed after ?since=<cursor> in commit order, ?limit= per page (see app/change_feed.py)."""
+    try:
+        return jsonify(changes_since(request.args.get('since'), request.args.get('limit')))
+    except CursorExpired as e:
+        # Re-export the catalog, then follow the feed from `cursor`
+        return jsonify(error=str(e), resync=True, cursor=e.head), 410
+
+
+@api_bp.route('/products/bulk-update', methods=['POST'])
+@login_required
+def bulk_update_products():
+    """Apply (or preview, with dry_run) a bulk change.
+
+    Accepts JSON: {"field", "operation", "value", "category", "is_active",
+    "skus": [...], "dry_run", "chunk_size"}, or the same keys as form fields
+    with the SKU list uploaded as a `sku_file`.
+    """
+    if request.is_json:
+        data = request.get_json()
+        if not isinstance(data, dict):
+            raise BulkUpdateError('Expected a JSON object')
+        skus = data.get('skus')
+        if skus is not None and not (isinstance(skus, list) and all(isinstance(s, str) for s in skus)):
+            raise BulkUpdateError("'skus' must be a list of strings")
+    else:
+        data = request.form.to_dict()
+        sku_file = request.files.get('sku_file')
+        skus = read_sku_file(sku_file.stream) if sku_file else None
+    if 'field' not in data or 'value' not in data:
+        raise BulkUpdateError("'field' and 'value' are required")
+
+    try:
+        chunk_size = int(data.get('chunk_size', 500))
+    except (TypeError, ValueError):
+        raise BulkUpdateError('chunk_size must be an integer')
+    bulk = BulkUpdate(
+        data['field'], data.get('operation', 'set'), data['value'],
+        category=data.get('category'), is_active=data.get('is_active'),
+        skus=skus, chunk_size=chunk_size)
+
+    dry_run = data.get('dry_run') in (True, 'true', '1', 'y', 'yes')
+    return jsonify(bulk.preview() if dry_run else bulk.run())
+
+
+@api_bp.route('/products/facets')
+@login_required
+def product_facets():
+    """Per-category product counts, split by active/inactive."""
+    return jsonify(facets=category_facets())
+
+
+@api_bp.route('/products/low-stock')
+@login_required
+def low_stock_products():
+    """Products at or below their reorder point, lowest stock first."""
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    products = low_stock_query().limit(limit).all()
+    return jsonify(products=[{
+        'sku': p.sku, 'name': p.name, 'stock_quantity': p.stock_quantity, 'reorder_point': p.reorder_point,
+    } for p in products])
+
+
+@api_bp.route('/products/<sku>/stock')
+@login_required
+def product_stock(sku):
+    """The product's total stock and its quantity per location."""
+    row = db.session.execute(product_by_sku_query(sku)).first()
+    if row is None:
+        return jsonify(error='Product not found'), 404
+    return jsonify(sku=row.sku, stock_quantity=row.stock_quantity, locations=[
+        {'location': code, 'name': name, 'quantity': quantity} for code, name, quantity in location_stock(row.id)])
+
+
+@api_bp.route('/inventory/allocate', methods=['POST'])
+@csrf.exempt # A read: nothing is reserved
+@login_required
+@read_only
+def allocate_order():
+    """Fulfilling locations for an order: {"lines": [{"sku", "quantity"}, ...]}."""
+    data = request.get_json(silent=True)
+    lines = data.get('lines') if isinstance(data, dict) else None
+    if not isinstance(lines, list) or not all(isinstance(line, dict) for line in lines):
+        raise InventoryError("'lines' must be a list of {\"sku\", \"quantity\"} objects")
+    result = allocate([(line.get('sku'), line.get('quantity')) for line in lines])
+    return jsonify(lines=result, complete=all(line['allocated'] == line['requested'] for line in result))
+
+
+@api_bp.route('/products/prices/as-of', methods=['POST'])
+@csrf.exempt # A read: the POST only carries the SKU list
+@login_required
+@read_only
+def product_prices_as_of():
+    """Prices of many SKUs at one point in time: {"as_of": ISO datetime, "skus": [...]}."""
+    data = request.get_json(silent=True) or {}
+    as_of = _parse_datetime(data.get('as_of'), 'as_of')
+    skus = data.get('skus')
+    if as_of is None or not isinstance(skus, list):
+        raise ApiArgumentError("'as_of' and a list of 'skus' are required")
+    prices = prices_as_of(as_of, skus)
+    return jsonify(as_of=as_of.isoformat(), prices=prices,
+                   missing=sorted({sku.lower() for sku in skus} - prices.keys()))
+
+
+@api_bp.route('/products/<sku>/price-history')
+@login_required
+def product_price_history(sku):
+    return jsonify(sku=sku.lower(), history=[{
+        'price': row.price,
+        'effective_from': row.effective_from.isoformat(),
+        'effective_to': row.effective_to.isoformat() if row.effective_to else None,
+    } for row in price_history(sku)])
+
+
+def _parse_datetime(value, name):
+    """An ISO 8601 query value as a naive UTC datetime, like the stored columns and utcnow()."""
+    try:
+        parsed = datetime.fromisoformat(value) if value else None
+    except ValueError:
+        raise ApiArgumentError(f'{name} must be an ISO 8601 date/time')
+    if parsed is not None and parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+@api_bp.route('/audit')
+@login_required
+def audit_log():
+    """Product audit entries filtered by sku, user_id and a since/until range (default: last 30 days)."""
+    entries = query_audit_log(
+        sku=request.args.get('sku'),
+        user_id=request.args.get('user_id', type=int),
+        since=_parse_datetime(request.args.get('since'), 'since'),
+        until=_parse_datetime(request.args.get('until'), 'until'),
+        limit=min(request.args.get('limit', 100, type=int), 1000))
+    return jsonify(entries=entries)
+
+
+def _report_range(period):
+    """start/end query args; defaults to the last 30 days (daily) or 48 hours (hourly)."""
+    end = _parse_datetime(request.args.get('end'), 'end') or utcnow()
+    default_span = timedelta(hours=48) if period == 'hour' else timedelta(days=30)
+    start = _parse_datetime(request.args.get('start'), 'start') or end - default_span
+    return start, end
+
+
+def _wants_csv():
+    return request.args.get('format') == 'csv'
+
+
+def _csv_response(columns, rows, filename):
+    return Response(stream_with_context(iter_csv(columns, rows)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+@api_bp.route('/reports/activity')
+@login_required
+def report_activity():
+    """Sales and stock movement totals per hour/day, by category or product. format=csv streams CSV."""
+    period = request.args.get('period', 'day')
+    by = request.args.get('by', 'category')
+    start, end = _report_range(period)
+    rows = activity_report(start, end, period=period, by=by, category=request.args.get('category'),
+                           product_id=request.args.get('product_id', type=int))
+    key = 'category' if by == 'category' else 'product_id'
+    columns = ['bucket', key, *METRICS]
+    if _wants_csv():
+        return _csv_response(columns, rows, f'activity-{by}-{period}.csv')
+    return jsonify(period=period, start=start.isoformat(), end=end.isoformat(), rows=[
+        dict(zip(columns, (row[0].isoformat(), *row[1:]))) for row in rows])
+
+
+@api_bp.route('/reports/turnover')
+@login_required
+def report_turnover():
+    """Best sellers over a date range with current stock and days of cover. format=csv streams CSV."""
+    start, end = _report_range('day')
+    rows = stock_turnover(start, end, limit=min(request.args.get('limit', 100, type=int), 1000))
+    if _wants_csv():
+        return _csv_response(['product_id', 'sku', 'units_sold', 'revenue', 'units_out', 'stock_quantity',
+                              'days_of_cover'], rows, 'turnover.csv')
+    return jsonify(start=start.isoformat(), end=end.isoformat(), products=rows)
@@ -0,0 +1,149 @@
+"""Archival of long-inactive products.
+
+`flask products archive` moves products that have been inactive and
+unchanged for ARCHIVE_AFTER_DAYS into `archived_products`. Each product's
+price history goes with it into `archived_product_prices`, and its stock
+locations into `archived_location_stock`. Products keep their ids, so the
+ledger, the change feed and the audit log still refer to them. Lists,
+counts and the SKU index of `products` then only cover the live catalog.
+
+Work is done in chunks of primary keys, one short transaction each. A
+chunk re-checks the condition on rows it has locked, so a product
+reactivated meanwhile is left alone. Derived data (facet counts, the
+change feed, the audit log) follows via the products_archiving and
+products_restored signals, in the same transaction.
+
+`view_product` falls back to `find_archived()`, so archived SKUs still
+resolve. `flask products restore SKU` moves a product back. It fails if its
+SKU or id has been taken by a live product since.
+"""
+from datetime import timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import select, insert, delete, func, literal
+
+from . import db
+from .models import (Product, ProductPrice, LocationStock, archived_products, archived_product_prices,
+                     archived_location_stock, utcnow)
+from .signals import products_archiving, products_restored
+
+# (live table, archive table, column holding the product id), the product's history first
+_MOVED = (
+    (ProductPrice.__table__, archived_product_prices, 'product_id'),
+    (LocationStock.__table__, archived_location_stock, 'product_id'),
+    (Product.__table__, archived_products, 'id'),
+)
+
+
+class ArchiveError(ValueError):
+    """Raised when an archived product can't be restored."""
+
+
+def archivable(older_than):
+    """Condition for products to archive: inactive, and not updated since `older_than`."""
+    return (Product.is_active == False) & (Product.date_updated < older_than) # noqa: E712
+
+
+def _move(live, source, target, key, ids, **extra):
+    """Move the rows of `source` whose `key` is in ids to `target`: the columns of `live`, plus `extra` values."""
+    columns = [column.name for column in live.columns]
+    condition = source.c[key].in_(ids)
+    db.session.execute(insert(target).from_select(
+        columns + list(extra), select(*(source.c[name] for name in columns), *map(literal, extra.values()))
+        .where(condition)))
+    db.session.execute(delete(source).where(condition))
+
+
+def archive_products(older_than, chunk_size=500, max_chunks=None):
+    """Archive products matching `archivable(older_than)`, one transaction per chunk. Returns how many."""
+    archived = chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        try:
+            ids = db.session.scalars(select(Product.id).where(archivable(older_than))
+                                     .order_by(Product.id).limit(chunk_size).with_for_update()).all()
+            if not ids:
+                db.session.rollback()
+                break
+            products_archiving.send(current_app._get_current_object(), session=db.session, ids=ids)
+            now = utcnow()
+            for live, archive, key in _MOVED:
+                extra = {'archived_at': now} if archive is archived_products else {}
+                _move(live, live, archive, key, ids, **extra)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        archived += len(ids)
+        chunks += 1
+    return archived
+
+
+def find_archived(sku):
+    """The most recently archived product with this SKU (case-insensitive), as a row, or None."""
+    return db.session.execute(select(archived_products).where(func.lower(archived_products.c.sku) == sku.lower())
+                              .order_by(archived_products.c.archived_at.desc()).limit(1)).first()
+
+
+def restore_product(sku):
+    """Move an archived product back into `products`. Returns its id; it stays inactive until edited."""
+    row = find_archived(sku)
+    if row is None:
+        raise ArchiveError(f'No archived product with SKU {sku}')
+    taken = db.session.scalar(select(Product.sku).where((Product.id == row.id)
+                                                        | (func.lower(Product.sku) == row.sku.lower())))
+    if taken is not None:
+        raise ArchiveError(f'Cannot restore {row.sku}: product {taken} now has its SKU or id {row.id}')
+    try:
+        for live, archive, key in reversed(_MOVED): # The product first, then its history
+            _move(live, archive, live, key, [row.id])
+        # A fresh date_updated keeps it from being archived again right away, and refreshes cached fragments
+        db.session.execute(Product.__table__.update().where(Product.id == row.id).values(date_updated=utcnow()))
+        products_restored.send(current_app._get_current_object(), session=db.session, ids=[row.id])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return row.id
+
+
+def archive_stats():
+    """(live products, archived products)."""
+    return (db.session.scalar(select(func.count()).select_from(Product)),
+            db.session.scalar(select(func.count()).select_from(archived_products)))
+
+
+# --- CLI -----------------------------------------------------------------------
+
+@click.command('archive')
+@click.option('--older-than-days', type=int, default=None,
+              help='Archive products inactive and unchanged for this long (default: ARCHIVE_AFTER_DAYS).')
+@click.option('--chunk-size', type=int, default=500, show_default=True, help='Products per transaction.')
+@click.option('--max-chunks', type=int, default=None, help='Stop after this many chunks.')
+@click.option('--dry-run', is_flag=True, help='Only count the products that would be archived.')
+def archive_command(older_than_days, chunk_size, max_chunks, dry_run):
+    """Move long-inactive products and their history to the archive tables."""
+    days = current_app.config['ARCHIVE_AFTER_DAYS'] if older_than_days is None else older_than_days
+    older_than = utcnow() - timedelta(days=days)
+    if dry_run:
+        count = db.session.scalar(select(func.count()).select_from(Product).where(archivable(older_than)))
+        click.echo(f'{count} products would be archived.')
+        return
+    archived = archive_products(older_than, chunk_size, max_chunks)
+    live, total_archived = archive_stats()
+    click.echo(f'Archived {archived} products ({live} live, {total_archived} archived).')
+
+
+@click.command('restore')
+@click.argument('sku')
+def restore_command(sku):
+    """Bring an archived product back (inactive) with its history."""
+    try:
+        restore_product(sku)
+    except ArchiveError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Restored {sku}; it is inactive until edited.')
+
+
+def init_app(app):
+    app.config.setdefault('ARCHIVE_AFTER_DAYS', 365) # Inactive and unchanged for this long
@@ -0,0 +1,186 @@
+"""Async product read API, served over ASGI.
+
+The Flask views run under sync gunicorn workers, where a worker waiting on
+the database can't serve anyone else. The endpoints here run on an event
+loop with SQLAlchemy's async engine (aiosqlite / asyncpg), so one process
+keeps many slow requests in flight:
+
+    GET  /api/async/products?after=&limit=&category=&active=
+    GET  /api/async/products/<sku>
+    POST /api/async/products/lookup   {"skus": [...]}
+
+They return the same JSON as the sync /api/products endpoints (both use
+app/product_reads.py) and accept the same login: the Flask session cookie is
+verified with the app's secret key. Serve asgi.py with an async worker, e.g.
+`gunicorn -k uvicorn.workers.UvicornWorker asgi:application`, and route
+/api/async/ to it next to the sync workers.
+"""
+import json
+from urllib.parse import parse_qs, unquote
+
+from itsdangerous import BadSignature
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from .models import User
+from .product_reads import (ProductQueryError, product_page_query, product_by_sku_query, sku_lookup_query,
+                            product_dict, page_result, lookup_result)
+
+PREFIX = '/api/async'
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+MAX_BODY_SIZE = 1024 * 1024
+
+
+def async_database_url(url):
+    """The async-driver equivalent of a sync database URL."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver configured for {backend!r} databases')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncAPI:
+    """ASGI application for the /api/async endpoints of `flask_app`."""
+
+    def __init__(self, flask_app):
+        config = flask_app.config
+        self.flask_app = flask_app
+        self.url = config['ASYNC_DATABASE_URL'] or async_database_url(config['SQLALCHEMY_DATABASE_URI'])
+        self.engine_options = {}
+        if make_url(self.url).database not in (None, '', ':memory:'):
+            self.engine_options = {'pool_size': config['ASYNC_DB_POOL_SIZE'],
+                                   'max_overflow': config['ASYNC_DB_MAX_OVERFLOW']}
+        self.engine = None
+        self.routes = [
+            ('GET', ('products',), self.list_products),
+            ('POST', ('products', 'lookup'), self.lookup_products),
+            ('GET', ('products', None), self.get_product),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.handle(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.get_engine()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def get_engine(self):
+        # Created lazily so the engine's pool belongs to the serving event loop
+        if self.engine is None:
+            self.engine = create_async_engine(self.url, **self.engine_options)
+        return self.engine
+
+    async def dispose(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+
+    async def handle(self, scope, receive, send):
+        try:
+            handler, args = self.match(scope['method'], scope['path'])
+            async with self.get_engine().connect() as connection:
+                await self.authenticate(connection, scope)
+                status, body = await handler(connection, scope, receive, *args)
+        except HTTPError as e:
+            status, body = e.status, {'error': str(e)}
+        except ProductQueryError as e:
+            status, body = 400, {'error': str(e)}
+        await send_json(send, status, body)
+
+    def match(self, method, path):
+        if not path.startswith(PREFIX + '/'):
+            raise HTTPError(404, 'Not found')
+        parts = tuple(unquote(part) for part in path[len(PREFIX) + 1:].strip('/').split('/'))
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            if len(pattern) == len(parts) and all(p is None or p == part for p, part in zip(pattern, parts)):
+                if route_method == method:
+                    return handler, [part for p, part in zip(pattern, parts) if p is None]
+                allowed = True
+        raise HTTPError(405 if allowed else 404, 'Method not allowed' if allowed else 'Not found')
+
+    async def authenticate(self, connection, scope):
+        """Accept the Flask session cookie of a logged-in user, as @login_required would."""
+        app = self.flask_app
+        cookie = request_cookies(scope).get(app.config['SESSION_COOKIE_NAME'])
+        serializer = app.session_interface.get_signing_serializer(app)
+        try:
+            session = serializer.loads(cookie, max_age=int(app.permanent_session_lifetime.total_seconds()))
+        except (BadSignature, TypeError):
+            session = {}
+        user_id = session.get('_user_id')
+        if user_id is None or not str(user_id).isdigit() or await connection.scalar(
+                select(User.id).where(User.id == int(user_id))) is None:
+            raise HTTPError(401, 'Login required')
+
+    async def list_products(self, connection, scope, receive):
+        args = {key: values[0] for key, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+        statement = product_page_query(after_id=args.get('after'), limit=args.get('limit'),
+                                       category=args.get('category'), active=args.get('active'))
+        return 200, page_result(await connection.execute(statement))
+
+    async def get_product(self, connection, scope, receive, sku):
+        row = (await connection.execute(product_by_sku_query(sku))).first()
+        if row is None:
+            raise HTTPError(404, 'Product not found')
+        return 200, {'product': product_dict(row)}
+
+    async def lookup_products(self, connection, scope, receive):
+        try:
+            data = json.loads(await read_body(receive) or b'{}')
+        except ValueError:
+            raise HTTPError(400, 'Request body must be JSON')
+        skus = data.get('skus') if isinstance(data, dict) else None
+        rows = await connection.execute(sku_lookup_query(skus))
+        return 200, lookup_result(skus, rows)
+
+
+def request_cookies(scope):
+    cookies = {}
+    for name, value in scope.get('headers', ()):
+        if name == b'cookie':
+            for pair in value.decode('latin-1').split(';'):
+                key, _, val = pair.strip().partition('=')
+                cookies[key] = val
+    return cookies
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_SIZE:
+            raise HTTPError(413, 'Request body too large')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_json(send, status, body):
+    payload = json.dumps(body, separators=(',', ':'), default=str).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(payload)).encode())]})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+def create_asgi_app(flask_app):
+    return AsyncAPI(flask_app)
@@ -0,0 +1,350 @@
+"""Append-only audit log of product changes.
+
+Field-level diffs are captured from flush events, held on the session until
+the transaction commits (a rollback discards them) and then handed to an
+AuditWriter. The writer buffers them in a bounded queue and a background
+thread inserts them in batches, so auditing adds no statements to the
+request's own transaction.
+
+Rows go to monthly tables (audit_log_YYYYMM), created on first use. Old
+months can be archived or dropped as a whole instead of deleting rows, and
+each month stays small enough for its (sku, ts) / (user_id, ts) indexes to
+be cheap to maintain. SKUs are stored lower-cased, so filtering by one is
+case-insensitive and still uses the index.
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+from datetime import timedelta
+from decimal import Decimal
+
+from flask import current_app, has_request_context
+from flask_login import current_user
+from sqlalchemy import (MetaData, Table, Column, Index, BigInteger, Integer, String, Text, DateTime,
+                        event, inspect, select, union_all)
+
+from . import db
+from .models import Product, utcnow
+from .signals import products_bulk_updating, products_bulk_updated, products_archiving, products_restored
+from .tracking import track_old_values, committed_value
+
+AUDITED_FIELDS = ('sku', 'name', 'description', 'price', 'category', 'image_url', 'stock_quantity',
+                  'is_active')
+CREATE, UPDATE, DELETE, ARCHIVE, RESTORE = 'C', 'U', 'D', 'A', 'R'
+
+# Partitions are not part of db.metadata: they are created at runtime and
+# migrations/env.py keeps autogenerate from trying to drop them
+audit_metadata = MetaData()
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def partition_name(ts):
+    return f'audit_log_{ts:%Y%m}'
+
+
+def audit_table(name):
+    with _tables_lock:
+        table = _tables.get(name)
+        if table is None:
+            table = Table(
+                name, audit_metadata,
+                Column('id', BigInteger().with_variant(Integer, 'sqlite'), primary_key=True),
+                Column('ts', DateTime, nullable=False),
+                Column('user_id', Integer), # No FK: entries must outlive deleted users
+                Column('product_id', Integer),
+                Column('sku', String(80), nullable=False),
+                Column('op', String(1), nullable=False), # C / U / D / A (archived) / R (restored)
+                Column('changes', Text, nullable=False), # {"field": [old, new]}; compact JSON
+                Index(f'ix_{name}_sku_ts', 'sku', 'ts'),
+                Index(f'ix_{name}_user_id_ts', 'user_id', 'ts'),
+                Index(f'ix_{name}_ts', 'ts'),
+            )
+            _tables[name] = table
+        return table
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _encode(changes):
+    return json.dumps(changes, separators=(',', ':'), default=str)
+
+
+def _current_user_id():
+    if has_request_context() and current_user and current_user.is_authenticated:
+        return current_user.id
+    return None
+
+
+# --- Capture -----------------------------------------------------------------
+
+track_old_values(Product, AUDITED_FIELDS)
+
+
+@event.listens_for(db.session, 'before_flush')
+def _capture_changes(session, flush_context, instances):
+    pending = session.info.setdefault('audit_pending', [])
+    now = utcnow()
+    user_id = _current_user_id()
+    for obj in session.new:
+        if isinstance(obj, Product):
+            changes = {f: [None, _json_value(getattr(obj, f))] for f in AUDITED_FIELDS
+                       if getattr(obj, f) is not None}
+            pending.append([now, user_id, obj, obj.sku, CREATE, changes])
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            changes = {f: [_json_value(committed_value(obj, f)), None] for f in AUDITED_FIELDS}
+            pending.append([now, user_id, obj.id, committed_value(obj, 'sku'), DELETE, changes])
+    for obj in session.dirty:
+        if isinstance(obj, Product) and obj not in session.deleted:
+            state = inspect(obj)
+            changes = {}
+            for f in AUDITED_FIELDS:
+                if state.attrs[f].history.has_changes():
+                    old, new = _json_value(committed_value(obj, f)), _json_value(getattr(obj, f))
+                    if old != new:
+                        changes[f] = [old, new]
+            if changes:
+                pending.append([now, user_id, obj.id, obj.sku, UPDATE, changes])
+
+
+@event.listens_for(db.session, 'after_flush')
+def _resolve_new_ids(session, flush_context):
+    # Primary keys of inserted products are known once the flush has run
+    for entry in session.info.get('audit_pending', ()):
+        if isinstance(entry[2], Product):
+            entry[2] = entry[2].id
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_changes(session):
+    pending = session.info.pop('audit_pending', None)
+    if pending:
+        writer = current_app.extensions.get('audit')
+        if writer is not None:
+            writer.put_many(tuple(entry) for entry in pending)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    session.info.pop('audit_pending', None)
+
+
+@products_bulk_updating.connect
+def _before_bulk_update(sender, session, ids, fields, **kwargs):
+    fields = [f for f in fields if f in AUDITED_FIELDS]
+    if fields:
+        rows = session.execute(select(Product.id, *(getattr(Product, f) for f in fields))
+                               .where(Product.id.in_(ids)))
+        session.info['audit_bulk_before'] = {row[0]: row[1:] for row in rows}
+
+
+@products_bulk_updated.connect
+def _after_bulk_update(sender, session, ids, fields, **kwargs):
+    before = session.info.pop('audit_bulk_before', None)
+    if not before:
+        return
+    fields = [f for f in fields if f in AUDITED_FIELDS]
+    pending = session.info.setdefault('audit_pending', [])
+    now = utcnow()
+    user_id = _current_user_id()
+    rows = session.execute(select(Product.id, Product.sku, *(getattr(Product, f) for f in fields))
+                           .where(Product.id.in_(ids)))
+    for row in rows:
+        old_values = before.get(row[0], ())
+        changes = {f: [_json_value(old), _json_value(new)]
+                   for f, old, new in zip(fields, old_values, row[2:]) if old != new}
+        if changes:
+            pending.append([now, user_id, row[0], row[1], UPDATE, changes])
+
+
+def _note_moves(session, ids, op):
+    pending = session.info.setdefault('audit_pending', [])
+    now = utcnow()
+    user_id = _current_user_id()
+    for product_id, sku in session.execute(select(Product.id, Product.sku).where(Product.id.in_(ids))):
+        pending.append([now, user_id, product_id, sku, op, {}])
+
+
+@products_archiving.connect
+def _before_archive(sender, session, ids, **kwargs):
+    _note_moves(session, ids, ARCHIVE)
+
+
+@products_restored.connect
+def _after_restore(sender, session, ids, **kwargs):
+    _note_moves(session, ids, RESTORE)
+
+
+# --- Writing -----------------------------------------------------------------
+
+class AuditWriter:
+    """Bounded queue of audit entries drained in batches by a daemon thread.
+
+    When the queue is full the committing thread writes a batch itself, so a
+    slow database applies back-pressure instead of losing audit entries.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.batch_size = app.config['AUDIT_BATCH_SIZE']
+        self.flush_interval = app.config['AUDIT_FLUSH_INTERVAL']
+        self.background = app.config['AUDIT_BACKGROUND_WRITER']
+        self.queue = queue.Queue(maxsize=app.config['AUDIT_QUEUE_SIZE'])
+        self._write_lock = threading.Lock()
+        self._known_tables = set()
+        self._thread = None
+        self._pid = None
+        self._engine = None
+        self._stopping = threading.Event()
+        self.written = 0
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self.app.app_context():
+                self._engine = db.engine
+        return self._engine
+
+    def put_many(self, entries):
+        self._ensure_thread()
+        for entry in entries:
+            try:
+                self.queue.put_nowait(entry)
+            except queue.Full:
+                self.flush(max_batches=1) # Back-pressure: write one batch inline
+                self.queue.put_nowait(entry)
+
+    def _ensure_thread(self):
+        if not self.background:
+            return
+        if self._thread is None or self._pid != os.getpid(): # (Re)start after a fork
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception:
+                self.app.logger.exception('Failed to write %d audit entries', len(batch))
+
+    def stop(self, timeout=5):
+        """Stop the thread and write whatever is still queued."""
+        self._stopping.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+        self.flush()
+
+    def flush(self, max_batches=None):
+        """Write queued entries from the calling thread. Returns the number written."""
+        written = batches = 0
+        while max_batches is None or batches < max_batches:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                break
+            self._write(batch)
+            written += len(batch)
+            batches += 1
+        return written
+
+    def _write(self, batch):
+        by_partition = {}
+        for ts, user_id, product_id, sku, op, changes in batch:
+            by_partition.setdefault(partition_name(ts), []).append({
+                'ts': ts, 'user_id': user_id, 'product_id': product_id, 'sku': sku.lower(), 'op': op,
+                'changes': _encode(changes)})
+        with self._write_lock:
+            engine = self.engine
+            with engine.begin() as conn:
+                for name, rows in by_partition.items():
+                    table = audit_table(name)
+                    if name not in self._known_tables:
+                        table.create(conn, checkfirst=True)
+                        self._known_tables.add(name)
+                    conn.execute(table.insert(), rows)
+            self.written += len(batch)
+
+    def has_partition(self, name):
+        """Whether partition `name` exists. Known ones are remembered, so readers don't inspect the schema each time.
+
+        A partition dropped by hand stays known until the process restarts.
+        """
+        if name not in self._known_tables:
+            if not inspect(self.engine).has_table(name):
+                return False
+            self._known_tables.add(name)
+        return True
+
+
+def init_app(app):
+    app.config.setdefault('AUDIT_BACKGROUND_WRITER', True)
+    app.config.setdefault('AUDIT_QUEUE_SIZE', 10000)
+    app.config.setdefault('AUDIT_BATCH_SIZE', 500)
+    app.config.setdefault('AUDIT_FLUSH_INTERVAL', 1.0) # Seconds the writer waits for a batch to fill
+    app.extensions['audit'] = AuditWriter(app)
+
+
+# --- Querying ----------------------------------------------------------------
+
+def _months(since, until):
+    month = since.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while month <= until:
+        yield month
+        month = (month + timedelta(days=32)).replace(day=1)
+
+
+def query_audit_log(sku=None, user_id=None, since=None, until=None, limit=100):
+    """Newest-first audit entries, reading only the partitions covering [since, until]."""
+    until = until or utcnow()
+    since = since or until - timedelta(days=30)
+    writer = current_app.extensions['audit']
+    selects = []
+    for month in _months(since, until):
+        name = partition_name(month)
+        if not writer.has_partition(name):
+            continue
+        table = audit_table(name)
+        query = select(table).where(table.c.ts >= since, table.c.ts <= until)
+        if sku is not None:
+            query = query.where(table.c.sku == sku.lower()) # Stored lower-cased, like every SKU lookup
+        if user_id is not None:
+            query = query.where(table.c.user_id == user_id)
+        selects.append(query.order_by(table.c.ts.desc()).limit(limit))
+    if not selects:
+        return []
+    combined = selects[0] if len(selects) == 1 else union_all(*(q.subquery().select() for q in selects))
+    combined = combined.subquery()
+    rows = db.session.execute(select(combined).order_by(combined.c.ts.desc(), combined.c.id.desc()).limit(limit))
+    return [{
+        'ts': row.ts.isoformat(),
+        'user_id': row.user_id,
+        'product_id': row.product_id,
+        'sku': row.sku,
+        'op': {CREATE: 'create', UPDATE: 'update', DELETE: 'delete', ARCHIVE: 'archive', RESTORE: 'restore'}[row.op],
+        'changes': json.loads(row.changes),
+    } for row in rows]
@@ -1,5 +1,7 @@
 from flask import Blueprint
+from ..user_import import import_users_command
 
 auth = Blueprint('auth', __name__)
+auth.cli.add_command(import_users_command) # flask auth import-users users.csv
 
 from . import routes 
\ No newline at end of file
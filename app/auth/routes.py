@@ -1,7 +1,7 @@
-from flask import render_template, redirect, url_for, flash, request
+from flask import render_template, redirect, url_for, flash, request, make_response
 from flask_login import login_user, logout_user, login_required, current_user
 from urllib.parse import urlparse
-from app import db
+from app import db, login_limiter
 from app.auth import auth
 from app.models import User
 from app.auth.forms import LoginForm
@@ -13,11 +13,24 @@ def login():
     
     form = LoginForm()
     if form.validate_on_submit():
+        # Reject throttled clients before touching the database or hashing anything
+        if login_limiter.is_limited(request.remote_addr, form.username.data):
+            flash('Too many failed login attempts. Please try again later.', 'error')
+            response = make_response(render_template('auth/login.html', title='Login', form=form), 429)
+            response.headers['Retry-After'] = str(login_limiter.retry_after())
+            return response
+
         user = User.query.filter_by(username=form.username.data).first()
-        if user is None or not user.check_password(form.password.data):
+        if user is None:
+            valid = User.check_dummy_password(form.password.data) # Keep timing uniform
+        else:
+            valid = user.check_password(form.password.data)
+        if not valid:
+            login_limiter.register_failure(request.remote_addr, form.username.data)
             flash('Invalid username or password', 'error')
             return render_template('auth/login.html', title='Login', form=form)
         
+        login_limiter.register_success(form.username.data)
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get('next')
         if not next_page or urlparse(next_page).netloc != '':
@@ -0,0 +1,284 @@
+"""Online backfills: filling in existing rows in small batches instead of one big UPDATE.
+
+A schema migration that adds a column should only add it (nullable, or with a
+cheap default) so `flask db upgrade` holds its lock for milliseconds. The
+data is filled in afterwards by a backfill registered here, while the app
+keeps serving. The app's own write path must set the new value for rows it
+writes from then on; the backfill covers the rows that already exist.
+
+    @backfill('products.sku_normalized', Product.__table__)
+    def sku_normalized(start_id, end_id):
+        return db.session.execute(
+            update(Product).where(Product.id.between(start_id, end_id), Product.sku_normalized.is_(None))
+            .values(sku_normalized=func.lower(Product.sku))).rowcount
+
+    flask db upgrade && flask backfill run --pending
+
+`flask backfill run` walks the table by primary key range. Each batch is one
+short transaction that updates the rows with start_id <= id <= end_id and
+moves the checkpoint in backfill_progress, so a batch and its checkpoint
+commit together and a stopped or crashed run resumes after the last
+committed batch. Batches are sized to take about BACKFILL_TARGET_BATCH_SECONDS
+(halved when slower, doubled when much faster) and separated by
+BACKFILL_PAUSE seconds, which keeps each write lock short and leaves the
+database room for the app's own reads and writes.
+"""
+import os
+import signal
+import socket
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, func
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import BackfillProgress, utcnow
+
+_backfills = {}
+
+
+class UnknownBackfill(LookupError):
+    """Raised for a backfill name that isn't registered."""
+
+
+class BackfillBusy(RuntimeError):
+    """Raised when another runner holds the backfill (its heartbeat is recent)."""
+
+
+def backfill(name, table, description=None):
+    """Register `func(start_id, end_id)` as backfill `name` over `table`.
+
+    The function updates the rows of `table` whose integer primary key is
+    between start_id and end_id (inclusive) and returns how many it changed.
+    It must be idempotent: a batch interrupted before its commit is run again.
+    """
+    primary_key = list(table.primary_key.columns)
+    if len(primary_key) != 1:
+        raise ValueError(f'Backfill {name!r}: {table.name} needs a single-column primary key')
+
+    def decorator(func):
+        _backfills[name] = (func, primary_key[0], description or (func.__doc__ or '').strip().split('\n')[0])
+        return func
+    return decorator
+
+
+class BackfillRunner:
+    def __init__(self, app, name, batch_size=None, pause=None, target_seconds=None, max_batch_size=None):
+        if name not in _backfills:
+            raise UnknownBackfill(name)
+        config = app.config
+        self.app = app
+        self.name = name
+        self.func, self.primary_key, self.description = _backfills[name]
+        self.batch_size = batch_size or config['BACKFILL_BATCH_SIZE']
+        self.max_batch_size = max(max_batch_size or config['BACKFILL_MAX_BATCH_SIZE'], self.batch_size)
+        self.pause = config['BACKFILL_PAUSE'] if pause is None else pause
+        self.target_seconds = target_seconds or config['BACKFILL_TARGET_BATCH_SECONDS']
+        self.token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._stopping = False
+        self.stats = {'batches': 0, 'rows': 0, 'slowest': 0.0}
+
+    def stop(self, *args):
+        """Finish the current batch, then pause the backfill (it resumes on the next run)."""
+        self._stopping = True
+
+    def _progress_filter(self):
+        return (BackfillProgress.name == self.name) & (BackfillProgress.locked_by == self.token)
+
+    def claim(self, restart=False):
+        """Take the backfill for this runner. Returns False if it is already done."""
+        try:
+            db.session.execute(BackfillProgress.__table__.insert().values(name=self.name, status='pending',
+                                                                            last_id=0, batches=0, rows_updated=0))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+        now = utcnow()
+        stale = now - timedelta(seconds=self.app.config['BACKFILL_LOCK_TIMEOUT'])
+        values = {'status': 'running', 'locked_by': self.token, 'heartbeat_at': now, 'last_error': None,
+                  'started_at': func.coalesce(BackfillProgress.started_at, now),
+                  # Rows added since the previous run are written by the app's code, but cover them anyway
+                  'max_id': select(func.max(self.primary_key)).scalar_subquery()}
+        claimable = [BackfillProgress.name == self.name,
+                     (BackfillProgress.status != 'running') | (BackfillProgress.heartbeat_at < stale)]
+        if restart:
+            values.update(last_id=0, batches=0, rows_updated=0, started_at=now, completed_at=None)
+        else:
+            claimable.append(BackfillProgress.status != 'done')
+        claimed = db.session.execute(update(BackfillProgress).where(*claimable).values(**values)
+                                     .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        if not claimed:
+            status = db.session.scalar(select(BackfillProgress.status).where(BackfillProgress.name == self.name))
+            if status == 'done':
+                return False
+            raise BackfillBusy(self.name)
+        return True
+
+    def progress(self):
+        return db.session.get(BackfillProgress, self.name, populate_existing=True)
+
+    def next_range(self, last_id, max_id):
+        """(start_id, end_id) of the next batch_size rows after last_id, or None when finished."""
+        if max_id is None or last_id >= max_id:
+            return None
+        rows = (select(self.primary_key).where(self.primary_key > last_id)
+                .order_by(self.primary_key).offset(self.batch_size - 1).limit(1))
+        end_id = db.session.scalar(rows) # Seeks the primary key index; never scans the batch
+        return last_id + 1, min(end_id if end_id is not None else max_id, max_id)
+
+    def run_batch(self, last_id, max_id):
+        """Backfill and checkpoint one batch in one transaction. Returns the new last_id, or None when done."""
+        batch = self.next_range(last_id, max_id)
+        if batch is None:
+            return None
+        started = time.perf_counter()
+        rows = self.func(*batch) or 0
+        checkpoint = db.session.execute(
+            update(BackfillProgress).where(self._progress_filter())
+            .values(last_id=batch[1], batches=BackfillProgress.batches + 1,
+                    rows_updated=BackfillProgress.rows_updated + rows, heartbeat_at=utcnow())
+            .execution_options(synchronize_session=False))
+        if checkpoint.rowcount != 1: # Another runner took over after our heartbeat went stale
+            db.session.rollback()
+            raise BackfillBusy(self.name)
+        db.session.commit()
+        elapsed = time.perf_counter() - started
+        self.stats['batches'] += 1
+        self.stats['rows'] += rows
+        self.stats['slowest'] = max(self.stats['slowest'], elapsed)
+        if elapsed > self.target_seconds:
+            self.batch_size = max(self.batch_size // 2, 1)
+        elif elapsed < self.target_seconds / 2:
+            self.batch_size = min(self.batch_size * 2, self.max_batch_size)
+        return batch[1]
+
+    def _finish(self, status, error=None):
+        values = {'status': status, 'locked_by': None, 'heartbeat_at': utcnow()}
+        if status == 'done':
+            values['completed_at'] = utcnow()
+        if error is not None:
+            values['last_error'] = error[-4000:]
+        db.session.execute(update(BackfillProgress).where(self._progress_filter()).values(**values)
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+
+    def run(self, max_batches=None, restart=False, progress=None):
+        """Run until done, stopped, or max_batches. Returns the final BackfillProgress."""
+        if not self.claim(restart=restart):
+            return self.progress()
+        state = self.progress()
+        last_id, max_id = state.last_id, state.max_id
+        try:
+            while True:
+                if self._stopping or (max_batches is not None and self.stats['batches'] >= max_batches):
+                    self._finish('paused')
+                    break
+                last_id = self.run_batch(last_id, max_id)
+                if last_id is None:
+                    self._finish('done')
+                    break
+                if progress is not None:
+                    progress(self, last_id, max_id)
+                if self.pause:
+                    time.sleep(self.pause)
+        except BackfillBusy:
+            raise
+        except Exception:
+            db.session.rollback()
+            self._finish('failed', traceback.format_exc())
+            self.app.logger.exception('Backfill %s failed after id %s', self.name, last_id)
+            raise
+        return self.progress()
+
+
+def init_app(app):
+    app.config.setdefault('BACKFILL_BATCH_SIZE', 1000) # Rows in the first batch
+    app.config.setdefault('BACKFILL_MAX_BATCH_SIZE', 20000)
+    app.config.setdefault('BACKFILL_TARGET_BATCH_SECONDS', 0.25) # Batch size adapts to stay near this
+    app.config.setdefault('BACKFILL_PAUSE', 0.05) # Seconds between batches, for the app's own queries
+    app.config.setdefault('BACKFILL_LOCK_TIMEOUT', 300) # Seconds without a heartbeat before a run counts as dead
+    app.cli.add_command(backfill_cli)
+
+
+@click.group('backfill')
+def backfill_cli():
+    """Run and inspect online backfills."""
+
+
+@backfill_cli.command('list')
+@with_appcontext
+def backfill_list():
+    """Show every registered backfill and how far it got."""
+    states = {p.name: p for p in db.session.scalars(select(BackfillProgress))}
+    for name, (_, primary_key, description) in sorted(_backfills.items()):
+        state = states.get(name)
+        if state is None:
+            click.echo(f'{name:32} {"pending":8} {primary_key.table.name}: {description}')
+            continue
+        done = f'{state.last_id}/{state.max_id or 0}' + (
+            f' ({100 * state.last_id / state.max_id:.0f}%)' if state.max_id else '')
+        click.echo(f'{name:32} {state.status:8} {done}, {state.rows_updated} rows in {state.batches} batches')
+        if state.status == 'failed' and state.last_error:
+            click.echo('    ' + state.last_error.strip().splitlines()[-1])
+
+
+@backfill_cli.command('run')
+@click.argument('names', nargs=-1)
+@click.option('--pending', is_flag=True, help='Run every registered backfill that is not done.')
+@click.option('--batch-size', type=int, default=None, help='Rows in the first batch (adapts from there).')
+@click.option('--pause', type=float, default=None, help='Seconds to sleep between batches.')
+@click.option('--max-batches', type=int, default=None, help='Stop (resumably) after this many batches.')
+@click.option('--restart', is_flag=True, help='Start over from the first row, even if done.')
+@with_appcontext
+def backfill_run(names, pending, batch_size, pause, max_batches, restart):
+    """Run backfills, resuming from their last checkpoint."""
+    if pending:
+        done = set(db.session.scalars(select(BackfillProgress.name).where(BackfillProgress.status == 'done')))
+        names = [name for name in sorted(_backfills) if name not in done]
+    if not names:
+        click.echo('Nothing to backfill.' if pending else 'Name a backfill, or pass --pending.')
+        return
+    unknown = [name for name in names if name not in _backfills]
+    if unknown:
+        raise click.UsageError(f"Unknown backfill(s): {', '.join(unknown)}")
+    app = current_app._get_current_object()
+    reported = [time.monotonic()]
+
+    def report(runner, last_id, max_id):
+        if time.monotonic() - reported[0] >= 5:
+            reported[0] = time.monotonic()
+            click.echo(f'{runner.name}: {last_id}/{max_id}, {runner.stats["rows"]} rows, '
+                       f'batch size {runner.batch_size}')
+
+    for name in names:
+        runner = BackfillRunner(app, name, batch_size=batch_size, pause=pause)
+        handlers = {sig: signal.signal(sig, runner.stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+        started = time.monotonic()
+        try:
+            state = runner.run(max_batches=max_batches, restart=restart, progress=report)
+        except BackfillBusy:
+            raise click.ClickException(f'{name} is being run by another process.')
+        finally:
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+        click.echo(f'{name}: {state.status}, {runner.stats["rows"]} rows in {runner.stats["batches"]} batches '
+                   f'({time.monotonic() - started:.1f}s, slowest batch {runner.stats["slowest"] * 1000:.0f} ms).')
+        if state.status == 'paused' and runner._stopping:
+            break
+
+
+@backfill_cli.command('reset')
+@click.argument('name')
+@with_appcontext
+def backfill_reset(name):
+    """Forget a backfill's progress so it runs again from the start."""
+    deleted = db.session.execute(BackfillProgress.__table__.delete().where(BackfillProgress.name == name)).rowcount
+    db.session.commit()
+    click.echo(f'{name}: progress cleared.' if deleted else f'{name}: no progress recorded.')
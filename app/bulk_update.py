@@ -0,0 +1,272 @@
+"""Set-based bulk updates for product prices and attributes.
+
+A BulkUpdate describes one change (field + operation + value) and the products
+it applies to (a category / is_active filter, a list of SKUs, or both). It is
+executed as plain UPDATE statements over chunks of primary keys, committing
+after every chunk, so a large change never holds one long transaction.
+"""
+import time
+from decimal import Decimal, InvalidOperation
+
+import click
+from sqlalchemy import select, update, func, cast, Integer
+
+from . import db
+from .models import Product
+from .signals import products_bulk_updating, products_bulk_updated
+
+FIELDS = ('price', 'stock_quantity', 'is_active', 'category')
+OPERATIONS = ('set', 'percent', 'delta')
+NUMERIC_FIELDS = ('price', 'stock_quantity')
+
+
+class BulkUpdateError(ValueError):
+    """Raised for an invalid bulk update specification."""
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in ('1', 'true', 'yes', 'y', 'on'):
+        return True
+    if str(value).strip().lower() in ('0', 'false', 'no', 'n', 'off'):
+        return False
+    raise BulkUpdateError(f'Invalid boolean value: {value!r}')
+
+
+def read_sku_file(stream):
+    """Read SKUs from an uploaded file: one per line, or the first CSV column."""
+    skus = []
+    for raw in stream:
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8')
+        sku = raw.split(',')[0].strip()
+        if sku and sku.lower() != 'sku': # Skip blank lines and a header row
+            skus.append(sku)
+    return skus
+
+
+class BulkUpdate:
+    def __init__(self, field, operation, value, category=None, is_active=None, skus=None,
+                 chunk_size=500):
+        if field not in FIELDS:
+            raise BulkUpdateError(f'Field must be one of: {", ".join(FIELDS)}')
+        if operation not in OPERATIONS:
+            raise BulkUpdateError(f'Operation must be one of: {", ".join(OPERATIONS)}')
+        if operation != 'set' and field not in NUMERIC_FIELDS:
+            raise BulkUpdateError(f"Only 'set' is supported for {field}")
+        if chunk_size < 1:
+            raise BulkUpdateError('Chunk size must be positive')
+
+        self.field = field
+        self.operation = operation
+        self.value = self._coerce(value)
+        self.category = category
+        self.is_active = None if is_active is None else _parse_bool(is_active)
+        # Normalize and de-duplicate while keeping the uploaded order
+        self.skus = None if skus is None else list(dict.fromkeys(s.strip().lower() for s in skus if s.strip()))
+        self.chunk_size = chunk_size
+
+    def _coerce(self, value):
+        try:
+            if self.field == 'is_active':
+                return _parse_bool(value)
+            if self.field == 'category':
+                return (str(value).strip() or None) if value is not None else None
+            if self.field == 'stock_quantity' and self.operation != 'percent':
+                return int(value)
+            return Decimal(str(value))
+        except (InvalidOperation, TypeError, ValueError):
+            raise BulkUpdateError(f'Invalid value for {self.field}: {value!r}')
+
+    @property
+    def column(self):
+        return getattr(Product, self.field)
+
+    def new_value_expression(self):
+        """SQL expression computing the new value from the current row."""
+        column = self.column
+        if self.operation == 'set':
+            return self.value
+        if self.operation == 'delta':
+            return column + self.value
+        # percent
+        factor = (Decimal(100) + self.value) / Decimal(100)
+        if self.field == 'price':
+            return func.round(column * factor, 2, type_=Product.price.type)
+        return cast(func.round(column * factor), Integer)
+
+    def _valid_condition(self):
+        """Rows whose new value would break a CHECK constraint are skipped, not failed."""
+        if self.field in NUMERIC_FIELDS and self.operation != 'set':
+            return self.new_value_expression() >= 0
+        return None
+
+    def _filters(self):
+        filters = []
+        if self.category is not None:
+            filters.append(Product.category == self.category)
+        if self.is_active is not None:
+            filters.append(Product.is_active == self.is_active)
+        return filters
+
+    def validate(self):
+        if self.field in NUMERIC_FIELDS and self.operation == 'set' and self.value < 0:
+            raise BulkUpdateError(f'{self.field} cannot be negative')
+        if self.skus is None and self.category is None and self.is_active is None:
+            raise BulkUpdateError('Refusing to update every product: give a filter or a SKU list')
+
+    def id_chunks(self):
+        """Yield lists of matching product ids, at most chunk_size each."""
+        filters = self._filters()
+        if self.skus is not None:
+            for start in range(0, len(self.skus), self.chunk_size):
+                sku_chunk = self.skus[start:start + self.chunk_size]
+                ids = db.session.scalars(
+                    select(Product.id).where(func.lower(Product.sku).in_(sku_chunk), *filters)
+                    .order_by(Product.id)).all()
+                if ids:
+                    yield ids
+            return
+        # Keyset pagination over the primary key: each chunk query is an index range scan
+        last_id = 0
+        while True:
+            ids = db.session.scalars(
+                select(Product.id).where(Product.id > last_id, *filters)
+                .order_by(Product.id).limit(self.chunk_size)).all()
+            if not ids:
+                return
+            yield ids
+            last_id = ids[-1]
+
+    def count_matching(self):
+        query = select(func.count(Product.id)).where(*self._filters())
+        if self.skus is not None:
+            total = 0
+            for start in range(0, len(self.skus), self.chunk_size):
+                sku_chunk = self.skus[start:start + self.chunk_size]
+                total += db.session.scalar(query.where(func.lower(Product.sku).in_(sku_chunk)))
+            return total
+        return db.session.scalar(query)
+
+    def missing_skus(self):
+        """Uploaded SKUs that don't exist at all (ignoring the other filters)."""
+        if self.skus is None:
+            return []
+        found = set()
+        for start in range(0, len(self.skus), self.chunk_size):
+            sku_chunk = self.skus[start:start + self.chunk_size]
+            found.update(db.session.scalars(
+                select(func.lower(Product.sku)).where(func.lower(Product.sku).in_(sku_chunk))))
+        return [sku for sku in self.skus if sku not in found]
+
+    def preview(self, limit=20):
+        """Dry run: counts plus the first `limit` affected rows with old and new values."""
+        self.validate()
+        valid = self._valid_condition()
+        columns = [Product.sku, self.column.label('old')]
+        if self.operation != 'set':
+            columns.append(self.new_value_expression().label('new'))
+        if valid is not None:
+            columns.append(valid.label('valid'))
+        rows = []
+        matched = skipped = 0
+        for ids in self.id_chunks():
+            matched += len(ids)
+            if valid is not None:
+                skipped += db.session.scalar(
+                    select(func.count(Product.id)).where(Product.id.in_(ids), ~valid))
+            if len(rows) < limit:
+                result = db.session.execute(
+                    select(*columns).where(Product.id.in_(ids)).order_by(Product.id).limit(limit - len(rows)))
+                for r in result:
+                    row_skipped = valid is not None and not r.valid
+                    new = self.value if self.operation == 'set' else r.new
+                    rows.append({'sku': r.sku, 'old': r.old, 'new': None if row_skipped else new,
+                                 'skipped': row_skipped})
+        return {
+            'dry_run': True,
+            'field': self.field,
+            'operation': self.operation,
+            'matched': matched,
+            'would_update': matched - skipped,
+            'would_skip': skipped,
+            'missing_skus': self.missing_skus(),
+            'preview': rows,
+        }
+
+    def run(self, progress=None):
+        """Apply the update chunk by chunk. `progress(report)` is called after each commit."""
+        self.validate()
+        started = time.monotonic()
+        new_value = self.new_value_expression()
+        valid = self._valid_condition()
+        report = {
+            'dry_run': False,
+            'field': self.field,
+            'operation': self.operation,
+            'total': self.count_matching(),
+            'matched': 0,
+            'updated': 0,
+            'skipped': 0,
+            'chunks': 0,
+            'missing_skus': self.missing_skus(),
+        }
+        for ids in self.id_chunks():
+            statement = update(Product).where(Product.id.in_(ids))
+            if valid is not None:
+                statement = statement.where(valid)
+            # Bumping version makes edit forms opened before this change stale
+            statement = statement.values({self.field: new_value, 'version': Product.version + 1}) \
+                .execution_options(synchronize_session=False)
+            try:
+                # Let derived data (facet counts, ...) follow the change in the same transaction
+                products_bulk_updating.send(self, session=db.session, ids=ids, fields=(self.field,))
+                result = db.session.execute(statement)
+                products_bulk_updated.send(self, session=db.session, ids=ids, fields=(self.field,))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            report['chunks'] += 1
+            report['matched'] += len(ids)
+            report['updated'] += result.rowcount
+            report['skipped'] += len(ids) - result.rowcount
+            if progress is not None:
+                progress(report)
+        report['elapsed'] = round(time.monotonic() - started, 3)
+        return report
+
+
+@click.command('bulk-update')
+@click.option('--field', required=True, type=click.Choice(FIELDS))
+@click.option('--op', 'operation', default='set', show_default=True, type=click.Choice(OPERATIONS))
+@click.option('--value', required=True, help='New value, percentage, or delta.')
+@click.option('--category', default=None, help='Only products in this category.')
+@click.option('--active/--inactive', 'is_active', default=None, help='Only active / inactive products.')
+@click.option('--sku-file', type=click.File('r'), default=None, help='File with one SKU per line (or CSV).')
+@click.option('--chunk-size', default=500, show_default=True, type=int)
+@click.option('--dry-run', is_flag=True, help='Show the affected rows without changing anything.')
+def bulk_update_command(field, operation, value, category, is_active, sku_file, chunk_size, dry_run):
+    """Bulk-change a product field for a filter or a SKU list."""
+    try:
+        bulk = BulkUpdate(field, operation, value, category=category, is_active=is_active,
+                          skus=read_sku_file(sku_file) if sku_file else None, chunk_size=chunk_size)
+        if dry_run:
+            report = bulk.preview()
+            for row in report['preview']:
+                new = 'SKIPPED (would be negative)' if row['skipped'] else row['new']
+                click.echo(f"{row['sku']}: {row['old']} -> {new}")
+            click.echo(f"{report['matched']} matched, {report['would_update']} would be updated, "
+                       f"{report['would_skip']} skipped.")
+        else:
+            def progress(report):
+                click.echo(f"chunk {report['chunks']}: {report['matched']}/{report['total']} processed, "
+                           f"{report['updated']} updated")
+            report = bulk.run(progress=progress)
+            click.echo(f"Done: {report['updated']} updated, {report['skipped']} skipped "
+                       f"in {report['elapsed']}s.")
+    except BulkUpdateError as e:
+        raise click.UsageError(str(e))
+    if report['missing_skus']:
+        click.echo(f"Unknown SKUs ({len(report['missing_skus'])}): {', '.join(report['missing_skus'])}")
@@ -0,0 +1,288 @@
+"""In-process snapshot of the active catalog for read-only hot paths.
+
+Building Product instances is most of the CPU cost of the product pages and
+the product read API. With CATALOG_SNAPSHOT_ENABLED each worker keeps every
+active product as a compact __slots__ record (price in integer cents,
+date_updated in integer microseconds), indexed by id, lower-case SKU and
+category. The product list (active products), the product page and the
+/api/products reads serve active products from it and fall back to the
+database for everything else.
+
+The snapshot is loaded when the app is created, i.e. at worker start, and
+refreshed incrementally from the product change feed (app/change_feed.py):
+at most every CATALOG_SNAPSHOT_MAX_AGE seconds, and on the next read after
+this worker commits a product change. A refresh re-reads the products with
+feed entries after its cursor. Feed entries are numbered in commit order, so
+a transaction that commits late is picked up however old its date_updated
+is. A cursor older than the compacted part of the feed means a full reload.
+The active product count is still compared with the database, for rows
+deleted behind the ORM's back.
+"""
+import sys
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from flask import current_app
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from . import db
+from .change_feed import SEQUENCE
+from .models import Product, ProductChange, ChangeSequence
+from .product_reads import page_args, parse_flag
+from .signals import products_bulk_updated
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+REFRESH_CHUNK = 500 # Changed products re-read per query
+SNAPSHOT_COLUMNS = (Product.id, Product.sku, Product.name, Product.description, Product.price,
+                    Product.category, Product.image_url, Product.stock_quantity, Product.reorder_point,
+                    Product.is_low_stock, Product.is_active, Product.date_updated)
+
+
+class CatalogProduct:
+    """An active product as held by the snapshot. Read-only; has the Product attributes the views use."""
+    __slots__ = ('id', 'sku', 'name', 'description', 'price_cents', 'category', 'image_url', 'stock_quantity',
+                 'reorder_point', 'is_low_stock', 'updated_us')
+    is_active = True
+
+    def __init__(self, row):
+        self.id = row.id
+        self.sku = row.sku
+        self.name = row.name
+        self.description = row.description
+        self.price_cents = int(row.price.scaleb(2))
+        self.category = sys.intern(row.category) if row.category else row.category
+        self.image_url = row.image_url
+        self.stock_quantity = row.stock_quantity
+        self.reorder_point = row.reorder_point
+        self.is_low_stock = row.is_low_stock
+        self.updated_us = (row.date_updated - EPOCH) // MICROSECOND
+
+    @property
+    def price(self):
+        return Decimal(self.price_cents).scaleb(-2)
+
+    @property
+    def date_updated(self):
+        return EPOCH + self.updated_us * MICROSECOND
+
+    def to_dict(self):
+        """Same shape as product_reads.product_dict()."""
+        return {'id': self.id, 'sku': self.sku, 'name': self.name, 'description': self.description,
+                'price': str(self.price), 'category': self.category, 'image_url': self.image_url,
+                'stock_quantity': self.stock_quantity, 'is_active': True}
+
+    def __repr__(self):
+        return f'<CatalogProduct {self.sku}>'
+
+
+class CatalogSnapshot:
+    """Active products of one worker. Lookups need no lock; refreshes and derived orderings take one."""
+
+    def __init__(self, max_age=5):
+        self.max_age = max_age
+        self.by_id = {}
+        self.by_sku = {} # lower-case SKU -> CatalogProduct
+        self.by_category = {} # category ('' for none) -> set of ids
+        self.cursor = None # Change feed seq applied up to
+        self.refreshed_at = None # time.monotonic() of the last refresh
+        self.stale = True
+        self._orderings = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get(self, product_id):
+        return self.by_id.get(product_id)
+
+    def get_by_sku(self, sku):
+        return self.by_sku.get(sku.lower())
+
+    def lookup(self, skus):
+        """{lower-case SKU: product dict} for the SKUs found in the snapshot."""
+        found = {}
+        for sku in skus:
+            product = self.by_sku.get(sku.lower())
+            if product is not None:
+                found[product.sku.lower()] = product.to_dict()
+        return found
+
+    def by_name(self, category=None):
+        """Products ordered by name (then id), optionally of one category ('' for uncategorized)."""
+        return self._ordering(('name', category), lambda products: sorted(products, key=_name_key))
+
+    def page(self, after_id=None, limit=None, category=None):
+        """Up to `limit` products ordered by id, after `after_id`."""
+        products = self._ordering(('id', category), lambda products: sorted(products, key=_id_key))
+        start = 0 if after_id is None else bisect_right(products, after_id, key=_id_key)
+        return products[start:start + limit]
+
+    def _ordering(self, key, build):
+        ordering = self._orderings.get(key)
+        if ordering is None:
+            with self._lock:
+                category = key[1]
+                products = (self.by_id.values() if category is None
+                            else [self.by_id[i] for i in self.by_category.get(category, ())])
+                ordering = self._orderings[key] = build(products)
+        return ordering
+
+    # -- Maintenance -----------------------------------------------------------
+
+    def maybe_refresh(self):
+        if not self.stale and time.monotonic() - self.refreshed_at < self.max_age:
+            return
+        # Readers don't queue behind a running refresh, once there is something to serve
+        if self._lock.acquire(blocking=self.refreshed_at is None):
+            try:
+                self.refresh()
+            finally:
+                self._lock.release()
+
+    def refresh(self, full=False):
+        """Apply product changes since the last refresh; `full` (or a first call) reloads everything."""
+        with self._lock:
+            self.stale = False
+            self.refreshed_at = time.monotonic()
+            head = _execute(select(ChangeSequence.last_seq, ChangeSequence.compacted_seq)
+                            .where(ChangeSequence.name == SEQUENCE)).first()
+            last_seq, compacted_seq = head if head is not None else (0, 0)
+            if full or self.cursor is None or self.cursor < compacted_seq:
+                self._load(last_seq)
+                return
+            # Entries up to last_seq are all committed: the counter row is updated in the same transaction
+            ids = list(dict.fromkeys(_execute(
+                select(ProductChange.product_id).where(ProductChange.seq > self.cursor, ProductChange.seq <= last_seq)
+                .order_by(ProductChange.seq)).scalars()))
+            self.cursor = last_seq
+            changed = bool(ids)
+            for start in range(0, len(ids), REFRESH_CHUNK):
+                chunk = ids[start:start + REFRESH_CHUNK]
+                rows = {row.id: row for row in _execute(select(*SNAPSHOT_COLUMNS).where(Product.id.in_(chunk)))}
+                for product_id in chunk:
+                    row = rows.get(product_id) # None once deleted or archived
+                    self._remove(product_id)
+                    if row is not None and row.is_active:
+                        self._add(CatalogProduct(row))
+            active_count = _execute(select(func.count()).select_from(Product).where(Product.is_active)).scalar()
+            if active_count != len(self.by_id):
+                active = set(_execute(select(Product.id).where(Product.is_active)).scalars())
+                for product_id in self.by_id.keys() - active:
+                    self._remove(product_id)
+                changed = True
+            if changed:
+                self._orderings = {}
+
+    def _load(self, last_seq):
+        # The cursor is read first: a change committed during the load is applied again by the next refresh
+        self.by_id, self.by_sku, self.by_category, self.cursor = {}, {}, {}, last_seq
+        for row in _execute(select(*SNAPSHOT_COLUMNS).where(Product.is_active)):
+            self._add(CatalogProduct(row))
+        self._orderings = {}
+
+    def _add(self, product):
+        self.by_id[product.id] = product
+        self.by_sku[product.sku.lower()] = product
+        self.by_category.setdefault(product.category or '', set()).add(product.id)
+
+    def _remove(self, product_id):
+        product = self.by_id.pop(product_id, None)
+        if product is None:
+            return
+        if self.by_sku.get(product.sku.lower()) is product:
+            del self.by_sku[product.sku.lower()]
+        ids = self.by_category.get(product.category or '')
+        if ids is not None:
+            ids.discard(product_id)
+            if not ids:
+                del self.by_category[product.category or '']
+
+
+def _name_key(product):
+    return product.name, product.id
+
+
+def _id_key(product):
+    return product.id
+
+
+def _execute(statement):
+    # Always the primary: a lagging replica could move the snapshot backwards
+    return db.session.execute(statement, bind_arguments={'bind': db.engine})
+
+
+class SnapshotPagination(Pagination):
+    """Flask-SQLAlchemy's Pagination over a list, e.g. CatalogSnapshot.by_name()."""
+
+    def _query_items(self):
+        offset = self._query_offset
+        return self._query_args['items'][offset:offset + self.per_page]
+
+    def _query_count(self):
+        return len(self._query_args['items'])
+
+
+def catalog_snapshot():
+    """The app's up-to-date snapshot, or None when CATALOG_SNAPSHOT_ENABLED is off."""
+    snapshot = current_app.extensions.get('catalog_snapshot')
+    if snapshot is not None:
+        snapshot.maybe_refresh()
+    return snapshot
+
+
+def snapshot_page(snapshot, after_id=None, limit=None, category=None, active=None):
+    """product_reads.page_result() for a page of active products, or None if the snapshot can't serve it."""
+    after_id, limit = page_args(after_id, limit)
+    if parse_flag(active) is not True or category == '': # The API matches '' literally, not NULL
+        return None
+    products = [product.to_dict() for product in snapshot.page(after_id, limit, category)]
+    return {'products': products, 'next_after': products[-1]['id'] if products else None}
+
+
+@event.listens_for(db.session, 'before_flush')
+def _note_product_changes(session, flush_context, instances):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Product):
+            session.info['catalog_changed'] = True
+            return
+
+
+@products_bulk_updated.connect
+def _note_bulk_update(sender, session, ids, fields, **kwargs):
+    session.info['catalog_changed'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _mark_stale(session):
+    if session.info.pop('catalog_changed', False):
+        snapshot = current_app.extensions.get('catalog_snapshot')
+        if snapshot is not None:
+            snapshot.stale = True # This worker reads its own writes on the next request
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    session.info.pop('catalog_changed', None)
+
+
+def init_app(app):
+    app.config.setdefault('CATALOG_SNAPSHOT_ENABLED', False)
+    app.config.setdefault('CATALOG_SNAPSHOT_MAX_AGE', 5) # Seconds between refreshes
+    if not app.config['CATALOG_SNAPSHOT_ENABLED']:
+        return
+    snapshot = CatalogSnapshot(app.config['CATALOG_SNAPSHOT_MAX_AGE'])
+    app.extensions['catalog_snapshot'] = snapshot
+    with app.app_context():
+        try:
+            snapshot.refresh()
+        except (OperationalError, ProgrammingError): # No products table yet (before `flask db upgrade`)
+            db.session.rollback()
+            snapshot.refreshed_at = None
+            snapshot.stale = True
+            app.logger.warning('Catalog snapshot not loaded at startup; loading on first use')
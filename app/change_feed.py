@@ -0,0 +1,237 @@
+"""Change feed of products for downstream sync (search, storefront, ERP).
+
+Every commit that inserts, updates or deletes products appends one entry per
+product to `product_changes`: U for a created or updated product, D (a
+tombstone carrying the SKU) for a deleted one. Entries are numbered from the
+`change_sequences` counter row in before_commit, so the row lock is held
+only from there to the commit. Sequence numbers are therefore handed out in
+commit order and a consumer reading `seq > cursor` never skips an entry that
+commits later with a lower number.
+
+Consumers poll GET /api/products/changes?since=<cursor> (or `flask products
+changes`). Each page returns the current state of the changed products, so
+the cost of a sync is proportional to what changed, not to the catalog.
+
+`flask products compact-changes` keeps the feed small. It drops entries
+older than the retention window that a newer entry of the same product
+supersedes, so any cursor still gets every product's latest state. It also
+drops old tombstones and records the highest one removed as compacted_seq.
+A cursor below compacted_seq could miss a delete, so it gets 410 Gone and
+must resync from a full export.
+
+Writes that bypass the ORM must send products_bulk_updated (as the bulk
+update engine does) to be recorded.
+"""
+import json
+import time
+from datetime import timedelta
+
+import click
+from sqlalchemy import event, select, update, insert, exists, func
+from sqlalchemy.orm import aliased
+
+from . import db
+from .models import Product, ProductChange, ChangeSequence, utcnow
+from .product_reads import PRODUCT_COLUMNS, ProductQueryError, product_dict
+from .signals import products_bulk_updated, products_archiving, products_restored
+
+SEQUENCE = 'products'
+UPSERT, DELETE = 'U', 'D'
+DEFAULT_BATCH_SIZE = 500
+MAX_BATCH_SIZE = 1000
+
+
+class CursorExpired(LookupError):
+    """The cursor is older than the compacted part of the feed; the consumer must resync."""
+
+    def __init__(self, cursor, head):
+        super().__init__(f'Cursor {cursor} is older than the retained change feed; resync from a full export')
+        self.head = head
+
+
+# --- Capture -----------------------------------------------------------------
+
+def _note(session, product_id, op, sku=None):
+    pending = session.info.setdefault('change_feed_pending', {})
+    pending.pop((product_id, op), None) # Re-insert so entries keep the order of the changes
+    pending[(product_id, op)] = sku
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changes(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, Product):
+            _note(session, obj.id, UPSERT)
+    for obj in session.dirty:
+        if isinstance(obj, Product) and obj not in session.deleted and session.is_modified(obj):
+            _note(session, obj.id, UPSERT)
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            _note(session, obj.id, DELETE, obj.sku)
+
+
+@products_bulk_updated.connect
+def _after_bulk_update(sender, session, ids, fields, **kwargs):
+    for product_id in ids:
+        _note(session, product_id, UPSERT)
+
+
+@products_archiving.connect
+def _before_archive(sender, session, ids, **kwargs):
+    # Archived products are gone as far as consumers are concerned
+    for product_id, sku in session.execute(select(Product.id, Product.sku).where(Product.id.in_(ids))):
+        _note(session, product_id, DELETE, sku)
+
+
+@products_restored.connect
+def _after_restore(sender, session, ids, **kwargs):
+    for product_id in ids:
+        _note(session, product_id, UPSERT)
+
+
+def _allocate(connection, count):
+    """Reserve `count` sequence numbers; returns the last one. Locks the counter row until commit."""
+    table = ChangeSequence.__table__
+    result = connection.execute(update(table).where(table.c.name == SEQUENCE)
+                                .values(last_seq=table.c.last_seq + count))
+    if result.rowcount == 0: # First change ever (the migration normally creates the row)
+        connection.execute(insert(table).values(name=SEQUENCE, last_seq=count, compacted_seq=0))
+        return count
+    return connection.scalar(select(table.c.last_seq).where(table.c.name == SEQUENCE))
+
+
+@event.listens_for(db.session, 'before_commit')
+def _write_changes(session):
+    session.flush() # The commit's own flush would come after this hook
+    pending = session.info.pop('change_feed_pending', None)
+    if not pending:
+        return
+    connection = session.connection()
+    first = _allocate(connection, len(pending)) - len(pending) + 1
+    now = utcnow()
+    connection.execute(insert(ProductChange.__table__), [
+        {'seq': seq, 'product_id': product_id, 'op': op, 'sku': sku, 'changed_at': now}
+        for seq, ((product_id, op), sku) in enumerate(pending.items(), first)])
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    session.info.pop('change_feed_pending', None)
+
+
+# --- Reading -----------------------------------------------------------------
+
+def feed_head():
+    """(last_seq, compacted_seq) of the feed."""
+    row = db.session.execute(select(ChangeSequence.last_seq, ChangeSequence.compacted_seq)
+                             .where(ChangeSequence.name == SEQUENCE)).first()
+    return (row.last_seq, row.compacted_seq) if row is not None else (0, 0)
+
+
+def changes_since(since=None, limit=None):
+    """The next page of changes after cursor `since`, with the changed products' current state.
+
+    Within a page only the last upsert of a product is returned, and upserts
+    of products deleted since are left out (their tombstone follows).
+    """
+    try:
+        since = int(since or 0)
+        limit = max(min(int(limit or DEFAULT_BATCH_SIZE), MAX_BATCH_SIZE), 1)
+    except (TypeError, ValueError):
+        raise ProductQueryError('since and limit must be integers')
+    last_seq, compacted_seq = feed_head()
+    if since < compacted_seq:
+        raise CursorExpired(since, last_seq)
+    entries = db.session.execute(
+        select(ProductChange.seq, ProductChange.product_id, ProductChange.op, ProductChange.sku)
+        .where(ProductChange.seq > since).order_by(ProductChange.seq).limit(limit + 1)).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    last_upsert = {entry.product_id: entry.seq for entry in entries if entry.op == UPSERT}
+    products = {}
+    if last_upsert:
+        rows = db.session.execute(select(*PRODUCT_COLUMNS).where(Product.id.in_(last_upsert)))
+        products = {row.id: product_dict(row) for row in rows}
+    changes = []
+    for entry in entries:
+        if entry.op == DELETE:
+            changes.append({'seq': entry.seq, 'op': 'delete', 'id': entry.product_id, 'sku': entry.sku})
+        elif last_upsert[entry.product_id] == entry.seq and entry.product_id in products:
+            changes.append({'seq': entry.seq, 'op': 'upsert', 'product': products[entry.product_id]})
+    return {'changes': changes, 'cursor': entries[-1].seq if entries else since, 'has_more': has_more}
+
+
+# --- Compaction ----------------------------------------------------------------
+
+def compact_changes(older_than, chunk_size=5000):
+    """Drop superseded entries and tombstones older than `older_than`, one transaction per chunk.
+
+    Returns (superseded entries removed, tombstones removed).
+    """
+    first_recent = db.session.scalar(select(ProductChange.seq).where(ProductChange.changed_at >= older_than)
+                                     .order_by(ProductChange.seq).limit(1))
+    horizon = first_recent - 1 if first_recent is not None else feed_head()[0]
+    table = ProductChange.__table__
+    newer = aliased(table)
+    superseded = tombstones = 0
+    last = 0
+    while last < horizon:
+        end = db.session.scalar(select(table.c.seq).where(table.c.seq > last).order_by(table.c.seq)
+                                .offset(chunk_size - 1).limit(1))
+        end = horizon if end is None else min(end, horizon)
+        in_chunk = table.c.seq.between(last + 1, end)
+        try:
+            superseded += db.session.execute(table.delete().where(
+                in_chunk, table.c.op == UPSERT,
+                exists().where(newer.c.product_id == table.c.product_id, newer.c.seq > table.c.seq))).rowcount
+            newest_tombstone = db.session.scalar(select(func.max(table.c.seq)).where(in_chunk, table.c.op == DELETE))
+            if newest_tombstone is not None:
+                db.session.execute(update(ChangeSequence).where(ChangeSequence.name == SEQUENCE,
+                                                                ChangeSequence.compacted_seq < newest_tombstone)
+                                   .values(compacted_seq=newest_tombstone))
+                tombstones += db.session.execute(table.delete().where(in_chunk, table.c.op == DELETE)).rowcount
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        last = end
+    return superseded, tombstones
+
+
+# --- CLI -----------------------------------------------------------------------
+
+@click.command('changes')
+@click.option('--since', default=0, show_default=True, type=int, help='Cursor returned by the previous sync.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, type=int)
+@click.option('--follow', is_flag=True, help='Keep polling for new changes.')
+@click.option('--interval', default=2.0, show_default=True, type=float, help='Seconds between polls with --follow.')
+def changes_command(since, batch_size, follow, interval):
+    """Print product changes after a cursor as JSON lines; the new cursor goes to stderr."""
+    cursor = since
+    try:
+        while True:
+            try:
+                page = changes_since(cursor, batch_size)
+            except CursorExpired as e:
+                raise click.ClickException(f'{e} (current cursor: {e.head})')
+            for change in page['changes']:
+                click.echo(json.dumps(change, separators=(',', ':')))
+            cursor = page['cursor']
+            db.session.rollback() # Don't hold a read transaction between batches
+            if not page['has_more']:
+                if not follow:
+                    break
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        click.echo(f'cursor: {cursor}', err=True)
+
+
+@click.command('compact-changes')
+@click.option('--older-than-days', type=int, default=7, show_default=True,
+              help='Keep every entry newer than this; cursors older than it may need a resync.')
+def compact_changes_command(older_than_days):
+    """Drop superseded change feed entries and old tombstones."""
+    superseded, tombstones = compact_changes(utcnow() - timedelta(days=older_than_days))
+    click.echo(f'Removed {superseded} superseded changes and {tombstones} tombstones.')
@@ -0,0 +1,64 @@
+"""Response compression.
+
+Compresses buffered responses of text-like content types with Brotli when
+the `brotli` package is installed and the client accepts it, else gzip.
+Small bodies (below COMPRESS_MIN_SIZE bytes), streamed or file responses,
+responses that are already encoded, and anything marked
+Cache-Control: no-transform are sent as they are.
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError: # Optional dependency: pip install brotli
+    brotli = None
+
+DEFAULT_MIMETYPES = ('text/html', 'text/plain', 'text/css', 'text/csv', 'text/xml', 'application/json',
+                     'application/javascript', 'application/xml', 'image/svg+xml')
+
+
+def choose_encoding(accept_encodings):
+    """'br', 'gzip' or None for a request's Accept-Encoding values."""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BR_QUALITY'])
+    return gzip.compress(data, compresslevel=config['COMPRESS_LEVEL'], mtime=0)
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESS_ENABLED', True)
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500) # Bytes; smaller bodies gain nothing
+    app.config.setdefault('COMPRESS_MIMETYPES', DEFAULT_MIMETYPES)
+    app.config.setdefault('COMPRESS_LEVEL', 6) # gzip, 1-9
+    app.config.setdefault('COMPRESS_BR_QUALITY', 4) # brotli, 0-11; 4 is about gzip -6 speed
+
+    @app.after_request
+    def compress_response(response):
+        config = app.config
+        if not config['COMPRESS_ENABLED'] or response.mimetype not in config['COMPRESS_MIMETYPES']:
+            return response
+        response.vary.add('Accept-Encoding')
+        if (response.direct_passthrough or response.is_streamed or not 200 <= response.status_code < 300
+                or response.status_code == 204 or 'Content-Encoding' in response.headers
+                or 'no-transform' in response.headers.get('Cache-Control', '')):
+            return response
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress(data, encoding, config))
+        response.headers['Content-Encoding'] = encoding
+        if response.headers.get('ETag'):
+            response.set_etag(f'{response.get_etag()[0]}-{encoding}', weak=True)
+        return response
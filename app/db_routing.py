@@ -0,0 +1,92 @@
+"""Read-replica routing for db.session.
+
+Replicas are ordinary SQLALCHEMY_BINDS entries listed in DB_REPLICA_BINDS.
+At the start of each request one replica is picked for requests that only
+read: GET/HEAD/OPTIONS requests, or any view marked with `@read_only`
+(`@use_primary` opts a GET view out). `RoutingSession.get_bind` then sends
+plain SELECTs for the default bind to that replica, and everything else --
+flushes, UPDATE/INSERT/DELETE, SELECT ... FOR UPDATE, raw SQL, and all work
+outside requests (CLI, worker) -- to the primary.
+
+Once a request writes, the rest of it reads from the primary, and the
+client's session cookie pins it to the primary for DB_PRIMARY_STICKY_SECONDS
+so it reads its own writes despite replication lag.
+"""
+import random
+import time
+
+from flask import current_app, g, has_request_context, request, session as cookie_session
+from flask_sqlalchemy.session import Session
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_KEY = '_db_primary_until'
+
+
+def read_only(view):
+    """Let a view that isn't a GET (e.g. a lookup taking a JSON body) read from a replica."""
+    view.read_only = True
+    return view
+
+
+def use_primary(view):
+    """Keep a GET view on the primary, e.g. one that renders data the user is about to edit."""
+    view.read_only = False
+    return view
+
+
+def _is_plain_select(clause):
+    return (clause is not None and getattr(clause, 'is_select', False)
+            and getattr(clause, '_for_update_arg', None) is None)
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or not has_request_context() or not current_app.config['DB_REPLICA_BINDS']:
+            return engine
+        engines = self._db.engines
+        if engine is not engines.get(None):
+            return engine # Explicit binds are never rerouted
+        if self._flushing or not _is_plain_select(clause):
+            g.db_wrote = True
+            return engine
+        replica = g.get('db_replica')
+        if replica is None or g.get('db_wrote'):
+            return engine
+        return engines[replica]
+
+
+def _choose_bind():
+    g.db_wrote = False
+    g.db_replica = None
+    replicas = current_app.config['DB_REPLICA_BINDS']
+    if not replicas:
+        return
+    view = current_app.view_functions.get(request.endpoint)
+    is_read = getattr(view, 'read_only', None)
+    if is_read is None:
+        is_read = request.method in READ_METHODS
+    if is_read and cookie_session.get(STICKY_KEY, 0) <= time.time():
+        g.db_replica = random.choice(replicas)
+
+
+def _stick_after_write(response):
+    if g.get('db_wrote') and current_app.config['DB_REPLICA_BINDS']:
+        cookie_session[STICKY_KEY] = time.time() + current_app.config['DB_PRIMARY_STICKY_SECONDS']
+    return response
+
+
+def _forget_bind(exc):
+    g.pop('db_replica', None)
+    g.pop('db_wrote', None)
+
+
+def init_app(app):
+    app.config.setdefault('DB_REPLICA_BINDS', [])
+    app.config.setdefault('DB_PRIMARY_STICKY_SECONDS', 5)
+    unknown = set(app.config['DB_REPLICA_BINDS']) - set(app.config.get('SQLALCHEMY_BINDS') or {})
+    if unknown:
+        raise ValueError(f"DB_REPLICA_BINDS not in SQLALCHEMY_BINDS: {', '.join(sorted(unknown))}")
+    app.before_request(_choose_bind)
+    app.after_request(_stick_after_write)
+    app.teardown_request(_forget_bind)
@@ -0,0 +1,141 @@
+"""Precomputed category facet counts.
+
+`category_facets` holds one row per (category, is_active) pair with the number
+of products in it. The counts are adjusted incrementally in the same
+transaction as the product change, from the session's before_flush event (and
+from the bulk update signals for set-based updates), so reading the facet
+sidebar costs O(categories) instead of a GROUP BY over every product.
+"""
+from collections import Counter
+
+import click
+from sqlalchemy import event, select, func, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import db
+from .models import Product, CategoryFacet
+from .signals import products_bulk_updating, products_bulk_updated, products_archiving, products_restored
+from .tracking import track_old_values, committed_value, has_changes
+
+UNCATEGORIZED = '' # Stored in place of NULL, which can't be part of the primary key
+FACET_FIELDS = ('category', 'is_active')
+
+
+def _facet_key(category, is_active):
+    return (category or UNCATEGORIZED, True if is_active is None else bool(is_active))
+
+
+def apply_deltas(connection, deltas):
+    """Add `deltas` {(category, is_active): n} to the summary table."""
+    table = CategoryFacet.__table__
+    dialect = connection.dialect.name
+    for (category, is_active), delta in deltas.items():
+        if not delta:
+            continue
+        if dialect in ('sqlite', 'postgresql'):
+            insert = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(table)
+            connection.execute(
+                insert.values(category=category, is_active=is_active, product_count=delta)
+                .on_conflict_do_update(index_elements=[table.c.category, table.c.is_active],
+                                       set_={'product_count': table.c.product_count + delta}))
+        else:
+            result = connection.execute(
+                update(table).where(table.c.category == category, table.c.is_active == is_active)
+                .values(product_count=table.c.product_count + delta))
+            if result.rowcount == 0:
+                connection.execute(table.insert().values(
+                    category=category, is_active=is_active, product_count=delta))
+
+
+track_old_values(Product, FACET_FIELDS)
+
+
+@event.listens_for(db.session, 'before_flush')
+def _track_facet_changes(session, flush_context, instances):
+    # Runs before the rows are written, so deleted or expired rows can still be
+    # loaded to find the facet they are leaving. Unset is_active on new products
+    # is the column default (True), which _facet_key assumes.
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Product):
+            deltas[_facet_key(obj.category, obj.is_active)] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            deltas[_facet_key(committed_value(obj, 'category'), committed_value(obj, 'is_active'))] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, Product) and obj not in session.deleted and has_changes(obj, FACET_FIELDS):
+            deltas[_facet_key(committed_value(obj, 'category'), committed_value(obj, 'is_active'))] -= 1
+            deltas[_facet_key(obj.category, obj.is_active)] += 1
+    if any(deltas.values()):
+        apply_deltas(session.connection(), deltas)
+
+
+def _group_counts(session, ids):
+    rows = session.execute(
+        select(Product.category, Product.is_active, func.count(Product.id))
+        .where(Product.id.in_(ids)).group_by(Product.category, Product.is_active))
+    return Counter({_facet_key(category, is_active): n for category, is_active, n in rows})
+
+
+@products_bulk_updating.connect
+def _before_bulk_update(sender, session, ids, fields, **kwargs):
+    if set(fields) & set(FACET_FIELDS):
+        deltas = _group_counts(session, ids)
+        apply_deltas(session.connection(), {key: -n for key, n in deltas.items()})
+
+
+@products_bulk_updated.connect
+def _after_bulk_update(sender, session, ids, fields, **kwargs):
+    if set(fields) & set(FACET_FIELDS):
+        apply_deltas(session.connection(), _group_counts(session, ids))
+
+
+@products_archiving.connect
+def _before_archive(sender, session, ids, **kwargs):
+    apply_deltas(session.connection(), {key: -n for key, n in _group_counts(session, ids).items()})
+
+
+@products_restored.connect
+def _after_restore(sender, session, ids, **kwargs):
+    apply_deltas(session.connection(), _group_counts(session, ids))
+
+
+def category_facets():
+    """[{'category', 'active', 'inactive', 'total'}] sorted by category; reads only the summary table."""
+    facets = {}
+    rows = db.session.execute(
+        select(CategoryFacet.category, CategoryFacet.is_active, CategoryFacet.product_count)
+        .where(CategoryFacet.product_count > 0))
+    for category, is_active, count in rows:
+        facet = facets.setdefault(category, {'category': category or None, 'active': 0, 'inactive': 0})
+        facet['active' if is_active else 'inactive'] += count
+    for facet in facets.values():
+        facet['total'] = facet['active'] + facet['inactive']
+    return [facets[key] for key in sorted(facets)]
+
+
+def rebuild_facets():
+    """Recompute every count from `products` in one transaction. Returns the number of rows."""
+    rows = db.session.execute(
+        select(Product.category, Product.is_active, func.count(Product.id))
+        .group_by(Product.category, Product.is_active)).all()
+    counts = Counter()
+    for category, is_active, n in rows:
+        counts[_facet_key(category, is_active)] += n
+    try:
+        db.session.execute(CategoryFacet.__table__.delete())
+        if counts:
+            db.session.execute(CategoryFacet.__table__.insert(), [
+                {'category': category, 'is_active': is_active, 'product_count': n}
+                for (category, is_active), n in counts.items()])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(counts)
+
+
+@click.command('rebuild-facets')
+def rebuild_facets_command():
+    """Recompute category facet counts from the products table."""
+    click.echo(f'Rebuilt {rebuild_facets()} category facet rows.')
@@ -0,0 +1,152 @@
+"""Template fragment caching.
+
+Templates wrap expensive blocks in
+
+    {% cache 'product-row', product.id, product.date_updated %} ... {% endcache %}
+
+The rendered markup is kept in a per-process LRU keyed by those values.
+Including the product's date_updated means a change made anywhere (another
+worker, a bulk update) produces a new key, so a stale fragment is never
+served. Fragments of products changed in this process are also dropped as
+soon as the transaction commits, so they don't sit in the LRU.
+
+Never put per-user or per-session values (csrf_token(), current_user) inside
+a cached block; render them next to it.
+"""
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from sqlalchemy import event
+
+from . import db
+from .models import Product
+from .signals import products_bulk_updated
+
+PRODUCT_FRAGMENTS = ('product-row', 'product-detail') # Names used with product.id as the second key part
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered fragments, indexed by (name, object id) for invalidation."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_object = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._by_object.setdefault(key[:2], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._forget(next(iter(self._entries)))
+
+    def _forget(self, key):
+        self._entries.pop(key, None)
+        keys = self._by_object.get(key[:2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_object[key[:2]]
+
+    def invalidate(self, name, object_id):
+        """Drop every cached version of fragment `name` for one object."""
+        with self._lock:
+            for key in list(self._by_object.get((name, object_id), ())):
+                self._forget(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_object.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FragmentCacheExtension(Extension):
+    """Adds {% cache key, ... %}...{% endcache %} to Jinja."""
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', [nodes.List(key)]), [], [], body) \
+            .set_lineno(lineno)
+
+    def _render_cached(self, key, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = tuple(key)
+        value = cache.get(key)
+        if value is None:
+            value = caller()
+            cache.set(key, value)
+        return value
+
+
+def invalidate_products(product_ids):
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is not None:
+        for product_id in product_ids:
+            for name in PRODUCT_FRAGMENTS:
+                cache.invalidate(name, product_id)
+
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_changed_products(session, flush_context, instances):
+    changed = session.info.setdefault('fragment_cache_ids', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Product) and obj.id is not None:
+            changed.add(obj.id)
+
+
+@products_bulk_updated.connect
+def _collect_bulk_updated(sender, session, ids, fields, **kwargs):
+    session.info.setdefault('fragment_cache_ids', set()).update(ids)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_committed(session):
+    changed = session.info.pop('fragment_cache_ids', None)
+    if changed:
+        invalidate_products(changed)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    session.info.pop('fragment_cache_ids', None)
+
+
+def init_app(app):
+    app.config.setdefault('FRAGMENT_CACHE_ENABLED', True)
+    app.config.setdefault('FRAGMENT_CACHE_SIZE', 10000) # Fragments per process
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    if app.config['FRAGMENT_CACHE_ENABLED']:
+        cache = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
+        app.extensions['fragment_cache'] = cache
+        app.jinja_env.fragment_cache = cache
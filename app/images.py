@@ -0,0 +1,351 @@
+"""Product images: content-addressed storage and thumbnails.
+
+An image is stored once, under the SHA-256 of its bytes:
+
+    <IMAGE_ROOT>/<2 hex>/<digest>/original.<ext>    (as uploaded)
+    <IMAGE_ROOT>/<2 hex>/<digest>/<w>x<h>.webp       (one per IMAGE_SIZES entry)
+
+IMAGE_ROOT defaults to <instance>/images. Uploading the same file again, for
+any product, reuses what is there. Since a file's content never changes at
+its URL (a new size gets a new file name), `/images/...` responses are
+served with a one-year, `immutable` Cache-Control and never revalidated.
+Product.image_url points at the original, e.g. /images/<digest>/original.jpg.
+
+Uploads are checked (format, pixel count) and written in the request;
+resizing is not. The request enqueues an `images.derive` job, and the worker
+runs it in a process pool of IMAGE_WORKERS processes (0: in the worker
+thread). Until a size exists, its URL redirects, uncached, to the original.
+
+`flask images ingest DIR` attaches a directory of files named <SKU>.<ext>
+to their products, hashing and resizing in a process pool, and
+`flask images rebuild` renders sizes added to IMAGE_SIZES for existing
+images. Files no product refers to any more are left in place.
+"""
+import atexit
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from flask import Blueprint, abort, current_app, redirect, send_from_directory
+from PIL import Image, ImageOps
+from sqlalchemy import func, select
+
+from . import db
+from .jobs import job, enqueue
+from .models import Product
+
+# Pillow format -> file extension of the stored original
+IMAGE_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+_FILE_NAME = re.compile(r'^(original\.[a-z]+|\d+x\d+\.webp)$')
+
+images_bp = Blueprint('images', __name__)
+
+Variant = namedtuple('Variant', 'url width height')
+
+
+class ImageError(ValueError):
+    """Raised for files that aren't images we accept."""
+
+
+# --- Storage (no app context: these also run in pool processes) ----------------
+
+def image_dir(root, digest):
+    return os.path.join(root, digest[:2], digest)
+
+
+def size_name(width, height):
+    return f'{width}x{height}.webp'
+
+
+def _write_once(path, data):
+    """Write `data` to `path` unless it exists. Atomic, so readers never see part of a file."""
+    if os.path.exists(path):
+        return False
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return True
+
+
+def store_original(root, data, max_pixels):
+    """Check that `data` is an image we accept and store it. Returns (digest, ext); reads only the header."""
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            image_format, (width, height) = im.format, im.size
+    except (OSError, Image.DecompressionBombError):
+        raise ImageError('Not an image file')
+    if image_format not in IMAGE_FORMATS:
+        raise ImageError(f'Unsupported image format {image_format}; use {", ".join(IMAGE_FORMATS)}')
+    if width * height > max_pixels:
+        raise ImageError(f'Image is too large ({width}x{height})')
+    digest, ext = hashlib.sha256(data).hexdigest(), IMAGE_FORMATS[image_format]
+    _write_once(os.path.join(image_dir(root, digest), f'original.{ext}'), data)
+    return digest, ext
+
+
+def render_sizes(root, digest, ext, sizes, quality):
+    """Write the missing `sizes` [(width, height)] of a stored image. Returns how many were written."""
+    directory = image_dir(root, digest)
+    missing = [(w, h) for w, h in sizes if not os.path.exists(os.path.join(directory, size_name(w, h)))]
+    if not missing:
+        return 0
+    largest = max(max(w, h) for w, h in missing)
+    with Image.open(os.path.join(directory, f'original.{ext}')) as im:
+        im.draft('RGB', (largest, largest)) # JPEG: decode at a reduced scale when that is still large enough
+        im = ImageOps.exif_transpose(im)
+        im = im.convert('RGBA' if im.mode in ('RGBA', 'LA', 'P', 'PA') else 'RGB')
+        im.thumbnail((largest, largest), Image.Resampling.LANCZOS, reducing_gap=3.0) # Resize once, then per size
+        background = (255, 255, 255, 0) if im.mode == 'RGBA' else (255, 255, 255)
+        for width, height in missing:
+            # Letterboxed to exactly width x height, so pages can reserve the space
+            resized = ImageOps.pad(im, (width, height), Image.Resampling.LANCZOS, color=background)
+            out = io.BytesIO()
+            resized.save(out, 'WEBP', quality=quality, method=4)
+            _write_once(os.path.join(directory, size_name(width, height)), out.getvalue())
+    return len(missing)
+
+
+def _ingest_file(root, path, max_bytes, max_pixels, sizes, quality):
+    """Pool task for one file: (path, digest, ext, error)."""
+    try:
+        if os.path.getsize(path) > max_bytes:
+            raise ImageError(f'File is larger than {max_bytes} bytes')
+        with open(path, 'rb') as f:
+            digest, ext = store_original(root, f.read(), max_pixels)
+        render_sizes(root, digest, ext, sizes, quality)
+        return path, digest, ext, None
+    except (ImageError, OSError) as e:
+        return path, None, None, str(e)
+
+
+# --- App side -----------------------------------------------------------------
+
+def image_root(app=None):
+    app = app or current_app
+    return app.config['IMAGE_ROOT'] or os.path.join(app.instance_path, 'images')
+
+
+def image_sizes(app=None):
+    return sorted(set(map(tuple, (app or current_app).config['IMAGE_SIZES'].values())))
+
+
+def _storage_args(app):
+    config = app.config
+    return image_root(app), config['IMAGE_MAX_PIXELS'], image_sizes(app), config['IMAGE_QUALITY']
+
+
+def _new_pool(workers):
+    # spawn, not fork: the app has threads (log writer, audit writer) whose locks a fork could copy held
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+_pool_lock = threading.Lock()
+
+
+def _shared_pool(app):
+    """The app's process pool for `images.derive` jobs, started on first use; None with IMAGE_WORKERS = 0."""
+    if not app.config['IMAGE_WORKERS']:
+        return None
+    with _pool_lock:
+        pool = app.extensions.get('image_pool')
+        if pool is None:
+            pool = app.extensions['image_pool'] = _new_pool(app.config['IMAGE_WORKERS'])
+            atexit.register(pool.shutdown, cancel_futures=True)
+        return pool
+
+
+def image_url(digest, ext):
+    return f"{current_app.config['IMAGE_URL_PREFIX']}/{digest}/original.{ext}"
+
+
+def parse_image_url(url):
+    """(digest, ext) when `url` is the original of a stored image, else None."""
+    prefix = re.escape(current_app.config['IMAGE_URL_PREFIX'])
+    match = re.match(rf'^{prefix}/([0-9a-f]{{64}})/original\.([a-z]+)$', url or '')
+    return match.groups() if match else None
+
+
+def image_variant(url, size):
+    """Variant(url, width, height) of a stored image at IMAGE_SIZES[size]; None for other URLs."""
+    parsed = parse_image_url(url)
+    if parsed is None:
+        return None
+    width, height = current_app.config['IMAGE_SIZES'][size]
+    return Variant(f"{current_app.config['IMAGE_URL_PREFIX']}/{parsed[0]}/{size_name(width, height)}",
+                   width, height)
+
+
+def ingest_upload(file):
+    """Store an uploaded file (a werkzeug FileStorage) and queue its sizes. Returns the URL for image_url.
+
+    The job joins the current transaction: it only runs if the product change is committed.
+    """
+    root, max_pixels, sizes, quality = _storage_args(current_app)
+    max_bytes = current_app.config['IMAGE_MAX_BYTES']
+    data = file.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ImageError(f'File is larger than {max_bytes // (1024 * 1024)} MB')
+    digest, ext = store_original(root, data, max_pixels)
+    directory = image_dir(root, digest)
+    if not all(os.path.exists(os.path.join(directory, size_name(w, h))) for w, h in sizes):
+        enqueue('images.derive', {'digest': digest, 'ext': ext})
+    return image_url(digest, ext)
+
+
+@job('images.derive')
+def derive_image_sizes(payload):
+    root, _, sizes, quality = _storage_args(current_app)
+    args = (root, payload['digest'], payload['ext'], sizes, quality)
+    pool = _shared_pool(current_app._get_current_object())
+    if pool is None:
+        render_sizes(*args)
+    else:
+        pool.submit(render_sizes, *args).result() # The worker thread waits; the CPU work is in the pool
+
+
+def ingest_directory(directory, workers=None, batch_size=500):
+    """Store and resize every <SKU>.<ext> file in `directory` and point those products at them.
+
+    Files are processed by a pool of `workers` processes (0: in this process);
+    products are updated batch_size at a time, one transaction each. Returns counts.
+    """
+    app = current_app._get_current_object()
+    root, max_pixels, sizes, quality = _storage_args(app)
+    paths = sorted(entry.path for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith('.'))
+    tasks = [(root, path, app.config['IMAGE_MAX_BYTES'], max_pixels, sizes, quality) for path in paths]
+    stats = {'files': len(paths), 'images': 0, 'linked': 0, 'unmatched': 0, 'failed': 0, 'seconds': 0.0}
+    started = time.perf_counter()
+    pool = _new_pool(workers) if workers != 0 and tasks else None
+    try:
+        if pool is not None:
+            results = pool.map(_ingest_file, *zip(*tasks), chunksize=8) # Fewer round-trips per file
+        else:
+            results = (_ingest_file(*task) for task in tasks)
+        digests = set()
+        batch = {}
+        for path, digest, ext, error in results:
+            if error is not None:
+                app.logger.warning('Skipped image %s: %s', path, error)
+                stats['failed'] += 1
+                continue
+            digests.add(digest)
+            batch[os.path.splitext(os.path.basename(path))[0].lower()] = image_url(digest, ext)
+            if len(batch) >= batch_size:
+                _link(batch, stats)
+                batch = {}
+        if batch:
+            _link(batch, stats)
+        stats['images'] = len(digests)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+def _link(urls, stats):
+    """Set image_url for products by lower(SKU) -> URL, through the ORM so listeners see the change."""
+    try:
+        products = db.session.scalars(select(Product).where(func.lower(Product.sku).in_(urls))).all()
+        for product in products:
+            product.image_url = urls[product.sku.lower()]
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    stats['linked'] += len(products)
+    stats['unmatched'] += len(urls) - len(products)
+
+
+def rebuild_sizes(workers=None):
+    """Render missing IMAGE_SIZES for every stored image a product refers to. Returns (images, files written)."""
+    app = current_app._get_current_object()
+    root, _, sizes, quality = _storage_args(app)
+    prefix = app.config['IMAGE_URL_PREFIX']
+    urls = db.session.scalars(select(Product.image_url).distinct().where(Product.image_url.startswith(prefix)))
+    stored = {parsed for parsed in map(parse_image_url, urls) if parsed is not None}
+    tasks = [(root, digest, ext, sizes, quality) for digest, ext in stored]
+    if workers == 0 or not tasks:
+        return len(tasks), sum(render_sizes(*t) for t in tasks)
+    with _new_pool(workers) as pool:
+        return len(tasks), sum(pool.map(render_sizes, *zip(*tasks)))
+
+
+# --- Serving -------------------------------------------------------------------
+
+@images_bp.route('/<digest>/<name>')
+def stored_image(digest, name):
+    if not _DIGEST.match(digest) or not _FILE_NAME.match(name):
+        abort(404)
+    directory = image_dir(image_root(), digest)
+    if not os.path.isfile(os.path.join(directory, name)):
+        originals = [n for n in os.listdir(directory) if n.startswith('original.')] \
+            if os.path.isdir(directory) else []
+        if name.startswith('original.') or not originals:
+            abort(404)
+        # Size not rendered yet: show the original for now, and don't let anyone cache that answer
+        response = redirect(f"{current_app.config['IMAGE_URL_PREFIX']}/{digest}/{originals[0]}")
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    response = send_from_directory(directory, name, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
+
+# --- CLI -----------------------------------------------------------------------
+
+@click.group('images')
+def images_cli():
+    """Product images."""
+
+
+@images_cli.command('ingest')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--workers', type=int, default=None, help='Processes resizing images (default: one per CPU; 0: none).')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Products updated per transaction.')
+def ingest_command(directory, workers, batch_size):
+    """Attach the images in DIRECTORY, named <SKU>.<ext>, to their products."""
+    stats = ingest_directory(directory, workers, batch_size)
+    rate = stats['files'] / stats['seconds'] if stats['seconds'] else 0
+    click.echo(f"{stats['files']} files ({stats['images']} distinct images) in {stats['seconds']:.1f}s, "
+               f"{rate:.1f} files/s: {stats['linked']} products updated, {stats['unmatched']} without a "
+               f"matching SKU, {stats['failed']} failed.")
+
+
+@images_cli.command('rebuild')
+@click.option('--workers', type=int, default=None, help='Processes resizing images (default: one per CPU; 0: none).')
+def rebuild_command(workers):
+    """Render sizes missing from IMAGE_SIZES for the images products refer to."""
+    images, written = rebuild_sizes(workers)
+    click.echo(f'{images} images checked, {written} files written.')
+
+
+def init_app(app):
+    app.config.setdefault('IMAGE_ROOT', None) # Default: <instance>/images
+    app.config.setdefault('IMAGE_URL_PREFIX', '/images')
+    # Name -> (width, height); changing a size creates new files (and URLs), see `flask images rebuild`
+    app.config.setdefault('IMAGE_SIZES', {'thumb': (96, 96), 'medium': (480, 480)})
+    app.config.setdefault('IMAGE_QUALITY', 80) # WebP quality of the sizes
+    app.config.setdefault('IMAGE_MAX_BYTES', 20 * 1024 * 1024) # Per upload / file
+    app.config.setdefault('IMAGE_MAX_PIXELS', 50_000_000) # Larger images are refused without being decoded
+    app.config.setdefault('IMAGE_WORKERS', os.cpu_count() or 1) # Processes for `images.derive` jobs; 0: none
+    app.register_blueprint(images_bp, url_prefix=app.config['IMAGE_URL_PREFIX'])
+    app.add_template_global(image_variant)
+    app.cli.add_command(images_cli)
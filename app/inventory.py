@@ -0,0 +1,334 @@
+"""Stock per location, with Product.stock_quantity as the maintained total.
+
+Products stocked at locations have one `location_stock` row per location.
+Their stock_quantity always equals the sum of those rows and is updated in
+the same transaction as the rows. List and detail pages (and low-stock
+alerts, the movement ledger, the change feed...) keep reading
+stock_quantity and never aggregate.
+
+  - `adjust_location_stock()` changes one location's row and the total
+    together.
+  - Any other change to stock_quantity is spread over the product's
+    locations in allocation order before the flush: a form edit,
+    `record_sale()`, or a bulk update. Additions go to
+    INVENTORY_DEFAULT_LOCATION, or the product's first location; removals
+    come from the first locations that hold stock.
+  - Products without location rows behave as before. `flask inventory
+    assign-unlocated` puts their current stock at a location.
+
+`allocate()` picks the locations that fulfil a multi-line order in one
+statement. Locations that can ship more of the order's lines complete are
+preferred, so orders split across as few locations as possible; after that
+come priority and id.
+"""
+from collections import defaultdict
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, select, update, insert, delete, exists, func, case, literal, union_all, bindparam
+
+from . import db
+from .models import Product, StockLocation, LocationStock
+from .signals import products_bulk_updated
+from .tracking import track_old_values, committed_value, has_changes
+
+MAX_ORDER_LINES = 500
+
+
+class InventoryError(ValueError):
+    """Raised for stock changes that can't be applied at a location."""
+
+
+def get_location(code):
+    location = db.session.scalar(select(StockLocation).where(StockLocation.code == code))
+    if location is None:
+        raise InventoryError(f'Unknown location {code!r}')
+    return location
+
+
+def adjust_location_stock(product, location, quantity_change):
+    """Add (or remove, if negative) stock at one location, and to the product's total.
+
+    Locks the product row (on databases with FOR UPDATE) and re-reads its
+    total, so adjustments at different locations can't overwrite each other.
+    """
+    if isinstance(location, str):
+        location = get_location(location)
+    db.session.flush() # refresh() would discard unflushed changes
+    db.session.refresh(product, ['stock_quantity', 'version'], with_for_update=True)
+    table = LocationStock.__table__
+    at_location = (table.c.product_id == product.id) & (table.c.location_id == location.id)
+    updated = db.session.execute(
+        update(table).where(at_location, table.c.quantity + quantity_change >= 0)
+        .values(quantity=table.c.quantity + quantity_change)).rowcount
+    if not updated:
+        if db.session.scalar(select(exists().where(at_location))) or quantity_change < 0:
+            raise InventoryError(f'Stock of {product.sku} at {location.code} cannot go below zero.')
+        if product.stock_quantity and not db.session.scalar(
+                select(exists().where(table.c.product_id == product.id))):
+            raise InventoryError(f'{product.sku} has stock not assigned to a location; '
+                                 f'run `flask inventory assign-unlocated` first.')
+        db.session.execute(insert(table).values(product_id=product.id, location_id=location.id,
+                                                quantity=quantity_change))
+    product.adjust_stock(quantity_change)
+    located = db.session.info.setdefault('inventory_located', defaultdict(int))
+    located[product] += quantity_change # Already at a location: before_flush doesn't spread it
+
+
+def location_stock(product_id):
+    """[(location code, name, quantity)] for one product, in allocation order."""
+    return db.session.execute(
+        select(StockLocation.code, StockLocation.name, LocationStock.quantity)
+        .join(StockLocation, StockLocation.id == LocationStock.location_id)
+        .where(LocationStock.product_id == product_id)
+        .order_by(StockLocation.priority, StockLocation.id)).all()
+
+
+# --- Keeping locations in step with the total ---------------------------------
+
+track_old_values(Product, ('stock_quantity',))
+
+
+def _spread(session, changes):
+    """Apply {product_id: quantity change} to the products' location rows. Products without rows are skipped.
+
+    Takes the product rows, then their location rows, FOR UPDATE in (product,
+    location) order, the order adjust_location_stock() locks in too, and
+    writes relative updates, so a concurrent adjustment is never overwritten.
+    """
+    session.execute(select(Product.id).where(Product.id.in_(changes)).order_by(Product.id).with_for_update())
+    rows = session.execute(
+        select(LocationStock.product_id, LocationStock.location_id, LocationStock.quantity,
+               StockLocation.code, StockLocation.priority)
+        .join(StockLocation, StockLocation.id == LocationStock.location_id)
+        .where(LocationStock.product_id.in_(changes))
+        .order_by(LocationStock.product_id, LocationStock.location_id)
+        .with_for_update(of=LocationStock)).all()
+    by_product = defaultdict(list)
+    for row in rows:
+        by_product[row.product_id].append(row)
+    default_code = current_app.config['INVENTORY_DEFAULT_LOCATION']
+    deltas = []
+    for product_id, locations in by_product.items():
+        locations.sort(key=lambda row: (row.priority, row.location_id)) # Allocation order
+        change = changes[product_id]
+        if change > 0:
+            target = next((row for row in locations if row.code == default_code), locations[0])
+            deltas.append((product_id, target.location_id, change))
+            continue
+        for row in locations:
+            if change == 0:
+                break
+            taken = min(row.quantity, -change)
+            if taken:
+                deltas.append((product_id, row.location_id, -taken))
+                change += taken
+        if change:
+            raise InventoryError(f'Location stock of product {product_id} is short by {-change}; '
+                                 f'run `flask inventory check --fix`.')
+    if deltas:
+        table = LocationStock.__table__
+        session.execute(
+            update(table).where(table.c.product_id == bindparam('pid'), table.c.location_id == bindparam('lid'))
+            .values(quantity=table.c.quantity + bindparam('delta')),
+            [{'pid': pid, 'lid': lid, 'delta': delta} for pid, lid, delta in deltas])
+
+
+@event.listens_for(db.session, 'before_flush')
+def _sync_locations(session, flush_context, instances):
+    located = session.info.pop('inventory_located', {})
+    changes, deleted = {}, []
+    for obj in session.dirty:
+        if not isinstance(obj, Product) or obj in session.deleted or not has_changes(obj, ('stock_quantity',)):
+            continue
+        change = (obj.stock_quantity or 0) - (committed_value(obj, 'stock_quantity') or 0) - located.get(obj, 0)
+        if change:
+            changes[obj.id] = change
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            deleted.append(obj.id)
+    if changes:
+        _spread(session, changes)
+    if deleted: # ON DELETE CASCADE, for SQLite without foreign key enforcement
+        session.execute(delete(LocationStock).where(LocationStock.product_id.in_(deleted))
+                        .execution_options(synchronize_session=False))
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_located(session, previous_transaction):
+    session.info.pop('inventory_located', None)
+
+
+@products_bulk_updated.connect
+def _after_bulk_update(sender, session, ids, fields, **kwargs):
+    if 'stock_quantity' not in fields:
+        return
+    # The UPDATE holds the product rows, so what it changed is the new total minus the locations' sum
+    located = (select(LocationStock.product_id, func.sum(LocationStock.quantity).label('quantity'))
+               .where(LocationStock.product_id.in_(ids)).group_by(LocationStock.product_id).subquery())
+    rows = session.execute(
+        select(Product.id, Product.stock_quantity - located.c.quantity)
+        .join(located, located.c.product_id == Product.id)
+        .where(Product.stock_quantity != located.c.quantity))
+    changes = dict(rows.all())
+    if changes:
+        _spread(session, changes)
+
+
+# --- Allocation ----------------------------------------------------------------
+
+def allocate(lines):
+    """Pick fulfilling locations for an order of [(sku, quantity)] lines, in one statement.
+
+    Returns one dict per line: sku, requested, allocated and locations, a
+    list of {location, quantity}. allocated is less than requested when
+    active locations don't hold enough. Lines with the same SKU are
+    allocated as one and the stock handed out to them in line order, so
+    no unit is promised twice. Nothing is reserved; apply the result with
+    adjust_location_stock() in the transaction that records the order.
+    """
+    if not lines:
+        return []
+    if len(lines) > MAX_ORDER_LINES:
+        raise InventoryError(f'At most {MAX_ORDER_LINES} lines per allocation')
+    for sku, quantity in lines:
+        if not isinstance(sku, str) or not isinstance(quantity, int) or quantity <= 0:
+            raise InventoryError('Each line needs a SKU and a positive integer quantity')
+    requested = defaultdict(int) # Lower-case SKU -> quantity over all its lines, in order of first line
+    for sku, quantity in lines:
+        requested[sku.lower()] += quantity
+    order = union_all(*(
+        select(literal(index).label('line'), literal(sku).label('sku'), literal(quantity).label('requested'))
+        for index, (sku, quantity) in enumerate(requested.items()))).cte('order_lines')
+    candidates = (
+        select(order.c.line, order.c.requested, StockLocation.id.label('location_id'), StockLocation.code,
+               StockLocation.priority, LocationStock.quantity,
+               # How many lines of the order this location could ship complete
+               func.sum(case((LocationStock.quantity >= order.c.requested, 1), else_=0))
+               .over(partition_by=StockLocation.id).label('lines_covered'))
+        .select_from(order)
+        .join(Product, func.lower(Product.sku) == order.c.sku)
+        .join(LocationStock, LocationStock.product_id == Product.id)
+        .join(StockLocation, StockLocation.id == LocationStock.location_id)
+        .where(StockLocation.is_active, LocationStock.quantity > 0)).cte('candidates')
+    preference = (candidates.c.lines_covered.desc(), candidates.c.priority, candidates.c.location_id)
+    ranked = select(
+        candidates,
+        func.coalesce(func.sum(candidates.c.quantity).over(
+            partition_by=candidates.c.line, order_by=preference, rows=(None, -1)), 0).label('before'),
+        func.row_number().over(partition_by=candidates.c.line, order_by=preference).label('rank'),
+    ).subquery()
+    remaining = ranked.c.requested - ranked.c.before
+    rows = db.session.execute(
+        select(ranked.c.line, ranked.c.code,
+               case((ranked.c.quantity < remaining, ranked.c.quantity), else_=remaining).label('quantity'))
+        .where(ranked.c.before < ranked.c.requested)
+        .order_by(ranked.c.line, ranked.c.rank))
+    available = [[] for _ in requested] # Per SKU: [location code, quantity not yet handed to a line]
+    for line, code, quantity in rows:
+        available[line].append([code, quantity])
+    index = {sku: line for line, sku in enumerate(requested)}
+    result = []
+    for sku, quantity in lines:
+        allocation = {'sku': sku, 'requested': quantity, 'allocated': 0, 'locations': []}
+        pool = available[index[sku.lower()]]
+        while pool and allocation['allocated'] < quantity:
+            taken = min(pool[0][1], quantity - allocation['allocated'])
+            allocation['locations'].append({'location': pool[0][0], 'quantity': taken})
+            allocation['allocated'] += taken
+            pool[0][1] -= taken
+            if not pool[0][1]:
+                pool.pop(0)
+        result.append(allocation)
+    return result
+
+
+# --- CLI -----------------------------------------------------------------------
+
+def init_app(app):
+    app.config.setdefault('INVENTORY_DEFAULT_LOCATION', None) # Location code that receives unplaced additions
+    app.cli.add_command(inventory_cli)
+
+
+@click.group('inventory')
+def inventory_cli():
+    """Manage stock locations and per-location stock."""
+
+
+@inventory_cli.command('locations')
+@with_appcontext
+def inventory_locations():
+    """List locations with their product count and units held."""
+    rows = db.session.execute(
+        select(StockLocation.code, StockLocation.name, StockLocation.priority, StockLocation.is_active,
+               func.count(LocationStock.product_id), func.coalesce(func.sum(LocationStock.quantity), 0))
+        .outerjoin(LocationStock, LocationStock.location_id == StockLocation.id)
+        .group_by(StockLocation.id).order_by(StockLocation.priority, StockLocation.id))
+    for code, name, priority, is_active, products, units in rows:
+        click.echo(f"{code:12} {name:30} priority {priority:4} {'active' if is_active else 'inactive':8} "
+                   f'{products} products, {units} units')
+
+
+@inventory_cli.command('add-location')
+@click.argument('code')
+@click.argument('name')
+@click.option('--priority', type=int, default=100, show_default=True, help='Lower ships first.')
+@with_appcontext
+def inventory_add_location(code, name, priority):
+    """Create a stock location."""
+    db.session.add(StockLocation(code=code, name=name, priority=priority))
+    db.session.commit()
+    click.echo(f'Location {code} created.')
+
+
+@inventory_cli.command('adjust')
+@click.argument('sku')
+@click.argument('location')
+@click.argument('quantity_change', type=int)
+@with_appcontext
+def inventory_adjust(sku, location, quantity_change):
+    """Add (or, if negative, remove) stock of SKU at LOCATION."""
+    product = db.session.scalar(select(Product).where(func.lower(Product.sku) == sku.lower()))
+    if product is None:
+        raise click.ClickException(f'Unknown SKU {sku}')
+    try:
+        adjust_location_stock(product, location, quantity_change)
+        db.session.commit()
+    except InventoryError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    click.echo(f'{product.sku}: {product.stock_quantity} in stock.')
+
+
+@inventory_cli.command('assign-unlocated')
+@click.argument('location')
+@with_appcontext
+def inventory_assign_unlocated(location):
+    """Put the stock of every product without location rows at LOCATION."""
+    location = get_location(location)
+    result = db.session.execute(insert(LocationStock).from_select(
+        ['product_id', 'location_id', 'quantity'],
+        select(Product.id, literal(location.id), Product.stock_quantity)
+        .where(~exists().where(LocationStock.product_id == Product.id))))
+    db.session.commit()
+    click.echo(f'{result.rowcount} products assigned to {location.code}.')
+
+
+@inventory_cli.command('check')
+@click.option('--fix', is_flag=True, help="Set stock_quantity to the locations' sum where they differ.")
+@with_appcontext
+def inventory_check(fix):
+    """Find products whose stock_quantity differs from their location rows."""
+    totals = (select(LocationStock.product_id, func.sum(LocationStock.quantity).label('total'))
+              .group_by(LocationStock.product_id).subquery())
+    rows = db.session.execute(select(Product, totals.c.total).join(totals, totals.c.product_id == Product.id)
+                              .where(Product.stock_quantity != totals.c.total)).all()
+    located = db.session.info.setdefault('inventory_located', defaultdict(int))
+    for product, total in rows:
+        click.echo(f'{product.sku}: stock_quantity {product.stock_quantity}, locations {total}')
+        if fix:
+            located[product] += total - product.stock_quantity
+            product.stock_quantity = total
+    db.session.commit()
+    click.echo(f"{len(rows)} products out of sync{', fixed' if fix and rows else ''}.")
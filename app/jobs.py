@@ -0,0 +1,285 @@
+"""Transactional outbox and the background worker that drains it.
+
+Request handlers call `enqueue()` instead of doing slow work inline. The job
+row is added to the current session, so it is committed (or rolled back)
+together with the change that caused it, and a worker only ever sees jobs
+for changes that actually happened.
+
+`flask worker` claims pending jobs in batches with a single
+UPDATE ... WHERE id IN (SELECT ... LIMIT n), which takes the rows with
+FOR UPDATE SKIP LOCKED on PostgreSQL and runs under SQLite's database write
+lock, so concurrent workers never claim the same job. Failed jobs are
+retried with exponential backoff until max_attempts is reached.
+
+Each claim carries a token in locked_by. A job is completed or failed with
+UPDATE ... WHERE locked_by = <token>, so a worker whose job was released as
+stale (and perhaps claimed again) cannot overwrite the new claim: its
+handler's writes are rolled back instead.
+"""
+import json
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, func
+
+from . import db
+from .logs import current_request_id, set_request_id, reset_request_id
+from .models import OutboxJob, utcnow
+
+_handlers = {}
+
+
+class UnknownJobTopic(LookupError):
+    """Raised when a job is enqueued for a topic with no registered handler."""
+
+
+def job(topic, max_attempts=None):
+    """Register a handler for `topic`. It is called with the job's payload dict."""
+    def decorator(func):
+        _handlers[topic] = (func, max_attempts)
+        return func
+    return decorator
+
+
+def enqueue(topic, payload=None, delay=0, max_attempts=None):
+    """Add a job to the current transaction. It runs only if the transaction commits."""
+    if topic not in _handlers:
+        raise UnknownJobTopic(topic)
+    handler_max = _handlers[topic][1]
+    outbox_job = OutboxJob(
+        topic=topic,
+        payload=json.dumps(payload or {}, separators=(',', ':'), default=str),
+        max_attempts=max_attempts or handler_max or current_app.config['JOB_MAX_ATTEMPTS'],
+        run_after=utcnow() + timedelta(seconds=delay),
+        request_id=current_request_id(),
+    )
+    db.session.add(outbox_job)
+    return outbox_job
+
+
+def retry_delay(attempts, base, cap):
+    """Exponential backoff with full jitter, in seconds."""
+    return random.uniform(0, min(cap, base * 2 ** (attempts - 1)))
+
+
+class Worker:
+    def __init__(self, app, concurrency=None, batch_size=None, poll_interval=None):
+        config = app.config
+        self.app = app
+        self.concurrency = concurrency or config['JOB_WORKER_CONCURRENCY']
+        self.batch_size = batch_size or config['JOB_BATCH_SIZE']
+        self.poll_interval = config['JOB_POLL_INTERVAL'] if poll_interval is None else poll_interval
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._stopping = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.stats = {'done': 0, 'retried': 0, 'failed': 0, 'lost': 0}
+
+    def _count(self, outcome):
+        with self._stats_lock:
+            self.stats[outcome] += 1
+
+    def stop(self, *args):
+        self._stopping.set()
+
+    def claim(self):
+        """Atomically mark up to batch_size due jobs as running; returns them."""
+        token = f'{self.worker_id}:{uuid.uuid4().hex[:12]}'
+        now = utcnow()
+        due = (select(OutboxJob.id)
+               .where(OutboxJob.status == 'pending', OutboxJob.run_after <= now)
+               .order_by(OutboxJob.id).limit(self.batch_size)
+               .with_for_update(skip_locked=True)) # Rendered on PostgreSQL, ignored by SQLite
+        db.session.execute(
+            update(OutboxJob).where(OutboxJob.id.in_(due.scalar_subquery()))
+            .values(status='running', locked_by=token, locked_at=now)
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+        return db.session.scalars(
+            select(OutboxJob).where(OutboxJob.locked_by == token).order_by(OutboxJob.id)).all()
+
+    def release_stale(self):
+        """Put back jobs whose worker died mid-run (locked longer than JOB_LOCK_TIMEOUT)."""
+        cutoff = utcnow() - timedelta(seconds=self.app.config['JOB_LOCK_TIMEOUT'])
+        result = db.session.execute(
+            update(OutboxJob).where(OutboxJob.status == 'running', OutboxJob.locked_at < cutoff)
+            .values(status='pending', locked_by=None, locked_at=None)
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+        return result.rowcount
+
+    def _claimed(self, job_id, claim):
+        return db.session.scalars(
+            select(OutboxJob).where(OutboxJob.id == job_id, OutboxJob.locked_by == claim)).first()
+
+    def _finish(self, job_id, claim, **values):
+        """Update a job and drop the claim, unless it was released meanwhile. Whether it was still ours."""
+        result = db.session.execute(
+            update(OutboxJob).where(OutboxJob.id == job_id, OutboxJob.locked_by == claim)
+            .values(locked_by=None, **values)
+            .execution_options(synchronize_session=False))
+        if result.rowcount == 1:
+            return True
+        db.session.rollback()
+        self._count('lost')
+        current_app.logger.warning('Job %s was released while it ran; its result is discarded', job_id)
+        return False
+
+    def execute(self, job_id, claim):
+        """Run one claimed job in its own app context (and therefore its own session)."""
+        with self.app.app_context():
+            outbox_job = self._claimed(job_id, claim)
+            if outbox_job is None: # Released as stale before it started
+                self._count('lost')
+                db.session.remove()
+                return
+            handler = _handlers.get(outbox_job.topic, (None,))[0]
+            token = set_request_id(outbox_job.request_id) # Its logs correlate with the request that caused it
+            try:
+                if handler is None:
+                    raise UnknownJobTopic(outbox_job.topic)
+                handler(json.loads(outbox_job.payload))
+                # Marked done in the same transaction as the handler's own writes
+                if self._finish(job_id, claim, status='done', attempts=OutboxJob.attempts + 1,
+                                completed_at=utcnow()):
+                    db.session.commit()
+                    self._count('done')
+            except Exception:
+                db.session.rollback()
+                self._record_failure(job_id, claim, traceback.format_exc())
+            finally:
+                reset_request_id(token)
+                db.session.remove()
+
+    def _record_failure(self, job_id, claim, error):
+        config = self.app.config
+        outbox_job = self._claimed(job_id, claim)
+        if outbox_job is None:
+            self._count('lost')
+            return
+        attempts = outbox_job.attempts + 1
+        values = {'attempts': attempts, 'last_error': error[-4000:]}
+        if attempts >= outbox_job.max_attempts:
+            values['status'] = outcome = 'failed'
+        else:
+            values['status'], outcome = 'pending', 'retried'
+            values['run_after'] = utcnow() + timedelta(seconds=retry_delay(
+                attempts, config['JOB_RETRY_BASE_DELAY'], config['JOB_RETRY_MAX_DELAY']))
+        if not self._finish(job_id, claim, **values):
+            return
+        db.session.commit()
+        self._count(outcome)
+        current_app.logger.warning('Job %s (%s) failed, attempt %s/%s', job_id, outbox_job.topic,
+                                   attempts, outbox_job.max_attempts)
+
+    def run_batch(self, executor=None):
+        """Claim and run one batch. Returns the number of jobs claimed."""
+        with self.app.app_context():
+            claimed = [(j.id, j.locked_by) for j in self.claim()]
+            db.session.remove()
+        if executor is None:
+            for job_id, claim in claimed:
+                self.execute(job_id, claim)
+        else:
+            list(executor.map(self.execute, *zip(*claimed))) # Wait for the whole batch
+        return len(claimed)
+
+    def run(self, once=False):
+        """Poll until stopped. With once=True, drain every due job and return."""
+        executor = ThreadPoolExecutor(self.concurrency) if self.concurrency > 1 else None
+        next_stale_check = 0
+        try:
+            while not self._stopping.is_set():
+                if time.monotonic() >= next_stale_check:
+                    with self.app.app_context():
+                        self.release_stale()
+                    next_stale_check = time.monotonic() + 60
+                claimed = self.run_batch(executor)
+                if claimed == 0:
+                    if once:
+                        break
+                    self._stopping.wait(self.poll_interval)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        return self.stats
+
+
+def init_app(app):
+    app.config.setdefault('JOB_WORKER_CONCURRENCY', 4)
+    app.config.setdefault('JOB_BATCH_SIZE', 20)
+    app.config.setdefault('JOB_POLL_INTERVAL', 1.0) # Seconds between polls when idle
+    app.config.setdefault('JOB_MAX_ATTEMPTS', 5)
+    app.config.setdefault('JOB_RETRY_BASE_DELAY', 5) # Seconds; doubles per attempt
+    app.config.setdefault('JOB_RETRY_MAX_DELAY', 3600)
+    app.config.setdefault('JOB_LOCK_TIMEOUT', 600) # Seconds before a running job counts as abandoned
+    app.cli.add_command(worker_command)
+    app.cli.add_command(jobs_cli)
+
+
+@click.command('worker')
+@click.option('--concurrency', type=int, default=None, help='Jobs run in parallel (threads).')
+@click.option('--batch-size', type=int, default=None, help='Jobs claimed per poll.')
+@click.option('--poll-interval', type=float, default=None, help='Seconds to sleep when idle.')
+@click.option('--once', is_flag=True, help='Drain due jobs and exit instead of polling forever.')
+@with_appcontext
+def worker_command(concurrency, batch_size, poll_interval, once):
+    """Run the background job worker."""
+    worker = Worker(current_app._get_current_object(), concurrency, batch_size, poll_interval)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    click.echo(f'Worker {worker.worker_id} started (concurrency={worker.concurrency}).')
+    stats = worker.run(once=once)
+    click.echo(f"Worker stopped: {stats['done']} done, {stats['retried']} retried, {stats['failed']} failed, "
+               f"{stats['lost']} lost to a stale-job release.")
+
+
+@click.group('jobs')
+def jobs_cli():
+    """Inspect and maintain the job outbox."""
+
+
+@jobs_cli.command('stats')
+@with_appcontext
+def jobs_stats():
+    """Show job counts by topic and status."""
+    rows = db.session.execute(
+        select(OutboxJob.topic, OutboxJob.status, func.count(OutboxJob.id))
+        .group_by(OutboxJob.topic, OutboxJob.status).order_by(OutboxJob.topic, OutboxJob.status))
+    for topic, status, count in rows:
+        click.echo(f'{topic:30} {status:8} {count}')
+
+
+@jobs_cli.command('retry-failed')
+@click.option('--topic', default=None)
+@with_appcontext
+def jobs_retry_failed(topic):
+    """Reset failed jobs so the worker picks them up again."""
+    statement = update(OutboxJob).where(OutboxJob.status == 'failed')
+    if topic:
+        statement = statement.where(OutboxJob.topic == topic)
+    result = db.session.execute(statement.values(status='pending', attempts=0, run_after=utcnow()))
+    db.session.commit()
+    click.echo(f'{result.rowcount} jobs reset.')
+
+
+@jobs_cli.command('purge')
+@click.option('--older-than-days', type=int, default=7, show_default=True)
+@with_appcontext
+def jobs_purge(older_than_days):
+    """Delete finished jobs older than N days."""
+    cutoff = utcnow() - timedelta(days=older_than_days)
+    result = db.session.execute(
+        OutboxJob.__table__.delete().where(OutboxJob.status == 'done', OutboxJob.completed_at < cutoff))
+    db.session.commit()
+    click.echo(f'{result.rowcount} jobs deleted.')
@@ -0,0 +1,206 @@
+"""Structured logging with request correlation ids.
+
+Every request gets an id: the caller's X-Request-ID header when it is a sane
+token, otherwise a new one. It is returned in the response's X-Request-ID
+and stamped on everything logged while the request runs, on slow-query log
+entries, and on outbox jobs enqueued by the request. Worker threads set it
+again while they run those jobs.
+
+With LOG_ENABLED, the app's logger writes one JSON object per line to a
+rotating file (LOG_FILE, default <instance>/app.log) and, with LOG_STDERR,
+to stderr. Request threads only put records on a bounded in-memory queue
+(`LogQueueHandler`). A `QueueListener` thread formats and writes them, so a
+slow disk never holds up a request. When the queue is full, records are
+dropped and counted instead of waiting.
+
+Each request also gets an access log line on the `app.access` logger. Errors
+(status >= 500) and requests slower than LOG_ACCESS_SLOW_MS are always
+logged. Other requests are logged with probability LOG_ACCESS_SAMPLE_RATE,
+and each line carries the rate so counts can be scaled back up.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import current_app, g, request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+# Attributes every LogRecord has; anything else was passed with extra={...}
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+
+
+def current_request_id():
+    """The correlation id of the request or job being handled, or None."""
+    return _request_id.get()
+
+
+def set_request_id(request_id):
+    """Make `request_id` current (for a job, say). Returns a token for `reset_request_id()`."""
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id. Runs in the thread that logs, before queueing."""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = current_request_id()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, message, request_id, extras and the traceback."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class LogQueueHandler(QueueHandler):
+    """A QueueHandler that never blocks: records that don't fit in the queue are dropped and counted."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Like QueueHandler.prepare, but keeps the traceback and extras as fields for JsonFormatter
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """A logger's queue handler and the listener thread that writes what it queues to `handlers`."""
+
+    def __init__(self, logger, handlers, queue_size):
+        self.handler = LogQueueHandler(queue.Queue(queue_size))
+        self.handler.addFilter(RequestIdFilter())
+        self.listener = QueueListener(self.handler.queue, *handlers, respect_handler_level=True)
+        self.logger = logger
+
+    def start(self):
+        self.logger.addHandler(self.handler)
+        self.listener.start()
+
+    def flush(self):
+        """Wait until everything queued so far is written."""
+        self.listener.stop() # Drains the queue, then joins the thread
+        self.listener.start()
+
+    def close(self):
+        self.logger.removeHandler(self.handler)
+        if self.listener._thread is not None:
+            self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+
+
+def log_path(app):
+    return app.config['LOG_FILE'] or os.path.join(app.instance_path, 'app.log')
+
+
+# --- Request hooks -------------------------------------------------------------
+
+def _start_request():
+    incoming = request.headers.get(REQUEST_ID_HEADER, '')
+    request_id = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+    g._request_id_token = _request_id.set(request_id)
+    g._request_started = time.perf_counter()
+
+
+def _log_access(response):
+    response.headers[REQUEST_ID_HEADER] = current_request_id() or ''
+    config = current_app.config
+    duration_ms = (time.perf_counter() - g.get('_request_started', time.perf_counter())) * 1000
+    rate = config['LOG_ACCESS_SAMPLE_RATE']
+    always = response.status_code >= 500 or duration_ms >= config['LOG_ACCESS_SLOW_MS']
+    if always or random.random() < rate:
+        user = g.get('_login_user') # Only if the request loaded it: no query just for the log
+        logging.getLogger(f'{current_app.logger.name}.access').info(
+            '%s %s %s', request.method, request.path, response.status_code, extra={
+                'method': request.method, 'path': request.path, 'status': response.status_code,
+                'duration_ms': round(duration_ms, 2), 'endpoint': request.endpoint,
+                'user_id': user.get_id() if user is not None else None,
+                'remote_addr': request.remote_addr, 'sample_rate': 1.0 if always else rate})
+    return response
+
+
+def _end_request(exc):
+    token = g.pop('_request_id_token', None)
+    if token is not None:
+        _request_id.reset(token)
+
+
+def init_app(app):
+    app.config.setdefault('LOG_ENABLED', False)
+    app.config.setdefault('LOG_LEVEL', 'INFO')
+    app.config.setdefault('LOG_FILE', None) # Default: <instance>/app.log
+    app.config.setdefault('LOG_MAX_BYTES', 10 * 1024 * 1024)
+    app.config.setdefault('LOG_BACKUP_COUNT', 5)
+    app.config.setdefault('LOG_STDERR', True) # Also write the JSON lines to stderr
+    app.config.setdefault('LOG_QUEUE_SIZE', 10000) # Records waiting for the writer thread; more are dropped
+    app.config.setdefault('LOG_ACCESS_SAMPLE_RATE', 1.0) # Fraction of ordinary requests in the access log
+    app.config.setdefault('LOG_ACCESS_SLOW_MS', 1000) # Slower requests are always logged
+    app.before_request(_start_request)
+    app.after_request(_log_access)
+    app.teardown_request(_end_request)
+    if not app.config['LOG_ENABLED']:
+        return
+    config = app.config
+    path = log_path(app)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handlers = [RotatingFileHandler(path, maxBytes=config['LOG_MAX_BYTES'],
+                                    backupCount=config['LOG_BACKUP_COUNT'], encoding='utf-8')]
+    if config['LOG_STDERR']:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    formatter = JsonFormatter()
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    pipeline = LogPipeline(app.logger, handlers, config['LOG_QUEUE_SIZE'])
+    for handler in list(app.logger.handlers): # Flask's default stderr handler, or an earlier app's queue
+        app.logger.removeHandler(handler)
+    app.logger.setLevel(config['LOG_LEVEL'])
+    pipeline.start()
+    atexit.register(pipeline.close)
+    app.extensions['log_pipeline'] = pipeline
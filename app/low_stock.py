@@ -0,0 +1,92 @@
+"""Low-stock alerting.
+
+`Product.is_low_stock` is kept equal to `stock_quantity <= reorder_point`
+whenever either column changes: from before_flush for ORM writes (edits,
+adjust_stock) and from the bulk update signal for set-based updates. Only
+rows whose flag actually flips produce a `stock.low` / `stock.replenished`
+job in the outbox, so alerting costs O(changed rows) and the dashboard reads
+just the partial index of low rows instead of scanning `products`.
+"""
+from flask import current_app
+from sqlalchemy import event, select, update, and_
+
+from . import db
+from .backfills import backfill
+from .jobs import job, enqueue
+from .models import Product
+from .signals import products_bulk_updated
+from .tracking import has_changes
+
+STOCK_FIELDS = ('stock_quantity', 'reorder_point')
+
+
+def is_below(stock_quantity, reorder_point):
+    return reorder_point is not None and stock_quantity is not None and stock_quantity <= reorder_point
+
+
+def _crossing_payload(product_id, sku, stock_quantity, reorder_point):
+    return {'product_id': product_id, 'sku': sku, 'stock_quantity': stock_quantity,
+            'reorder_point': reorder_point}
+
+
+@event.listens_for(db.session, 'before_flush')
+def _track_low_stock(session, flush_context, instances):
+    crossings = []
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Product) or obj in session.deleted:
+            continue
+        if obj not in session.new and not has_changes(obj, STOCK_FIELDS):
+            continue
+        below = is_below(obj.stock_quantity or 0, obj.reorder_point)
+        if below != bool(obj.is_low_stock):
+            obj.is_low_stock = below
+            crossings.append(obj)
+    for obj in crossings:
+        # New products have no id yet; the SKU identifies them for the handler
+        enqueue('stock.low' if obj.is_low_stock else 'stock.replenished',
+                _crossing_payload(obj.id, obj.sku, obj.stock_quantity or 0, obj.reorder_point))
+
+
+@products_bulk_updated.connect
+def _after_bulk_update(sender, session, ids, fields, **kwargs):
+    if not set(fields) & set(STOCK_FIELDS):
+        return
+    should_be_low = and_(Product.reorder_point.isnot(None), Product.stock_quantity <= Product.reorder_point)
+    flipped = session.execute(
+        select(Product.id, Product.sku, Product.stock_quantity, Product.reorder_point, Product.is_low_stock)
+        .where(Product.id.in_(ids), Product.is_low_stock != should_be_low)).all()
+    if not flipped:
+        return
+    session.execute(
+        update(Product).where(Product.id.in_([row.id for row in flipped]))
+        .values(is_low_stock=should_be_low).execution_options(synchronize_session=False))
+    for row in flipped:
+        enqueue('stock.replenished' if row.is_low_stock else 'stock.low',
+                _crossing_payload(row.id, row.sku, row.stock_quantity, row.reorder_point))
+
+
+@backfill('products.is_low_stock', Product.__table__)
+def recompute_low_stock(start_id, end_id):
+    """Recompute is_low_stock for existing products (no alerts are sent)."""
+    should_be_low = and_(Product.reorder_point.isnot(None), Product.stock_quantity <= Product.reorder_point)
+    return db.session.execute(
+        update(Product).where(Product.id.between(start_id, end_id), Product.is_low_stock != should_be_low)
+        .values(is_low_stock=should_be_low).execution_options(synchronize_session=False)).rowcount
+
+
+def low_stock_query():
+    """Products below their reorder point, most urgent first. Served by ix_products_low_stock."""
+    # Compare with == so SQLite renders "is_low_stock = 1", matching the index predicate
+    return Product.query.filter(Product.is_low_stock == True).order_by(Product.stock_quantity, Product.id)
+
+
+@job('stock.low')
+def notify_low_stock(payload):
+    current_app.logger.warning('Low stock: %s has %s left (reorder point %s)',
+                               payload['sku'], payload['stock_quantity'], payload['reorder_point'])
+
+
+@job('stock.replenished')
+def notify_replenished(payload):
+    current_app.logger.info('Stock replenished: %s has %s (reorder point %s)',
+                            payload['sku'], payload['stock_quantity'], payload['reorder_point'])
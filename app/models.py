@@ -3,6 +3,20 @@ from flask_login import UserMixin
 from . import db # Import db instance from app package __init__
 from sqlalchemy import CheckConstraint
 from decimal import Decimal # For price
+from datetime import datetime, timezone
+from functools import lru_cache
+import secrets
+
+
+def utcnow():
+    """Naive UTC timestamp, matching how DateTime columns are stored."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@lru_cache(maxsize=1)
+def _dummy_password_hash():
+    # Same method/cost as set_password, so verifying against it takes as long
+    return generate_password_hash(secrets.token_hex(16))
 
 
 class User(UserMixin, db.Model):
@@ -23,6 +37,16 @@ class User(UserMixin, db.Model):
         """Checks if the provided password matches the hash."""
         return check_password_hash(self.password_hash, password)
 
+    @staticmethod
+    def check_dummy_password(password):
+        """Burns the same hashing work as check_password for an unknown user.
+
+        Keeps login response times uniform so usernames can't be enumerated by
+        timing. The dummy hash is generated once per process and reused.
+        """
+        check_password_hash(_dummy_password_hash(), password)
+        return False
+
     # Flask-Login expects these properties/methods if not using UserMixin defaults
     # UserMixin provides suitable defaults for these based on the 'id' field
     # def get_id(self): # Provided by UserMixin
@@ -54,21 +78,280 @@ class Product(db.Model):
     image_url = db.Column(db.String(255), nullable=True)
     stock_quantity = db.Column(db.Integer, nullable=False, default=0)
     is_active = db.Column(db.Boolean, default=True, nullable=False, index=True)
-    # Optional: Timestamps
-    # date_created = db.Column(db.DateTime, default=datetime.utcnow)
-    # date_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Low-stock alerting: is_low_stock is kept equal to stock_quantity <= reorder_point
+    # by app/low_stock.py, and only low rows are in ix_products_low_stock
+    reorder_point = db.Column(db.Integer, nullable=True)
+    is_low_stock = db.Column(db.Boolean, default=False, nullable=False)
+    # Timestamps; date_updated also changes on set-based updates (Core applies onupdate)
+    # and is part of the template fragment cache key (see app/fragment_cache.py)
+    date_created = db.Column(db.DateTime, default=utcnow, nullable=False)
+    date_updated = db.Column(db.DateTime, default=utcnow, onupdate=utcnow, nullable=False)
+    # Optimistic concurrency: ORM updates check and bump it (a stale write raises StaleDataError)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
     # Add constraints directly to the table args or within Column definitions if supported
     __table_args__ = (
         CheckConstraint('price >= 0', name='ck_product_price_non_negative'),
         CheckConstraint('stock_quantity >= 0', name='ck_product_stock_non_negative'),
+        CheckConstraint('reorder_point >= 0', name='ck_product_reorder_point_non_negative'),
+        # Partial index: holds only the (few) products below their reorder point
+        db.Index('ix_products_low_stock', 'stock_quantity',
+                 sqlite_where=db.text('is_low_stock = 1'), postgresql_where=db.text('is_low_stock')),
+        # SKUs are unique case-insensitively; also serves the lower(sku) lookups
+        db.Index('ix_products_sku_lower', db.func.lower(sku), unique=True),
     )
+    # Deleting a product that is already gone stays a no-op, as before versioning
+    __mapper_args__ = {'version_id_col': version, 'confirm_deleted_rows': False}
 
     def __repr__(self):
         return f'<Product {self.sku}: {self.name}>'
 
-    # Potential helper methods can be added later, e.g.:
-    # def adjust_stock(self, quantity_change):
-    #     if self.stock_quantity + quantity_change < 0:
-    #         raise ValueError("Stock cannot go below zero.")
-    #     self.stock_quantity += quantity_change
\ No newline at end of file
+    def adjust_stock(self, quantity_change):
+        """Add (or remove, if negative) stock. Raises ValueError instead of going below zero."""
+        if self.stock_quantity + quantity_change < 0:
+            raise ValueError("Stock cannot go below zero.")
+        self.stock_quantity += quantity_change
+
+
+class RateLimitCounter(db.Model):
+    """Shared sliding-window counter row, used when LOGIN_RATE_LIMIT_STORAGE='database'."""
+    __tablename__ = 'rate_limit_counters'
+
+    key = db.Column(db.String(255), primary_key=True)
+    window_index = db.Column(db.Integer, nullable=False)
+    current = db.Column(db.Integer, nullable=False, default=0)
+    previous = db.Column(db.Integer, nullable=False, default=0)
+    expires_at = db.Column(db.Float, nullable=False, index=True) # Epoch seconds, for TTL eviction
+
+    def __repr__(self):
+        return f'<RateLimitCounter {self.key}>'
+
+
+
+class CategoryFacet(db.Model):
+    """Product counts per (category, is_active), maintained by app/facets.py."""
+    __tablename__ = 'category_facets'
+
+    category = db.Column(db.String(80), primary_key=True) # '' for uncategorized products
+    is_active = db.Column(db.Boolean, primary_key=True)
+    product_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CategoryFacet {self.category!r} active={self.is_active}: {self.product_count}>'
+
+
+
+class OutboxJob(db.Model):
+    """Background job written in the same transaction as the change that caused it (see app/jobs.py)."""
+    __tablename__ = 'outbox_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String(80), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}') # JSON
+    status = db.Column(db.String(16), nullable=False, default='pending') # pending/running/done/failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_after = db.Column(db.DateTime, nullable=False, default=utcnow)
+    locked_by = db.Column(db.String(80), nullable=True, index=True) # Claim token of the worker running it
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    request_id = db.Column(db.String(64), nullable=True) # Of the request that enqueued it (see app/logs.py)
+
+    __table_args__ = (
+        # Workers poll with status='pending' AND run_after <= now ORDER BY id
+        db.Index('ix_outbox_jobs_status_run_after', 'status', 'run_after'),
+    )
+
+    def __repr__(self):
+        return f'<OutboxJob {self.id} {self.topic} {self.status}>'
+
+
+
+class ProductPrice(db.Model):
+    """One row per price a product has had; effective_to is NULL for the current price.
+
+    Maintained by app/price_history.py. There is no foreign key to products so
+    the history of a deleted product is kept for order disputes.
+    """
+    __tablename__ = 'product_prices'
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, nullable=False)
+    sku = db.Column(db.String(80), nullable=False) # Lower-cased SKU the product had while this price applied
+    price = db.Column(db.Numeric(10, 2), nullable=False)
+    effective_from = db.Column(db.DateTime, nullable=False)
+    effective_to = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # Point-in-time lookups: seek to the product, then range-scan effective_from
+        db.Index('ix_product_prices_product_id_effective', 'product_id', 'effective_from', 'effective_to'),
+        db.Index('ix_product_prices_sku_effective', 'sku', 'effective_from', 'effective_to'),
+    )
+
+    def __repr__(self):
+        return f'<ProductPrice {self.sku} {self.price} from {self.effective_from}>'
+
+
+
+class StockMovement(db.Model):
+    """Ledger of stock changes (sales, receipts, adjustments); the source for rebuilding rollups.
+
+    Written by app/reporting.py in the same flush as the stock change.
+    """
+    __tablename__ = 'stock_movements'
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, nullable=False) # No FK: movements outlive deleted products
+    category = db.Column(db.String(80), nullable=False, default='') # '' for uncategorized
+    kind = db.Column(db.String(16), nullable=False) # sale / adjustment
+    quantity = db.Column(db.Integer, nullable=False) # Signed change in stock_quantity
+    amount = db.Column(db.Numeric(12, 2), nullable=False, default=0) # Revenue, for sales
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow, index=True)
+
+    def __repr__(self):
+        return f'<StockMovement {self.kind} product={self.product_id} {self.quantity:+d}>'
+
+
+def _rollup_metrics():
+    return (
+        db.Column('units_sold', db.Integer, nullable=False, default=0),
+        db.Column('revenue', db.Numeric(14, 2), nullable=False, default=0),
+        db.Column('units_in', db.Integer, nullable=False, default=0), # Positive adjustments (receipts)
+        db.Column('units_out', db.Integer, nullable=False, default=0), # Negative adjustments other than sales
+    )
+
+
+class ProductRollup(db.Model):
+    """Hourly and daily totals per product, maintained incrementally by app/reporting.py."""
+    __tablename__ = 'product_rollups'
+
+    period = db.Column(db.String(4), primary_key=True) # 'hour' or 'day'
+    bucket = db.Column(db.DateTime, primary_key=True) # Start of the hour/day, UTC
+    product_id = db.Column(db.Integer, primary_key=True)
+    units_sold, revenue, units_in, units_out = _rollup_metrics()
+
+    def __repr__(self):
+        return f'<ProductRollup {self.period} {self.bucket} product={self.product_id}>'
+
+
+class CategoryRollup(db.Model):
+    """Hourly and daily totals per category, maintained incrementally by app/reporting.py."""
+    __tablename__ = 'category_rollups'
+
+    period = db.Column(db.String(4), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    category = db.Column(db.String(80), primary_key=True) # '' for uncategorized
+    units_sold, revenue, units_in, units_out = _rollup_metrics()
+
+    def __repr__(self):
+        return f'<CategoryRollup {self.period} {self.bucket} {self.category!r}>'
+
+
+
+class BackfillProgress(db.Model):
+    """Checkpoint of an online backfill (see app/backfills.py); committed with each batch."""
+    __tablename__ = 'backfill_progress'
+
+    name = db.Column(db.String(80), primary_key=True)
+    status = db.Column(db.String(16), nullable=False, default='pending') # pending/running/paused/done/failed
+    last_id = db.Column(db.Integer, nullable=False, default=0) # Every row with id <= last_id is done
+    max_id = db.Column(db.Integer, nullable=True) # Highest id when the current run started
+    batches = db.Column(db.Integer, nullable=False, default=0)
+    rows_updated = db.Column(db.Integer, nullable=False, default=0)
+    locked_by = db.Column(db.String(80), nullable=True) # Runner currently working on it
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    def __repr__(self):
+        return f'<BackfillProgress {self.name} {self.status} last_id={self.last_id}>'
+
+
+
+class ProductChange(db.Model):
+    """One entry of the product change feed (see app/change_feed.py), in commit order by seq."""
+    __tablename__ = 'product_changes'
+
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=False) # Allocated from change_sequences
+    product_id = db.Column(db.Integer, nullable=False) # No FK: tombstones outlive the product
+    op = db.Column(db.String(1), nullable=False) # U (created or updated) / D (deleted)
+    sku = db.Column(db.String(80), nullable=True) # SKU at deletion, for tombstones
+    changed_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    __table_args__ = (
+        # Compaction looks for a newer entry of the same product
+        db.Index('ix_product_changes_product_id_seq', 'product_id', 'seq'),
+    )
+
+    def __repr__(self):
+        return f'<ProductChange {self.seq} {self.op} product={self.product_id}>'
+
+
+class ChangeSequence(db.Model):
+    """Counter the change feed allocates seq numbers from; its row lock orders them by commit."""
+    __tablename__ = 'change_sequences'
+
+    name = db.Column(db.String(40), primary_key=True)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
+    # Tombstones up to here were compacted away; cursors older than this must resync
+    compacted_seq = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ChangeSequence {self.name} {self.last_seq}>'
+
+
+
+class StockLocation(db.Model):
+    """A warehouse or store that holds stock (see app/inventory.py)."""
+    __tablename__ = 'stock_locations'
+
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(32), unique=True, nullable=False)
+    name = db.Column(db.String(120), nullable=False)
+    priority = db.Column(db.Integer, nullable=False, default=100) # Lower ships first when allocating
+    is_active = db.Column(db.Boolean, nullable=False, default=True) # Inactive locations aren't allocated from
+
+    def __repr__(self):
+        return f'<StockLocation {self.code}>'
+
+
+class LocationStock(db.Model):
+    """Quantity of one product at one location.
+
+    Product.stock_quantity is kept equal to the sum of a product's rows by
+    app/inventory.py, so pages read the total without aggregating.
+    """
+    __tablename__ = 'location_stock'
+
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    location_id = db.Column(db.Integer, db.ForeignKey('stock_locations.id'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        CheckConstraint('quantity >= 0', name='ck_location_stock_quantity_non_negative'),
+        db.Index('ix_location_stock_location_id_product_id', 'location_id', 'product_id'),
+    )
+
+    def __repr__(self):
+        return f'<LocationStock product={self.product_id} location={self.location_id}: {self.quantity}>'
+
+
+# --- Archive (see app/archive.py) ---------------------------------------------
+
+def _archive_table(name, source, *extra):
+    """A table with `source`'s columns but none of its defaults, constraints or indexes, so rows keep their ids."""
+    columns = [db.Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable,
+                         autoincrement=False) for column in source.columns]
+    return db.Table(name, *columns, *extra)
+
+
+# Long-inactive products, moved out of `products` with their price history and location stock
+archived_products = _archive_table('archived_products', Product.__table__,
+                                   db.Column('archived_at', db.DateTime, nullable=False, index=True))
+db.Index('ix_archived_products_sku_lower', db.func.lower(archived_products.c.sku))
+archived_product_prices = _archive_table('archived_product_prices', ProductPrice.__table__,
+                                         db.Index('ix_archived_product_prices_product_id', 'product_id'))
+archived_location_stock = _archive_table('archived_location_stock', LocationStock.__table__)
@@ -0,0 +1,155 @@
+"""Price history with effective-from / effective-to rows.
+
+Every time a product's price or SKU is set (on insert, on edit, or by a
+bulk update) the open `product_prices` row is closed and a new one opened,
+in the same transaction. Each row keeps the SKU the product had while it
+applied, so "what was the price of SKU X at T" is a range condition that the
+(sku, effective_from, effective_to) index answers directly, even after the
+product was renamed or its old SKU reused, and `prices_as_of` resolves any
+number of SKUs in a single query.
+"""
+import click
+from sqlalchemy import event, select, update, insert, or_, and_, exists, func, bindparam
+
+from . import db
+from .models import Product, ProductPrice, utcnow
+from .signals import products_bulk_updated
+from .tracking import has_changes
+
+
+@event.listens_for(db.session, 'after_flush')
+def _record_price_changes(session, flush_context):
+    # After the flush new products have ids; session.new/dirty and attribute
+    # history still describe what was just written
+    opened, closed = [], []
+    for obj in session.new:
+        if isinstance(obj, Product):
+            opened.append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            closed.append(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Product) and obj not in session.deleted:
+            if has_changes(obj, ('price', 'sku')): # A rename starts a row under the new SKU
+                closed.append(obj.id)
+                opened.append(obj)
+    if not (opened or closed):
+        return
+
+    now = utcnow()
+    table = ProductPrice.__table__
+    connection = session.connection()
+    if closed:
+        connection.execute(update(table).where(table.c.product_id.in_(closed), table.c.effective_to.is_(None))
+                           .values(effective_to=now))
+    if opened:
+        connection.execute(insert(table), [
+            {'product_id': obj.id, 'sku': obj.sku.lower(), 'price': obj.price, 'effective_from': now}
+            for obj in opened])
+
+
+@products_bulk_updated.connect
+def _after_bulk_update(sender, session, ids, fields, **kwargs):
+    if 'price' not in fields:
+        return
+    now = utcnow()
+    table = ProductPrice.__table__
+    products = Product.__table__
+    current_price = (select(products.c.price).where(products.c.id == table.c.product_id)
+                     .scalar_subquery())
+    session.execute(
+        update(table).where(table.c.product_id.in_(ids), table.c.effective_to.is_(None),
+                            table.c.price != current_price)
+        .values(effective_to=now))
+    has_open_row = exists().where(table.c.product_id == products.c.id, table.c.effective_to.is_(None))
+    session.execute(insert(table).from_select(
+        ['product_id', 'sku', 'price', 'effective_from'],
+        select(products.c.id, func.lower(products.c.sku), products.c.price, db.literal(now, db.DateTime))
+        .where(products.c.id.in_(ids), ~has_open_row)))
+
+
+def _in_effect(as_of):
+    return and_(ProductPrice.effective_from <= as_of,
+                or_(ProductPrice.effective_to.is_(None), ProductPrice.effective_to > as_of))
+
+
+def prices_as_of(as_of, skus):
+    """{sku: price} for every SKU that had a price at `as_of`, in one query.
+
+    SKUs are matched case-insensitively and returned lower-cased. The whole
+    list goes into one IN (...) clause; SQLite accepts up to 32766 values.
+    """
+    skus = list({sku.lower() for sku in skus})
+    if not skus:
+        return {}
+    rows = db.session.execute(
+        select(ProductPrice.sku, ProductPrice.price).where(ProductPrice.sku.in_(skus), _in_effect(as_of)))
+    return {sku: price for sku, price in rows}
+
+
+def price_history(sku):
+    """All price rows of the product with this SKU, oldest first, including those under earlier SKUs.
+
+    For a SKU that no product has now (deleted, archived or renamed), the rows
+    recorded under it.
+    """
+    sku = sku.lower()
+    product_id = db.session.scalar(select(Product.id).where(func.lower(Product.sku) == sku))
+    where = ProductPrice.sku == sku if product_id is None else ProductPrice.product_id == product_id
+    return db.session.scalars(
+        select(ProductPrice).where(where).order_by(ProductPrice.effective_from, ProductPrice.id)).all()
+
+
+def compact_price_history(chunk_size=1000):
+    """Merge consecutive closed rows with the same price and SKU and drop zero-length rows.
+
+    Open (current) rows are left alone so a concurrent price change can't end
+    up with two open rows. Works through products in chunks, one transaction
+    per chunk. Returns the number of rows removed.
+    """
+    table = ProductPrice.__table__
+    removed = 0
+    last_product_id = 0
+    while True:
+        product_ids = db.session.scalars(
+            select(table.c.product_id).where(table.c.product_id > last_product_id)
+            .group_by(table.c.product_id).order_by(table.c.product_id).limit(chunk_size)).all()
+        if not product_ids:
+            break
+        rows = db.session.execute(
+            select(table.c.id, table.c.product_id, table.c.sku, table.c.price, table.c.effective_from,
+                   table.c.effective_to)
+            .where(table.c.product_id.in_(product_ids), table.c.effective_to.isnot(None))
+            .order_by(table.c.product_id, table.c.effective_from, table.c.id)).all()
+        deletes, new_ends = [], {}
+        keep = None # [id, product_id, sku, price, effective_to] of the row being extended
+        for row in rows:
+            if row.effective_to <= row.effective_from:
+                deletes.append(row.id) # Zero-length: the price never applied
+                continue
+            if keep and keep[1:4] == [row.product_id, row.sku, row.price] and keep[4] == row.effective_from:
+                keep[4] = new_ends[keep[0]] = row.effective_to
+                deletes.append(row.id)
+            else: # A rename boundary is kept: lookups by the old SKU end there
+                keep = [row.id, row.product_id, row.sku, row.price, row.effective_to]
+        try:
+            if new_ends:
+                db.session.execute(
+                    update(table).where(table.c.id == bindparam('row_id')).values(effective_to=bindparam('end')),
+                    [{'row_id': row_id, 'end': end} for row_id, end in new_ends.items()])
+            if deletes:
+                db.session.execute(table.delete().where(table.c.id.in_(deletes)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        removed += len(deletes)
+        last_product_id = product_ids[-1]
+    return removed
+
+
+@click.command('compact-prices')
+@click.option('--chunk-size', default=1000, show_default=True, type=int)
+def compact_prices_command(chunk_size):
+    """Merge redundant consecutive price history rows."""
+    click.echo(f'Removed {compact_price_history(chunk_size)} redundant price history rows.')
@@ -1,28 +1,31 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField
 from wtforms import StringField, TextAreaField, DecimalField, IntegerField, BooleanField, SubmitField
-from wtforms.validators import DataRequired, Length, NumberRange, Optional, URL, ValidationError
-from .models import Product # Import Product to check SKU uniqueness
-from . import db # Import db from app package
+from wtforms.validators import DataRequired, InputRequired, Length, NumberRange, Optional, URL
+from wtforms.widgets import HiddenInput
+from .images import parse_image_url
+
+
+class ImageURL(URL):
+    """An absolute URL, or the URL of an image stored by app/images.py (a path on this site)."""
+
+    def __call__(self, form, field):
+        if parse_image_url(field.data) is None:
+            super().__call__(form, field)
+
 
 class ProductForm(FlaskForm):
     sku = StringField('SKU', validators=[DataRequired(), Length(min=3, max=80)])
     name = StringField('Product Name', validators=[DataRequired(), Length(min=3, max=120)])
     description = TextAreaField('Description', validators=[Optional(), Length(max=5000)])
-    price = DecimalField('Price', validators=[DataRequired(), NumberRange(min=0)], places=2)
+    price = DecimalField('Price', validators=[InputRequired(), NumberRange(min=0)], places=2) # 0 is a valid value
     category = StringField('Category', validators=[Optional(), Length(max=80)])
-    image_url = StringField('Image URL', validators=[Optional(), URL(), Length(max=255)])
-    stock_quantity = IntegerField('Stock Quantity', validators=[DataRequired(), NumberRange(min=0)])
+    image_url = StringField('Image URL', validators=[Optional(), ImageURL(), Length(max=255)])
+    image_file = FileField('Or upload an image') # Stored by app/images.py; replaces image_url
+    stock_quantity = IntegerField('Stock Quantity', validators=[InputRequired(), NumberRange(min=0)]) # So is out of stock
+    reorder_point = IntegerField('Reorder Point', validators=[Optional(), NumberRange(min=0)])
     is_active = BooleanField('Product Active', default=True)
+    # Product.version the form was loaded at; an edit saved after another change is a conflict
+    version = IntegerField(widget=HiddenInput(), validators=[Optional()])
     submit = SubmitField('Save Product')
-
-    # Add validation for unique SKU - needs access to the original SKU during edit
-    def __init__(self, original_sku=None, *args, **kwargs):
-        super(ProductForm, self).__init__(*args, **kwargs)
-        self.original_sku = original_sku
-
-    def validate_sku(self, sku):
-        # If the SKU hasn't changed or it's a new product, check normally
-        if self.original_sku is None or sku.data.lower() != self.original_sku.lower():
-            product = Product.query.filter(db.func.lower(Product.sku) == db.func.lower(sku.data)).first()
-            if product:
-                raise ValidationError('This SKU is already taken. Please choose a different one.')
\ No newline at end of file
+    # No validate_sku query: the database's unique index on lower(sku) is the check (see products.py)
@@ -0,0 +1,77 @@
+"""Read-only product queries shared by the sync (app/api.py) and async (app/async_api.py) JSON APIs.
+
+They are Core statements over the products table, so the same statement runs
+on db.session or on an AsyncConnection and both paths return identical JSON.
+"""
+from sqlalchemy import select, func
+
+from .models import Product
+
+PRODUCT_COLUMNS = (Product.id, Product.sku, Product.name, Product.description, Product.price,
+                   Product.category, Product.image_url, Product.stock_quantity, Product.is_active)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_LOOKUP_SKUS = 1000
+
+
+class ProductQueryError(ValueError):
+    """Raised for invalid product query parameters."""
+
+
+def parse_flag(value):
+    """True/False for an `active`-style query parameter, None if it's absent."""
+    if value is None or value == '':
+        return None
+    return str(value).lower() in ('1', 'true', 'y', 'yes')
+
+
+def page_args(after_id=None, limit=None):
+    """Validated (after_id, limit) for a keyset page."""
+    try:
+        return (int(after_id) if after_id else None), min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        raise ProductQueryError('limit and after must be integers')
+
+
+def product_page_query(after_id=None, limit=None, category=None, active=None):
+    """Products ordered by id, starting after `after_id` (keyset pagination)."""
+    after_id, limit = page_args(after_id, limit)
+    statement = select(*PRODUCT_COLUMNS).order_by(Product.id).limit(limit)
+    if after_id is not None:
+        statement = statement.where(Product.id > after_id)
+    if category is not None:
+        statement = statement.where(Product.category == category)
+    if parse_flag(active) is not None:
+        statement = statement.where(Product.is_active == parse_flag(active))
+    return statement
+
+
+def product_by_sku_query(sku):
+    return select(*PRODUCT_COLUMNS).where(func.lower(Product.sku) == sku.lower())
+
+
+def sku_lookup_query(skus):
+    """One query for up to MAX_LOOKUP_SKUS SKUs, matched case-insensitively."""
+    if not isinstance(skus, list) or not all(isinstance(sku, str) for sku in skus):
+        raise ProductQueryError("'skus' must be a list of strings")
+    if len(skus) > MAX_LOOKUP_SKUS:
+        raise ProductQueryError(f'At most {MAX_LOOKUP_SKUS} SKUs per lookup')
+    return select(*PRODUCT_COLUMNS).where(func.lower(Product.sku).in_({sku.lower() for sku in skus}))
+
+
+def product_dict(row):
+    product = dict(row._mapping)
+    product['price'] = str(product['price'])
+    return product
+
+
+def page_result(rows):
+    products = [product_dict(row) for row in rows]
+    return {'products': products, 'next_after': products[-1]['id'] if products else None}
+
+
+def lookup_result(skus, rows, found=None):
+    """`found` holds products already resolved elsewhere (the catalog snapshot), keyed by lower-case SKU."""
+    products = dict(found or {})
+    products.update((row.sku.lower(), product_dict(row)) for row in rows)
+    return {'products': products, 'missing': sorted({sku.lower() for sku in skus} - products.keys())}
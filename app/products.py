@@ -1,34 +1,105 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, abort
+import re
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, current_app
 from flask_login import login_required, current_user # Import current_user if needed for roles later
 from . import db
 from .models import Product
 from .product_forms import ProductForm
+from .bulk_update import bulk_update_command
+from .facets import category_facets, rebuild_facets_command
+from .low_stock import low_stock_query
+from .price_history import compact_prices_command
+from .change_feed import changes_command, compact_changes_command
+from .db_routing import use_primary
+from .catalog import catalog_snapshot, SnapshotPagination
+from .logs import current_request_id
+from .archive import archive_command, restore_command, find_archived
+from .images import ImageError, ingest_upload
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.exc import StaleDataError
 
 products_bp = Blueprint('products', __name__, template_folder='templates/products')
+products_bp.cli.add_command(bulk_update_command) # flask products bulk-update ...
+products_bp.cli.add_command(rebuild_facets_command) # flask products rebuild-facets
+products_bp.cli.add_command(compact_prices_command) # flask products compact-prices
+products_bp.cli.add_command(changes_command) # flask products changes --since <cursor>
+products_bp.cli.add_command(compact_changes_command) # flask products compact-changes
+products_bp.cli.add_command(archive_command) # flask products archive [--older-than-days N]
+products_bp.cli.add_command(restore_command) # flask products restore <sku>
+
+SKU_TAKEN = 'This SKU is already taken. Please choose a different one.'
 
 @products_bp.route('/')
 @login_required
 def list_products():
     page = request.args.get('page', 1, type=int)
     per_page = 10 # Example pagination
-    pagination = Product.query.order_by(Product.name).paginate(page=page, per_page=per_page, error_out=False)
+    category = request.args.get('category') # '' selects uncategorized products
+    active = request.args.get('active', type=int) # 1 / 0, omitted for both
+    snapshot = catalog_snapshot() if active == 1 else None
+    if snapshot is not None: # Holds exactly the active products
+        pagination = SnapshotPagination(items=snapshot.by_name(category), page=page, per_page=per_page,
+                                        error_out=False)
+        return render_template('list_products.html', products=pagination.items, pagination=pagination,
+                               title="Products", facets=category_facets(), category=category, active=active)
+    query = Product.query
+    if category == '':
+        query = query.filter(db.or_(Product.category.is_(None), Product.category == ''))
+    elif category is not None:
+        query = query.filter(Product.category == category)
+    if active is not None:
+        query = query.filter(Product.is_active == bool(active))
+    pagination = query.order_by(Product.name).paginate(page=page, per_page=per_page, error_out=False)
     products = pagination.items
-    return render_template('list_products.html', products=products, pagination=pagination, title="Products")
+    return render_template('list_products.html', products=products, pagination=pagination, title="Products",
+                           facets=category_facets(), category=category, active=active)
+
+@products_bp.route('/low-stock')
+@login_required
+def low_stock():
+    page = request.args.get('page', 1, type=int)
+    pagination = low_stock_query().paginate(page=page, per_page=50, error_out=False)
+    return render_template('low_stock.html', products=pagination.items, pagination=pagination,
+                           title="Low Stock")
+
+def _report_error(message, *args):
+    """Log the exception being handled; returns a flash message that quotes its request id."""
+    current_app.logger.exception(message, *args)
+    return f'{message % args}. Please try again; if it keeps failing, quote reference {current_request_id()}.'
+
+
+def _attach_upload(form):
+    """Store the uploaded image, if any, as form.image_url. False (with a form error) if it isn't one we take."""
+    if not form.image_file.data:
+        return True
+    try:
+        form.image_url.data = ingest_upload(form.image_file.data) # Thumbnails are made by a job
+    except ImageError as e:
+        form.image_file.errors.append(str(e))
+        return False
+    return True
+
+
+SKU_INDEXES = ('ix_products_sku', 'ix_products_sku_lower')
+# SQLite names an expression index, but reports a plain unique column index by its column
+_SKU_INDEX_MESSAGE = re.compile(r"UNIQUE constraint failed: (index '(ix_products_sku|ix_products_sku_lower)'|products\.sku$)")
+
+
+def _sku_taken(error):
+    """Whether an IntegrityError comes from the unique SKU indexes, not from another constraint naming a sku."""
+    constraint = getattr(getattr(error.orig, 'diag', None), 'constraint_name', None) # psycopg2
+    if constraint is not None:
+        return constraint in SKU_INDEXES
+    return _SKU_INDEX_MESSAGE.search(str(error.orig)) is not None
+
 
 @products_bp.route('/add', methods=['GET', 'POST'])
 @login_required
 def add_product():
     form = ProductForm()
-    if form.validate_on_submit():
-        # Check SKU uniqueness again explicitly here in case of race conditions,
-        # though form validation should handle most cases.
-        existing_product = Product.query.filter(db.func.lower(Product.sku) == db.func.lower(form.sku.data)).first()
-        if existing_product:
-             flash('SKU already exists.', 'danger')
-             # Re-rendering might clear other fields depending on setup, consider alternatives
-             return render_template('product_form.html', title='Add New Product', form=form)
-
+    if form.validate_on_submit() and _attach_upload(form):
+        # No SKU pre-check: the unique index rejects duplicates, without a race and in one round-trip
         new_product = Product(
             sku=form.sku.data,
             name=form.name.data,
@@ -37,20 +108,23 @@ def add_product():
             category=form.category.data,
             image_url=form.image_url.data,
             stock_quantity=form.stock_quantity.data,
+            reorder_point=form.reorder_point.data,
             is_active=form.is_active.data
         )
         db.session.add(new_product)
         try:
             db.session.commit()
-            flash(f'Product {new_product.sku} added successfully!', 'success')
+            flash(f'Product {form.sku.data} added successfully!', 'success') # Not new_product: no reload after commit
             return redirect(url_for('products.list_products'))
         except IntegrityError as e:
             db.session.rollback()
-            # Log the error e
-            flash(f'Database error occurred: {e}', 'danger') # More specific error might be needed
-        except Exception as e:
+            if _sku_taken(e):
+                form.sku.errors.append(SKU_TAKEN)
+            else:
+                flash(_report_error('Could not add product %s', form.sku.data), 'danger')
+        except Exception:
              db.session.rollback()
-             flash(f'An error occurred: {e}', 'danger')
+             flash(_report_error('Could not add product %s', form.sku.data), 'danger')
 
     # For GET request or failed validation
     return render_template('product_form.html', title='Add New Product', form=form)
@@ -58,18 +132,31 @@ def add_product():
 @products_bp.route('/<sku>')
 @login_required
 def view_product(sku):
-    product = Product.query.filter(db.func.lower(Product.sku) == db.func.lower(sku)).first_or_404()
+    snapshot = catalog_snapshot()
+    product = snapshot.get_by_sku(sku) if snapshot is not None else None
+    if product is None: # Inactive, unknown, or no snapshot
+        product = Product.query.filter(db.func.lower(Product.sku) == db.func.lower(sku)).first()
+    if product is None: # Only SKUs that aren't live pay for the archive lookup
+        archived = find_archived(sku)
+        if archived is None:
+            abort(404)
+        return render_template('view_product.html', product=archived, archived_at=archived.archived_at,
+                               title=f"View {archived.name}")
     return render_template('view_product.html', product=product, title=f"View {product.name}")
 
 
 @products_bp.route('/<sku>/edit', methods=['GET', 'POST'])
 @login_required
+@use_primary # The form is prefilled with what the user is about to overwrite
 def edit_product(sku):
     product = Product.query.filter(db.func.lower(Product.sku) == db.func.lower(sku)).first_or_404()
-    # Pass original SKU to form for validation check
-    form = ProductForm(obj=product, original_sku=product.sku)
+    form = ProductForm(obj=product)
 
-    if form.validate_on_submit():
+    if form.validate_on_submit() and _attach_upload(form):
+        product_id = product.id
+        if form.version.data is not None:
+            # The UPDATE matches the version the form was loaded at, not the one just read
+            set_committed_value(product, 'version', form.version.data)
         # Update product fields from form data
         product.sku = form.sku.data # Be careful if SKU is allowed to change
         product.name = form.name.data
@@ -78,20 +165,32 @@ def edit_product(sku):
         product.category = form.category.data
         product.image_url = form.image_url.data
         product.stock_quantity = form.stock_quantity.data
+        product.reorder_point = form.reorder_point.data
         product.is_active = form.is_active.data
         try:
             db.session.commit()
-            flash(f'Product {product.sku} updated successfully!', 'success')
+            flash(f'Product {form.sku.data} updated successfully!', 'success')
             return redirect(url_for('products.list_products'))
+        except StaleDataError:
+            db.session.rollback()
+            current_version = db.session.scalar(select(Product.version).where(Product.id == product_id))
+            if current_version is None:
+                flash('This product was deleted while you were editing it.', 'danger')
+                return redirect(url_for('products.list_products'))
+            # Saving again overwrites the other change, knowingly
+            form.version.data, form.version.raw_data = current_version, None # raw_data would render the old one
+            flash('Someone else changed this product while you were editing it. Check the product, then save '
+                  'again to overwrite their change.', 'warning')
+            return render_template('product_form.html', title='Edit Product', form=form, product=product), 409
         except IntegrityError as e:
              db.session.rollback()
-             # This could happen if changing SKU to an existing one
-             flash(f'Database error: Could not update product. SKU may already exist. {e}', 'danger')
-             # Re-render form with error, might need to handle form repopulation better
-             return render_template('product_form.html', title='Edit Product', form=form, product=product)
-        except Exception as e:
+             if _sku_taken(e):
+                 form.sku.errors.append(SKU_TAKEN)
+             else:
+                 flash(_report_error('Could not update product %s', sku), 'danger')
+        except Exception:
              db.session.rollback()
-             flash(f'An error occurred: {e}', 'danger')
+             flash(_report_error('Could not update product %s', sku), 'danger')
 
     elif request.method == 'GET':
         # Pre-populate form with existing product data is handled by passing obj=product to form constructor
@@ -107,8 +206,7 @@ def delete_product(sku):
         db.session.delete(product)
         db.session.commit()
         flash(f'Product {product.sku} deleted.', 'success')
-    except Exception as e:
+    except Exception:
         db.session.rollback()
-        flash(f'Error deleting product {product.sku}: {e}', 'danger')
-        # Log the error
+        flash(_report_error('Could not delete product %s', sku), 'danger')
     return redirect(url_for('products.list_products'))
@@ -0,0 +1,263 @@
+"""Per-request profiling.
+
+With PROFILING_ENABLED, a request is profiled when
+  - its endpoint is listed in PROFILING_ENDPOINTS (e.g. 'products.edit_product'),
+  - it falls in the random PROFILING_SAMPLE_RATE fraction, or
+  - an admin asks for it with an `X-Profile: 1` header or `?_profile=1`.
+
+PROFILING_MODE picks the profiler: 'cprofile' is exact but slows the request
+down, and profiles one request at a time per process (from Python 3.12 only
+one cProfile can be active; overlapping requests are simply not profiled);
+'sampling' has a background thread record the request thread's stack
+every PROFILING_SAMPLE_INTERVAL seconds, which costs little. Profiles are
+written to PROFILING_DIR (default: <instance>/profiles): a pstats file
+(`.prof`, for snakeviz / `python -m pstats`) or collapsed stacks
+(`.collapsed`, for flamegraph.pl / speedscope), each with a `.json` of
+request details. `flask profiles list|show|purge` works with them.
+
+When PROFILING_ENABLED is off no hooks are registered, so requests pay nothing.
+"""
+import cProfile
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import click
+from flask import current_app, g, request
+from flask.cli import with_appcontext
+from flask_login import current_user
+
+MODES = ('cprofile', 'sampling')
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ARG = '_profile'
+SUFFIXES = ('.json', '.prof', '.collapsed')
+
+_cprofile_lock = threading.Lock() # Held while a request is being profiled with cProfile
+
+
+class StackSampler:
+    """Counts the stacks of one thread, sampled from a background thread."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Brendan Gregg's collapsed format: `frame;frame;frame count` per line."""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def profile_dir(app):
+    return app.config['PROFILING_DIR'] or os.path.join(app.instance_path, 'profiles')
+
+
+def _requested_by_admin():
+    flag = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_ARG)
+    if flag not in ('1', 'true', 'yes'):
+        return False
+    return current_user.is_authenticated and current_user.role == 'admin'
+
+
+def _should_profile(config):
+    if request.endpoint in config['PROFILING_ENDPOINTS']:
+        return True
+    if config['PROFILING_SAMPLE_RATE'] and random.random() < config['PROFILING_SAMPLE_RATE']:
+        return True
+    return _requested_by_admin()
+
+
+def _start_profiling():
+    config = current_app.config
+    if not _should_profile(config):
+        return
+    if config['PROFILING_MODE'] == 'sampling':
+        profiler = StackSampler(config['PROFILING_SAMPLE_INTERVAL'])
+        profiler.start()
+    else:
+        if not _cprofile_lock.acquire(blocking=False):
+            return # Another request is being profiled
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError: # Some other tool (a debugger, coverage) holds the profiling hook
+            _cprofile_lock.release()
+            return
+    g.profiler = profiler
+    g.profile_started = time.perf_counter()
+
+
+def _record_status(response):
+    if 'profiler' in g:
+        g.profile_status = response.status_code
+    return response
+
+
+def _finish_profiling(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    if isinstance(profiler, StackSampler):
+        profiler.stop()
+    else:
+        profiler.disable()
+        _cprofile_lock.release()
+    elapsed_ms = (time.perf_counter() - g.pop('profile_started')) * 1000
+    app = current_app._get_current_object()
+    directory = profile_dir(app)
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    name = f"{now:%Y%m%dT%H%M%S%f}-{request.endpoint or 'unknown'}"
+    if isinstance(profiler, StackSampler):
+        with open(os.path.join(directory, name + '.collapsed'), 'w') as f:
+            f.write(profiler.collapsed())
+    else:
+        profiler.dump_stats(os.path.join(directory, name + '.prof'))
+    details = {
+        'time': now.isoformat(), 'endpoint': request.endpoint, 'method': request.method, 'path': request.path,
+        'status': g.pop('profile_status', 500 if exc else None), 'duration_ms': round(elapsed_ms, 1),
+        'mode': 'sampling' if isinstance(profiler, StackSampler) else 'cprofile',
+    }
+    with open(os.path.join(directory, name + '.json'), 'w') as f:
+        json.dump(details, f)
+    _prune(directory, app.config['PROFILING_MAX_FILES'])
+
+
+def list_profiles(directory):
+    """Details of the captured profiles, oldest first, each with its `name` and `file`."""
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        name = filename[:-len('.json')]
+        with open(os.path.join(directory, filename)) as f:
+            details = json.load(f)
+        suffix = '.collapsed' if details.get('mode') == 'sampling' else '.prof'
+        details.update(name=name, file=os.path.join(directory, name + suffix))
+        profiles.append(details)
+    return profiles
+
+
+def _prune(directory, max_profiles):
+    # Names start with the capture time, so sorting them is oldest first; no need to read the details
+    names = sorted(filename[:-len('.json')] for filename in os.listdir(directory) if filename.endswith('.json'))
+    for name in names[:max(len(names) - max_profiles, 0)]:
+        _delete(directory, name)
+
+
+def _delete(directory, name):
+    for suffix in SUFFIXES:
+        try:
+            os.remove(os.path.join(directory, name + suffix))
+        except FileNotFoundError:
+            pass
+
+
+def summarize_collapsed(path, limit):
+    """(function, self samples, total samples) for the functions most often on top of the stack."""
+    own, total = Counter(), Counter()
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            frames = stack.split(';')
+            own[frames[-1]] += int(count)
+            for frame in set(frames):
+                total[frame] += int(count)
+    return [(frame, count, total[frame]) for frame, count in own.most_common(limit)]
+
+
+def init_app(app):
+    app.config.setdefault('PROFILING_ENABLED', False)
+    app.config.setdefault('PROFILING_MODE', 'sampling') # 'sampling' or 'cprofile'
+    app.config.setdefault('PROFILING_SAMPLE_RATE', 0.0) # Fraction of all requests
+    app.config.setdefault('PROFILING_ENDPOINTS', ()) # Always profiled, e.g. ('auth.login',)
+    app.config.setdefault('PROFILING_SAMPLE_INTERVAL', 0.005) # Seconds, sampling mode
+    app.config.setdefault('PROFILING_DIR', None) # Default: <instance>/profiles
+    app.config.setdefault('PROFILING_MAX_FILES', 500) # Oldest profiles are deleted beyond this
+    app.cli.add_command(profiles_cli)
+    if not app.config['PROFILING_ENABLED']:
+        return
+    if app.config['PROFILING_MODE'] not in MODES:
+        raise ValueError(f"PROFILING_MODE must be one of {', '.join(MODES)}")
+    app.before_request(_start_profiling)
+    app.after_request(_record_status)
+    app.teardown_request(_finish_profiling)
+
+
+@click.group('profiles')
+def profiles_cli():
+    """Inspect request profiles captured with PROFILING_ENABLED."""
+
+
+@profiles_cli.command('list')
+@click.option('--endpoint', default=None, help='Only profiles of this endpoint.')
+@with_appcontext
+def profiles_list(endpoint):
+    """List captured profiles, oldest first."""
+    profiles = [p for p in list_profiles(profile_dir(current_app)) if endpoint in (None, p['endpoint'])]
+    for p in profiles:
+        click.echo(f"{p['name']:60} {p['mode']:9} {p['method']:6} {p['status'] or '-'!s:4} "
+                   f"{p['duration_ms']:9.1f} ms  {p['path']}")
+    click.echo(f'{len(profiles)} profiles.')
+
+
+@profiles_cli.command('show')
+@click.argument('name')
+@click.option('--limit', type=int, default=25, show_default=True, help='Functions to show.')
+@click.option('--sort', default='cumulative', show_default=True, help='pstats sort key (cProfile profiles).')
+@with_appcontext
+def profiles_show(name, limit, sort):
+    """Summarize one profile: top functions by time (cProfile) or by samples (sampling)."""
+    profile = next((p for p in list_profiles(profile_dir(current_app)) if p['name'] == name), None)
+    if profile is None:
+        raise click.ClickException(f'No profile named {name}')
+    click.echo(f"{profile['method']} {profile['path']} -> {profile['status']}, {profile['duration_ms']} ms "
+               f"({profile['mode']})")
+    if profile['mode'] == 'cprofile':
+        stats = pstats.Stats(profile['file'], stream=click.get_text_stream('stdout'))
+        stats.sort_stats(sort).print_stats(limit)
+        return
+    click.echo(f"{'self':>6} {'total':>6}  function")
+    for frame, own, total in summarize_collapsed(profile['file'], limit):
+        click.echo(f'{own:6} {total:6}  {frame}')
+
+
+@profiles_cli.command('purge')
+@click.option('--endpoint', default=None, help='Only profiles of this endpoint.')
+@with_appcontext
+def profiles_purge(endpoint):
+    """Delete captured profiles."""
+    directory = profile_dir(current_app)
+    profiles = [p for p in list_profiles(directory) if endpoint in (None, p['endpoint'])]
+    for p in profiles:
+        _delete(directory, p['name'])
+    click.echo(f'{len(profiles)} profiles deleted.')
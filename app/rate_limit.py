@@ -0,0 +1,221 @@
+"""Sliding-window rate limiting for login attempts.
+
+Counts are kept with the "sliding window counter" approximation: for every key
+we only remember the current fixed window and the one before it, and weight the
+previous window by how much of it still overlaps the sliding window. That keeps
+memory at O(1) per key no matter how many attempts are made.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+
+def _window_state(window_index, current, previous, now_index):
+    """Shift a stored (window_index, current, previous) triple to now_index."""
+    if window_index == now_index:
+        return current, previous
+    if window_index == now_index - 1:
+        return 0, current
+    return 0, 0 # Both windows have expired
+
+
+def _estimate(current, previous, now, window):
+    """Weighted attempt count over the last `window` seconds."""
+    elapsed = (now % window) / window
+    return current + previous * (1 - elapsed)
+
+
+class MemoryStorage:
+    """Per-process storage. Good enough for a single worker or for tests."""
+
+    def __init__(self, sweep_interval=60):
+        # key -> [window_index, current, previous], ordered by last touch so
+        # stale keys can be evicted from the front without scanning everything
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweep_interval = sweep_interval
+        self._next_sweep = 0
+
+    def __len__(self):
+        return len(self._counters)
+
+    def get(self, key, window, now):
+        now_index = int(now // window)
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is None:
+                return 0
+            current, previous = _window_state(*entry, now_index)
+        return _estimate(current, previous, now, window)
+
+    def hit(self, key, window, now):
+        now_index = int(now // window)
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is None:
+                current, previous = 0, 0
+            else:
+                current, previous = _window_state(*entry, now_index)
+            self._counters[key] = [now_index, current + 1, previous]
+            self._counters.move_to_end(key)
+            self._evict(window, now)
+        return _estimate(current + 1, previous, now, window)
+
+    def reset(self, key):
+        with self._lock:
+            self._counters.pop(key, None)
+
+    def _evict(self, window, now):
+        """Drop keys that have not been touched for two full windows (TTL)."""
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self._sweep_interval
+        oldest_live = int(now // window) - 1
+        while self._counters:
+            key, entry = next(iter(self._counters.items()))
+            if entry[0] >= oldest_live:
+                break
+            del self._counters[key]
+
+
+class DatabaseStorage:
+    """Shares counters between workers through the `rate_limit_counters` table.
+
+    Uses its own short transactions on the engine so a rollback of the request
+    session never loses (or keeps) a counted attempt. Like MemoryStorage, each
+    process deletes expired rows at most every `sweep_interval` seconds, after
+    a hit.
+    """
+
+    def __init__(self, engine, sweep_interval=60):
+        self.engine = engine
+        self._sweep_interval = sweep_interval
+        self._next_sweep = 0
+
+    @property
+    def table(self):
+        from .models import RateLimitCounter
+        return RateLimitCounter.__table__
+
+    def get(self, key, window, now):
+        now_index = int(now // window)
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                self.table.select().where(self.table.c.key == key)
+            ).first()
+        if row is None:
+            return 0
+        current, previous = _window_state(row.window_index, row.current, row.previous, now_index)
+        return _estimate(current, previous, now, window)
+
+    def hit(self, key, window, now):
+        count = self._hit(key, window, now)
+        if now >= self._next_sweep:
+            self._next_sweep = now + self._sweep_interval
+            self.evict_expired(now)
+        return count
+
+    def _hit(self, key, window, now):
+        now_index = int(now // window)
+        table = self.table
+        for _ in range(2): # A concurrent insert of the same key triggers one retry
+            try:
+                with self.engine.begin() as conn:
+                    row = conn.execute(
+                        table.select().where(table.c.key == key).with_for_update()
+                    ).first()
+                    if row is None:
+                        current, previous = 0, 0
+                        conn.execute(table.insert().values(
+                            key=key, window_index=now_index, current=1, previous=0,
+                            expires_at=(now_index + 2) * window))
+                    else:
+                        current, previous = _window_state(
+                            row.window_index, row.current, row.previous, now_index)
+                        conn.execute(table.update().where(table.c.key == key).values(
+                            window_index=now_index, current=current + 1, previous=previous,
+                            expires_at=(now_index + 2) * window))
+                return _estimate(current + 1, previous, now, window)
+            except IntegrityError:
+                continue
+        return _estimate(1, 0, now, window)
+
+    def reset(self, key):
+        with self.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.key == key))
+
+    def evict_expired(self, now):
+        """Delete rows untouched for two full windows (TTL). Returns how many."""
+        with self.engine.begin() as conn:
+            result = conn.execute(self.table.delete().where(self.table.c.expires_at < now))
+        return result.rowcount
+
+
+class LoginRateLimiter:
+    """Throttles login attempts per client IP and per username.
+
+    Only failed attempts are counted. A successful login clears the username
+    counter but not the IP counter, so one valid account can't be used to
+    reset a credential-stuffing run from the same address.
+    """
+
+    def __init__(self, app=None, clock=time.time):
+        self.clock = clock
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOGIN_RATE_LIMIT_ENABLED', True)
+        app.config.setdefault('LOGIN_RATE_LIMIT_WINDOW', 300) # Seconds
+        app.config.setdefault('LOGIN_RATE_LIMIT_PER_USER', 5)
+        app.config.setdefault('LOGIN_RATE_LIMIT_PER_IP', 20)
+        app.config.setdefault('LOGIN_RATE_LIMIT_STORAGE', 'memory') # or 'database'
+        app.extensions['login_limiter'] = None # Storage is created lazily (needs db.engine)
+
+    @property
+    def storage(self):
+        storage = current_app.extensions.get('login_limiter')
+        if storage is None:
+            if current_app.config['LOGIN_RATE_LIMIT_STORAGE'] == 'database':
+                from . import db
+                storage = DatabaseStorage(db.engine)
+            else:
+                storage = MemoryStorage()
+            current_app.extensions['login_limiter'] = storage
+        return storage
+
+    def _keys(self, ip, username):
+        config = current_app.config
+        keys = [(f'ip:{ip}', config['LOGIN_RATE_LIMIT_PER_IP'])]
+        if username:
+            keys.append((f'user:{username.strip().lower()}', config['LOGIN_RATE_LIMIT_PER_USER']))
+        return keys
+
+    def is_limited(self, ip, username):
+        """True if either key has used up its allowance in the current window."""
+        if not current_app.config['LOGIN_RATE_LIMIT_ENABLED']:
+            return False
+        window = current_app.config['LOGIN_RATE_LIMIT_WINDOW']
+        now = self.clock()
+        return any(self.storage.get(key, window, now) >= limit for key, limit in self._keys(ip, username))
+
+    def retry_after(self):
+        """Upper bound (in seconds) until a limited key may try again."""
+        window = current_app.config['LOGIN_RATE_LIMIT_WINDOW']
+        return int(math.ceil(window - self.clock() % window)) + window
+
+    def register_failure(self, ip, username):
+        if not current_app.config['LOGIN_RATE_LIMIT_ENABLED']:
+            return
+        window = current_app.config['LOGIN_RATE_LIMIT_WINDOW']
+        now = self.clock()
+        for key, _ in self._keys(ip, username):
+            self.storage.hit(key, window, now)
+
+    def register_success(self, username):
+        if current_app.config['LOGIN_RATE_LIMIT_ENABLED'] and username:
+            self.storage.reset(f'user:{username.strip().lower()}')
@@ -0,0 +1,335 @@
+"""Sales and inventory reporting from pre-aggregated rollups.
+
+Every stock change is written to the `stock_movements` ledger and added to
+hourly and daily totals in `product_rollups` and `category_rollups`, in the
+same transaction as the change: from the session's flush events for ORM
+writes (edits, adjust_stock, `record_sale`) and from the bulk update signals
+for set-based updates. Reports only read the rollup tables, whose primary
+keys start with (period, bucket), so a dashboard costs O(buckets x rows per
+bucket) however long the history is.
+
+`flask reports rebuild` recomputes the rollups from the ledger, one day per
+transaction, while the app keeps writing.
+"""
+import csv
+import io
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, select, update, insert, func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import db
+from .models import Product, StockMovement, ProductRollup, CategoryRollup, utcnow
+from .signals import products_bulk_updating, products_bulk_updated
+from .tracking import track_old_values, committed_value, has_changes
+
+PERIODS = ('hour', 'day')
+METRICS = ('units_sold', 'revenue', 'units_in', 'units_out')
+SALE, ADJUSTMENT = 'sale', 'adjustment'
+UNCATEGORIZED = '' # Stored in place of NULL, which can't be part of the primary key
+
+
+class ReportError(ValueError):
+    """Raised for invalid report parameters."""
+
+
+def bucket_start(ts, period):
+    if period == 'hour':
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _metrics(kind, quantity, amount):
+    if kind == SALE:
+        return (-quantity, amount, 0, 0)
+    return (0, Decimal('0'), max(quantity, 0), max(-quantity, 0))
+
+
+def _aggregate(movements):
+    """Sum movements into {(table, period, bucket, key): [units_sold, revenue, units_in, units_out]}."""
+    totals = defaultdict(lambda: [0, Decimal('0'), 0, 0])
+    for m in movements:
+        metrics = _metrics(m['kind'], m['quantity'], m['amount'])
+        for period in PERIODS:
+            bucket = bucket_start(m['created_at'], period)
+            for key in ((ProductRollup, period, bucket, m['product_id']),
+                        (CategoryRollup, period, bucket, m['category'])):
+                total = totals[key]
+                for i, value in enumerate(metrics):
+                    total[i] += value
+    return totals
+
+
+def _rollup_rows(totals, model):
+    key_name = 'product_id' if model is ProductRollup else 'category'
+    return [dict(period=period, bucket=bucket, **{key_name: key}, **dict(zip(METRICS, total)))
+            for (table_model, period, bucket, key), total in totals.items() if table_model is model]
+
+
+def _add_to_rollups(connection, totals):
+    """Add `totals` (see _aggregate) to the rollup tables, one upsert statement per table."""
+    dialect = connection.dialect.name
+    for model, key_column in ((ProductRollup, 'product_id'), (CategoryRollup, 'category')):
+        rows = _rollup_rows(totals, model)
+        if not rows:
+            continue
+        table = model.__table__
+        if dialect in ('sqlite', 'postgresql'):
+            statement = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(table)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.period, table.c.bucket, table.c[key_column]],
+                set_={m: table.c[m] + statement.excluded[m] for m in METRICS})
+            connection.execute(statement, rows)
+        else:
+            for row in rows:
+                result = connection.execute(
+                    update(table).where(table.c.period == row['period'], table.c.bucket == row['bucket'],
+                                        table.c[key_column] == row[key_column])
+                    .values({m: table.c[m] + row[m] for m in METRICS}))
+                if result.rowcount == 0:
+                    connection.execute(table.insert().values(row))
+
+
+def _write_movements(connection, movements):
+    connection.execute(insert(StockMovement.__table__), movements)
+    _add_to_rollups(connection, _aggregate(movements))
+
+
+def _movement(product_id, category, kind, quantity, amount, created_at):
+    return {'product_id': product_id, 'category': category or UNCATEGORIZED, 'kind': kind,
+            'quantity': quantity, 'amount': amount, 'created_at': created_at}
+
+
+def record_sale(product, quantity, amount=None):
+    """Take `quantity` units of `product` out of stock as a sale worth `amount` (default: current price).
+
+    The hook for order processing: the sale reaches the ledger and rollups
+    when the session flushes, and disappears with it on rollback.
+    """
+    if quantity <= 0:
+        raise ValueError('Sale quantity must be positive.')
+    if amount is None:
+        amount = (product.price or Decimal('0')) * quantity
+    product.adjust_stock(-quantity)
+    sales = db.session.info.setdefault('reporting_sales', {})
+    sold, revenue = sales.get(product, (0, Decimal('0')))
+    sales[product] = (sold + quantity, revenue + Decimal(amount))
+
+
+# --- Capture -----------------------------------------------------------------
+
+track_old_values(Product, ('stock_quantity',))
+
+
+@event.listens_for(db.session, 'before_flush')
+def _capture_movements(session, flush_context, instances):
+    # New products have no id yet; after_flush swaps the object for its id
+    sales = session.info.pop('reporting_sales', {})
+    pending = session.info.setdefault('reporting_pending', [])
+    now = utcnow()
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Product) or obj in session.deleted:
+            continue
+        if obj not in session.new and not has_changes(obj, ('stock_quantity',)):
+            continue
+        old = 0 if obj in session.new else committed_value(obj, 'stock_quantity') or 0
+        change = (obj.stock_quantity or 0) - old
+        sold, revenue = sales.get(obj, (0, Decimal('0')))
+        if sold:
+            pending.append(_movement(obj, obj.category, SALE, -sold, revenue, now))
+        if change + sold:
+            pending.append(_movement(obj, obj.category, ADJUSTMENT, change + sold, Decimal('0'), now))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _write_pending_movements(session, flush_context):
+    pending = session.info.pop('reporting_pending', None)
+    if not pending:
+        return
+    for movement in pending:
+        if isinstance(movement['product_id'], Product):
+            movement['product_id'] = movement['product_id'].id
+    _write_movements(session.connection(), pending)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_movements(session, previous_transaction):
+    session.info.pop('reporting_sales', None)
+    session.info.pop('reporting_pending', None)
+
+
+@products_bulk_updating.connect
+def _before_bulk_update(sender, session, ids, fields, **kwargs):
+    if 'stock_quantity' in fields:
+        rows = session.execute(select(Product.id, Product.stock_quantity).where(Product.id.in_(ids)))
+        session.info['reporting_bulk_before'] = dict(rows.all())
+
+
+@products_bulk_updated.connect
+def _after_bulk_update(sender, session, ids, fields, **kwargs):
+    before = session.info.pop('reporting_bulk_before', None)
+    if not before:
+        return
+    now = utcnow()
+    rows = session.execute(select(Product.id, Product.category, Product.stock_quantity)
+                           .where(Product.id.in_(ids)))
+    movements = [_movement(product_id, category, ADJUSTMENT, stock - (before.get(product_id) or 0),
+                           Decimal('0'), now)
+                 for product_id, category, stock in rows if stock != before.get(product_id)]
+    if movements:
+        _write_movements(session.connection(), movements)
+
+
+# --- Reports -----------------------------------------------------------------
+
+def _check_range(period, start, end):
+    if period not in PERIODS:
+        raise ReportError(f"period must be one of: {', '.join(PERIODS)}")
+    if start is not None and end is not None and start >= end:
+        raise ReportError('start must be before end')
+
+
+def activity_report(start, end, period='day', by='category', category=None, product_id=None):
+    """Rollup rows for buckets starting in [start, end), oldest first.
+
+    `by` picks the category or product rollups; each row has bucket, the
+    category or product_id, and the METRICS.
+    """
+    _check_range(period, start, end)
+    if by == 'category':
+        model, key = CategoryRollup, CategoryRollup.category
+    elif by == 'product':
+        model, key = ProductRollup, ProductRollup.product_id
+    else:
+        raise ReportError("by must be 'category' or 'product'")
+    statement = (select(model.bucket, key, *(getattr(model, m) for m in METRICS))
+                 .where(model.period == period, model.bucket >= start, model.bucket < end)
+                 .order_by(model.bucket, key))
+    if category is not None:
+        if model is not CategoryRollup:
+            raise ReportError('category filter applies to category reports')
+        statement = statement.where(model.category == category)
+    if product_id is not None:
+        if model is not ProductRollup:
+            raise ReportError('product_id filter applies to product reports')
+        statement = statement.where(model.product_id == product_id)
+    return db.session.execute(statement)
+
+
+def stock_turnover(start, end, limit=100):
+    """Best sellers in [start, end) from the daily rollups, with current stock and days of cover.
+
+    Only the `limit` returned products are looked up in `products`, by primary key.
+    """
+    _check_range('day', start, end)
+    sold = func.sum(ProductRollup.units_sold)
+    totals = (select(ProductRollup.product_id, sold.label('units_sold'),
+                     func.sum(ProductRollup.revenue).label('revenue'),
+                     func.sum(ProductRollup.units_out).label('units_out'))
+              .where(ProductRollup.period == 'day', ProductRollup.bucket >= start, ProductRollup.bucket < end)
+              .group_by(ProductRollup.product_id).having(sold > 0)
+              .order_by(sold.desc(), ProductRollup.product_id).limit(limit).subquery())
+    rows = db.session.execute(
+        select(totals, Product.sku, Product.stock_quantity)
+        .outerjoin(Product, Product.id == totals.c.product_id)
+        .order_by(totals.c.units_sold.desc(), totals.c.product_id))
+    days = max((end - start).total_seconds() / 86400, 1)
+    return [{
+        'product_id': row.product_id, 'sku': row.sku, 'units_sold': row.units_sold,
+        'revenue': row.revenue, 'units_out': row.units_out, 'stock_quantity': row.stock_quantity,
+        'days_of_cover': (round(row.stock_quantity / (row.units_sold / days), 1)
+                          if row.stock_quantity is not None else None),
+    } for row in rows]
+
+
+def iter_csv(columns, rows):
+    """Yield CSV text a line at a time, for streaming responses."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([row[c] for c in columns] if isinstance(row, dict) else row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# --- Maintenance -------------------------------------------------------------
+
+def _next_day(day):
+    """Start of the first day from `day` (None: any) with movements or rollups, or None."""
+    firsts = []
+    for column in (StockMovement.created_at, ProductRollup.bucket, CategoryRollup.bucket):
+        statement = select(func.min(column))
+        if day is not None:
+            statement = statement.where(column >= day)
+        firsts.append(db.session.scalar(statement))
+    firsts = [first for first in firsts if first is not None]
+    return bucket_start(min(firsts), 'day') if firsts else None
+
+
+def _rebuild_day(day):
+    """Replace one day's hourly and daily rollups with totals recomputed from the ledger, in one transaction.
+
+    Live writes to the rollups are kept out until the commit: on SQLite the
+    DELETE takes the database write lock, on PostgreSQL the tables are
+    locked first. A movement committed before that is in the recomputed
+    totals, one committed after is added by its own listener; neither twice.
+    Returns the number of movements.
+    """
+    next_day = day + timedelta(days=1)
+    table = StockMovement.__table__
+    try:
+        connection = db.session.connection()
+        if connection.dialect.name == 'postgresql':
+            connection.exec_driver_sql('LOCK TABLE product_rollups, category_rollups IN EXCLUSIVE MODE')
+        for model in (ProductRollup, CategoryRollup):
+            connection.execute(model.__table__.delete().where(model.bucket >= day, model.bucket < next_day))
+        movements = connection.execute(
+            select(table.c.product_id, table.c.category, table.c.kind, table.c.quantity, table.c.amount,
+                   table.c.created_at)
+            .where(table.c.created_at >= day, table.c.created_at < next_day)).mappings().all()
+        _add_to_rollups(connection, _aggregate(movements))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(movements)
+
+
+def rebuild_rollups(since=None):
+    """Recompute rollups for buckets from `since` (default: all history) out of the ledger.
+
+    Works one day per transaction, so the app can keep recording movements
+    meanwhile (see _rebuild_day). Returns the number of days with movements.
+    """
+    day = bucket_start(since, 'day') if since else None
+    days = 0
+    while (day := _next_day(day)) is not None: # Jump straight to the next day with anything to rebuild
+        if _rebuild_day(day):
+            days += 1
+        day += timedelta(days=1)
+    return days
+
+
+def init_app(app):
+    app.cli.add_command(reports_cli)
+
+
+@click.group('reports')
+def reports_cli():
+    """Maintain the reporting rollups."""
+
+
+@reports_cli.command('rebuild')
+@click.option('--since', type=click.DateTime(), default=None, help='Only rebuild from this date (UTC).')
+@with_appcontext
+def reports_rebuild(since):
+    """Recompute product and category rollups from the stock movement ledger."""
+    click.echo(f'Rebuilt rollups for {rebuild_rollups(since)} days.')
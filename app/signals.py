@@ -0,0 +1,25 @@
+"""Signals for product changes that bypass ORM flush events.
+
+Subsystems that maintain derived data from flush events (facet counts and
+the like) also subscribe here, so set-based statements such as the bulk
+update engine keep that data in sync. Both signals are sent inside the
+chunk's transaction, before it commits.
+"""
+from blinker import Namespace
+
+_signals = Namespace()
+
+# Sent just before a set-based UPDATE of `ids`; receivers get
+# (sender, session=..., ids=[...], fields=(...)).
+products_bulk_updating = _signals.signal('products-bulk-updating')
+
+# Sent right after the UPDATE, with the same arguments.
+products_bulk_updated = _signals.signal('products-bulk-updated')
+
+# Sent inside each archival chunk's transaction, while the products in `ids`
+# are still in `products` (about to be moved to the archive tables, see
+# app/archive.py); receivers get (sender, session=..., ids=[...]).
+products_archiving = _signals.signal('products-archiving')
+
+# Sent after restored products are back in `products`, before the commit.
+products_restored = _signals.signal('products-restored')
@@ -0,0 +1,273 @@
+"""Slow-query log.
+
+With SLOW_QUERY_LOG_ENABLED, every statement the app's engines run for at
+least SLOW_QUERY_THRESHOLD_MS is written as one JSON line to a rotating log
+(SLOW_QUERY_LOG_FILE, default <instance>/slow_queries.log). Like the app log,
+it goes through a LogPipeline (app/logs.py): the request thread only queues
+the entry and a listener thread writes it. Each entry has
+  - the statement normalized to its shape (literals, parameters and IN /
+    VALUES lists collapsed) and a fingerprint of that shape,
+  - the parameters, redacted: numbers, booleans and None are kept, strings
+    and everything else are reduced to their type and length,
+  - where it ran: the endpoint and blueprint (or 'cli' outside requests),
+    the request id (see app/logs.py) and the innermost app/ source line
+    that led to it,
+  - with SLOW_QUERY_EXPLAIN, the plan (EXPLAIN QUERY PLAN on SQLite, EXPLAIN
+    on PostgreSQL) the first time this process sees the shape.
+
+`flask slow-queries report` aggregates the log (and its rotated files) into
+the top statement shapes by total time, count, mean or max.
+
+When SLOW_QUERY_LOG_ENABLED is off no engine listeners are registered.
+"""
+import atexit
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+import click
+from flask import current_app, has_request_context, request
+from flask.cli import with_appcontext
+from sqlalchemy import event
+
+from . import db
+from .logs import LogPipeline, current_request_id
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+EXPLAIN_PREFIXES = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}
+EXPLAINABLE = ('select', 'with', 'update', 'delete', 'insert')
+MAX_EXPLAINED_SHAPES = 10000
+SORT_KEYS = ('total_ms', 'count', 'mean_ms', 'max_ms')
+
+_NORMALIZERS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'), # String literals
+    (re.compile(r'%\(\w+\)s|%s|(?<!:):\w+|\$\d+'), '?'), # Driver parameter styles
+    (re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])'), '?'), # Numbers, not digits inside identifiers
+    (re.compile(r'\s+'), ' '),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?, ...)'), # IN lists / VALUES rows
+    (re.compile(r'(\(\?(?:, (?:\?|\.\.\.))*\))(?:, \(\?(?:, (?:\?|\.\.\.))*\))+'), r'\1, ...'), # Multi-row VALUES
+]
+
+
+def normalize(statement):
+    """The statement's shape: literals and parameters as ?, lists collapsed, whitespace squeezed."""
+    for pattern, replacement in _NORMALIZERS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def fingerprint(shape):
+    return hashlib.sha1(shape.encode()).hexdigest()[:16]
+
+
+def redact(value):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (str, bytes)):
+        return f'<{type(value).__name__}:{len(value)}>'
+    return f'<{type(value).__name__}>'
+
+
+def redact_parameters(parameters):
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    return redact(parameters)
+
+
+def call_site():
+    """'path/to/module.py:line in function' of the innermost app/ frame outside this module."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(APP_DIR) and filename != __file__:
+            return f'{os.path.relpath(filename, os.path.dirname(APP_DIR))}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+class SlowQueryLog:
+    """Engine listeners that time statements and log the slow ones, for one app."""
+
+    def __init__(self, app):
+        config = app.config
+        self.threshold = config['SLOW_QUERY_THRESHOLD_MS'] / 1000
+        self.explain = config['SLOW_QUERY_EXPLAIN']
+        self.path = log_path(app)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.logger = logging.Logger('slow_queries') # Private to this app: not in logging's registry
+        self.logger.propagate = False
+        handler = RotatingFileHandler(self.path, maxBytes=config['SLOW_QUERY_LOG_MAX_BYTES'],
+                                      backupCount=config['SLOW_QUERY_LOG_BACKUP_COUNT'], encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.pipeline = LogPipeline(self.logger, [handler], config['LOG_QUEUE_SIZE'])
+        self.pipeline.start()
+        self._explained = set()
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def detach(self, engine):
+        event.remove(engine, 'before_cursor_execute', self._before)
+        event.remove(engine, 'after_cursor_execute', self._after)
+
+    def flush(self):
+        """Wait until every entry logged so far is written."""
+        self.pipeline.flush()
+
+    def close(self):
+        self.pipeline.close()
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        context._slow_query_started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._slow_query_started
+        if elapsed < self.threshold:
+            return
+        shape = normalize(statement)
+        entry = {
+            'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'duration_ms': round(elapsed * 1000, 2),
+            'fingerprint': fingerprint(shape),
+            'statement': shape,
+            'parameters': ([redact_parameters(p) for p in parameters[:10]] if executemany
+                           else redact_parameters(parameters)),
+            'executemany': executemany,
+            'endpoint': request.endpoint if has_request_context() else 'cli',
+            'blueprint': request.blueprint if has_request_context() else None,
+            'request_id': current_request_id(),
+            'call_site': call_site(),
+            'database': conn.engine.url.render_as_string(hide_password=True),
+        }
+        if self.explain and not executemany and entry['fingerprint'] not in self._explained:
+            plan = self._explain(conn, statement, parameters)
+            if plan is not None:
+                entry['plan'] = plan
+                if len(self._explained) >= MAX_EXPLAINED_SHAPES:
+                    self._explained.clear()
+                self._explained.add(entry['fingerprint'])
+        self.logger.warning(json.dumps(entry, default=str))
+
+    def _explain(self, conn, statement, parameters):
+        """The statement's plan, via the DBAPI connection so no SQLAlchemy events fire."""
+        prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+        if prefix is None or not statement.lstrip().lower().startswith(EXPLAINABLE):
+            return None
+        savepoint = conn.dialect.name == 'postgresql' # A failed EXPLAIN mustn't abort the transaction
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            if savepoint:
+                cursor.execute('SAVEPOINT slow_query_explain')
+            try:
+                cursor.execute(prefix + statement, parameters)
+                plan = [' | '.join(str(value) for value in row) for row in cursor.fetchall()]
+            except Exception as e:
+                if savepoint:
+                    cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                return [f'EXPLAIN failed: {e}']
+            if savepoint:
+                cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+            return plan
+        finally:
+            cursor.close()
+
+
+def log_path(app):
+    return app.config['SLOW_QUERY_LOG_FILE'] or os.path.join(app.instance_path, 'slow_queries.log')
+
+
+def read_entries(path):
+    """Entries of the log and its rotated files (path.1, path.2, ...), oldest file first."""
+    rotated = sorted(glob.glob(glob.escape(path) + '.*'), key=lambda p: int(p.rsplit('.', 1)[1])
+                     if p.rsplit('.', 1)[1].isdigit() else 0, reverse=True)
+    for filename in [*rotated, path]:
+        if not os.path.exists(filename):
+            continue
+        with open(filename, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def aggregate(entries, since=None):
+    """Per statement shape: count, total/mean/max ms, endpoints, call sites and the first plan seen."""
+    shapes = defaultdict(lambda: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'endpoints': set(),
+                                  'call_sites': set(), 'plan': None})
+    for entry in entries:
+        if since is not None and entry['ts'] < since:
+            continue
+        shape = shapes[entry['fingerprint']]
+        shape['statement'] = entry['statement']
+        shape['count'] += 1
+        shape['total_ms'] += entry['duration_ms']
+        shape['max_ms'] = max(shape['max_ms'], entry['duration_ms'])
+        shape['endpoints'].add(entry['endpoint'])
+        if entry.get('call_site'):
+            shape['call_sites'].add(entry['call_site'])
+        if shape['plan'] is None and entry.get('plan'):
+            shape['plan'] = entry['plan']
+    for key, shape in shapes.items():
+        shape['fingerprint'] = key
+        shape['mean_ms'] = shape['total_ms'] / shape['count']
+    return list(shapes.values())
+
+
+def init_app(app):
+    app.config.setdefault('SLOW_QUERY_LOG_ENABLED', False)
+    app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', 200)
+    app.config.setdefault('SLOW_QUERY_EXPLAIN', True) # Plan of the first occurrence of each shape
+    app.config.setdefault('SLOW_QUERY_LOG_FILE', None) # Default: <instance>/slow_queries.log
+    app.config.setdefault('SLOW_QUERY_LOG_MAX_BYTES', 10 * 1024 * 1024)
+    app.config.setdefault('SLOW_QUERY_LOG_BACKUP_COUNT', 5)
+    app.cli.add_command(slow_queries_cli)
+    if not app.config['SLOW_QUERY_LOG_ENABLED']:
+        return
+    log = SlowQueryLog(app)
+    atexit.register(log.close)
+    app.extensions['slow_query_log'] = log
+    with app.app_context():
+        for engine in db.engines.values():
+            log.attach(engine)
+
+
+@click.group('slow-queries')
+def slow_queries_cli():
+    """Summarize the slow-query log."""
+
+
+@slow_queries_cli.command('report')
+@click.option('--top', type=int, default=20, show_default=True, help='Statement shapes to show.')
+@click.option('--sort', type=click.Choice(SORT_KEYS), default='total_ms', show_default=True)
+@click.option('--since', type=click.DateTime(), default=None, help='Only entries from this time (UTC).')
+@click.option('--plans', is_flag=True, help='Also print the captured query plans.')
+@with_appcontext
+def slow_queries_report(top, sort, since, plans):
+    """Top statement shapes in the slow-query log."""
+    since = since.replace(tzinfo=timezone.utc).isoformat() if since else None
+    shapes = sorted(aggregate(read_entries(log_path(current_app)), since), key=lambda s: s[sort], reverse=True)
+    if not shapes:
+        click.echo('No slow queries logged.')
+        return
+    click.echo(f"{'count':>7} {'total ms':>10} {'mean ms':>9} {'max ms':>9}  fingerprint / endpoints")
+    for shape in shapes[:top]:
+        click.echo(f"{shape['count']:7} {shape['total_ms']:10.1f} {shape['mean_ms']:9.1f} {shape['max_ms']:9.1f}  "
+                   f"{shape['fingerprint']}  {', '.join(sorted(map(str, shape['endpoints'])))}")
+        click.echo(f"    {shape['statement']}")
+        for site in sorted(shape['call_sites']):
+            click.echo(f'    at {site}')
+        if plans and shape['plan']:
+            for line in shape['plan']:
+                click.echo(f'    plan: {line}')
@@ -0,0 +1,31 @@
+"""Helpers for subsystems that derive data from flush-time product changes."""
+from sqlalchemy import event, inspect
+
+
+def _keep_value(target, value, oldvalue, initiator):
+    return value
+
+
+def track_old_values(model, attrs):
+    """Make SQLAlchemy load the previous value of an expired attribute when it is set.
+
+    Without this, assigning to an expired attribute leaves nothing in its
+    history and a flush listener can't tell what the value used to be.
+    """
+    for attr in attrs:
+        event.listen(getattr(model, attr), 'set', _keep_value, active_history=True, retval=True)
+
+
+def committed_value(obj, attr):
+    """The committed (pre-flush) value of an attribute; call from before_flush."""
+    history = inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.added:
+        return None # Was unset (NULL) before
+    return getattr(obj, attr) # Unchanged; loads it if expired
+
+
+def has_changes(obj, attrs):
+    state = inspect(obj)
+    return any(state.attrs[attr].history.has_changes() for attr in attrs)
@@ -0,0 +1,174 @@
+"""Bulk user provisioning from a CSV file.
+
+The file has a header row with `username` and `password` columns and
+optionally `email` and `role`. It is read as a stream, in batches:
+
+  - every row is validated, and checked against the usernames and emails
+    already taken -- fetched once, with one query, before the first batch --
+    and against earlier rows of the file;
+  - the valid rows' passwords are hashed in a process pool sized to the CPU
+    count (hashing is deliberately slow, and CPU-bound);
+  - the batch is inserted with one executemany INSERT and committed.
+
+Invalid rows are reported (line number, username, reason) and skipped; they
+never stop the import. If a batch insert fails, e.g. because another process
+created one of the users meanwhile, its rows are retried one by one so the
+report names the offending rows.
+"""
+import csv
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from . import db
+from .models import User
+
+REQUIRED_COLUMNS = ('username', 'password')
+DEFAULT_ROLE = 'admin' # Same as User.role's default
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+MIN_PASSWORD_LENGTH = 8
+
+
+class UserImportError(ValueError):
+    """Raised when the file itself can't be imported (e.g. missing columns)."""
+
+
+def validate_row(row, taken_usernames, taken_emails):
+    """The User values for one CSV row, or raises ValueError with the reason it's rejected."""
+    username = (row.get('username') or '').strip()
+    email = (row.get('email') or '').strip() or None
+    password = row.get('password') or ''
+    role = (row.get('role') or '').strip() or DEFAULT_ROLE
+    if not 3 <= len(username) <= 64:
+        raise ValueError('username must be 3-64 characters')
+    if username in taken_usernames:
+        raise ValueError('username already exists')
+    if email is not None:
+        if len(email) > 120 or not EMAIL_RE.match(email):
+            raise ValueError('invalid email address')
+        if email.lower() in taken_emails:
+            raise ValueError('email already exists')
+    if len(password) < MIN_PASSWORD_LENGTH:
+        raise ValueError(f'password must be at least {MIN_PASSWORD_LENGTH} characters')
+    if len(role) > 64:
+        raise ValueError('role must be at most 64 characters')
+    return {'username': username, 'email': email, 'role': role, 'is_active': True, 'password': password}
+
+
+def _batches(reader, size):
+    batch = []
+    for row in reader:
+        batch.append((reader.line_num, row))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_users(stream, batch_size=500, workers=None, dry_run=False, progress=None):
+    """Create users from a CSV text stream. Returns a report with per-row errors."""
+    reader = csv.DictReader(stream)
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or ())]
+    if missing:
+        raise UserImportError(f"Missing column(s): {', '.join(missing)}")
+
+    started = time.monotonic()
+    report = {'created': 0, 'failed': 0, 'batches': 0, 'errors': [], 'dry_run': dry_run}
+    # Case-sensitive usernames, as at login; emails compared lower-cased
+    taken_usernames, taken_emails = set(), set()
+    for username, email in db.session.execute(select(User.username, User.email)):
+        taken_usernames.add(username)
+        if email:
+            taken_emails.add(email.lower())
+
+    workers = workers or os.cpu_count()
+    pool = None if dry_run else ProcessPoolExecutor(max_workers=workers)
+    try:
+        for batch in _batches(reader, batch_size):
+            valid = []
+            for line, row in batch:
+                try:
+                    values = validate_row(row, taken_usernames, taken_emails)
+                except ValueError as e:
+                    report['errors'].append({'line': line, 'username': row.get('username'), 'error': str(e)})
+                    continue
+                taken_usernames.add(values['username'])
+                if values['email']:
+                    taken_emails.add(values['email'].lower())
+                valid.append((line, values))
+            if valid and not dry_run:
+                passwords = [values.pop('password') for _, values in valid]
+                chunksize = max(len(passwords) // (workers * 4), 1)
+                for (_, values), password_hash in zip(valid, pool.map(generate_password_hash, passwords,
+                                                                      chunksize=chunksize)):
+                    values['password_hash'] = password_hash
+                _insert(valid, report)
+            elif dry_run:
+                report['created'] += len(valid)
+            report['batches'] += 1
+            if progress is not None:
+                progress(report)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    report['failed'] = len(report['errors'])
+    report['elapsed'] = round(time.monotonic() - started, 3)
+    return report
+
+
+def _insert(valid, report):
+    try:
+        db.session.execute(User.__table__.insert(), [values for _, values in valid]) # One executemany
+        db.session.commit()
+        report['created'] += len(valid)
+        return
+    except IntegrityError:
+        db.session.rollback()
+    for line, values in valid: # Someone else took a name meanwhile: find out which rows
+        try:
+            db.session.execute(User.__table__.insert(), [values])
+            db.session.commit()
+            report['created'] += 1
+        except IntegrityError:
+            db.session.rollback()
+            report['errors'].append({'line': line, 'username': values['username'],
+                                     'error': 'username or email already exists'})
+
+
+@click.command('import-users')
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--batch-size', default=500, show_default=True, type=int, help='Rows hashed and inserted together.')
+@click.option('--workers', default=None, type=int, help='Hashing processes (default: CPU count).')
+@click.option('--errors', 'errors_file', type=click.File('w'), default=None,
+              help='Write rejected rows (line, username, error) to this CSV file.')
+@click.option('--dry-run', is_flag=True, help='Validate the file without creating anyone.')
+def import_users_command(csv_file, batch_size, workers, errors_file, dry_run):
+    """Create users from a CSV file with username, password[, email, role] columns."""
+    if batch_size < 1:
+        raise click.UsageError('--batch-size must be positive')
+
+    def progress(report):
+        click.echo(f"batch {report['batches']}: {report['created']} {'valid' if dry_run else 'created'}, "
+                   f"{len(report['errors'])} rejected")
+
+    try:
+        report = import_users(csv_file, batch_size=batch_size, workers=workers, dry_run=dry_run,
+                              progress=progress)
+    except UserImportError as e:
+        raise click.UsageError(str(e))
+    if errors_file is not None:
+        writer = csv.DictWriter(errors_file, fieldnames=('line', 'username', 'error'))
+        writer.writeheader()
+        writer.writerows(report['errors'])
+    else:
+        for error in report['errors']:
+            click.echo(f"line {error['line']} ({error['username']}): {error['error']}")
+    verb = 'would be created' if dry_run else 'created'
+    click.echo(f"Done: {report['created']} {verb}, {report['failed']} rejected in {report['elapsed']}s.")
@@ -0,0 +1,8 @@
+"""ASGI entry point for the async API (see app/async_api.py).
+
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+"""
+from run import app
+from app.async_api import create_asgi_app
+
+application = create_asgi_app(app)
@@ -0,0 +1,177 @@
+"""Concurrency benchmark: sync Flask product API vs the async ASGI one.
+
+Starts gunicorn with sync workers serving the Flask app, and uvicorn with
+one worker serving asgi.py, both on the same seeded SQLite file. Every
+database call is slowed by --latency-ms to stand in for a busy or remote
+database. Many concurrent clients then hit the same batch SKU lookup on
+each server, and the script reports throughput and latency:
+
+    python benchmarks/async_vs_sync.py --clients 50 --requests 10 --latency-ms 50
+
+With S sync workers the sync path completes at most S requests per latency
+period, so queued clients wait. The async path keeps up to
+ASYNC_DB_POOL_SIZE + ASYNC_DB_MAX_OVERFLOW lookups in flight in one process.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# --- Server side (run inside gunicorn / uvicorn) -----------------------------
+
+def _latency():
+    return float(os.environ.get('BENCH_LATENCY_MS', '0')) / 1000
+
+
+def sync_app():
+    """gunicorn factory: the Flask app with a blocking delay before each statement."""
+    from sqlalchemy import event
+    from app import create_app, db
+
+    app = create_app()
+    latency = _latency()
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: time.sleep(latency))
+    return app
+
+
+def async_app():
+    """uvicorn factory: the ASGI app with a non-blocking delay before each statement."""
+    from sqlalchemy import event
+    from sqlalchemy.util import await_only
+    from app import create_app
+    from app.async_api import create_asgi_app
+
+    asgi = create_asgi_app(create_app())
+    latency = _latency()
+    event.listen(asgi.get_engine().sync_engine, 'before_cursor_execute',
+                 lambda *args: await_only(asyncio.sleep(latency)))
+    return asgi
+
+
+# --- Driver -------------------------------------------------------------------
+
+def seed(env, products):
+    """Create the schema, `products` products and a user; returns a session cookie for the user."""
+    code = f'''
+from decimal import Decimal
+from sqlalchemy import insert
+from app import create_app, db
+from app.models import User, Product
+app = create_app()
+with app.app_context():
+    db.create_all()
+    db.session.execute(insert(Product), [
+        {{"sku": f"BENCH-{{i}}", "name": f"Bench {{i}}", "price": Decimal("9.99"), "stock_quantity": i}}
+        for i in range({products})])
+    user = User(username="bench", email="bench@example.com")
+    user.set_password("bench")
+    db.session.add(user)
+    db.session.commit()
+    print(app.session_interface.get_signing_serializer(app).dumps({{"_user_id": str(user.id), "_fresh": True}}))
+'''
+    return subprocess.run([sys.executable, '-c', code], env=env, cwd=ROOT, check=True,
+                          capture_output=True, text=True).stdout.strip().splitlines()[-1]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server at {url} did not start')
+
+
+async def run_clients(url, cookie, clients, requests, skus):
+    latencies, errors = [], 0
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async def client(http):
+        nonlocal errors
+        for _ in range(requests):
+            started = time.perf_counter()
+            try:
+                response = await http.post(url, json={'skus': skus})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+            except httpx.HTTPError:
+                errors += 1
+
+    async with httpx.AsyncClient(limits=limits, timeout=120, cookies={'session': cookie}) as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def report(name, latencies, errors, elapsed):
+    if not latencies:
+        print(f'{name:6} all {errors} requests failed')
+        return
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f'{name:6} {len(latencies) / elapsed:9.1f} req/s   p50 {statistics.median(latencies) * 1000:8.1f} ms'
+          f'   p95 {p95 * 1000:8.1f} ms   errors {errors}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=50, help='Concurrent clients per run.')
+    parser.add_argument('--requests', type=int, default=10, help='Requests per client.')
+    parser.add_argument('--latency-ms', type=float, default=50, help='Added delay per database statement.')
+    parser.add_argument('--sync-workers', type=int, default=4, help='gunicorn sync workers.')
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--skus', type=int, default=20, help='SKUs per lookup request.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='async-bench-')
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+               SECRET_KEY='bench-secret', FLASK_ENV='production', BENCH_LATENCY_MS=str(args.latency_ms),
+               PYTHONPATH=ROOT)
+    cookie = seed(env, args.products)
+    skus = [f'BENCH-{i * 37 % args.products}' for i in range(args.skus)]
+
+    sync_port, async_port = free_port(), free_port()
+    servers = [
+        subprocess.Popen([sys.executable, '-m', 'gunicorn', '--workers', str(args.sync_workers), '--bind',
+                          f'127.0.0.1:{sync_port}', '--log-level', 'warning',
+                          'benchmarks.async_vs_sync:sync_app()'], env=env, cwd=ROOT),
+        subprocess.Popen([sys.executable, '-m', 'uvicorn', '--factory', '--port', str(async_port),
+                          '--log-level', 'warning', 'benchmarks.async_vs_sync:async_app'], env=env, cwd=ROOT),
+    ]
+    try:
+        wait_until_up(f'http://127.0.0.1:{sync_port}/ping')
+        wait_until_up(f'http://127.0.0.1:{async_port}/api/async/products')
+        print(f'{args.clients} clients x {args.requests} lookups of {args.skus} SKUs, '
+              f'{args.latency_ms:g} ms per statement, {args.sync_workers} sync workers vs 1 async worker')
+        for name, url in (('sync', f'http://127.0.0.1:{sync_port}/api/products/lookup'),
+                          ('async', f'http://127.0.0.1:{async_port}/api/async/products/lookup')):
+            report(name, *asyncio.run(run_clients(url, cookie, args.clients, args.requests, skus)))
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Memory footprint and read cost of the catalog snapshot.
+
+Seeds a SQLite file with --products active products, loads the snapshot and
+reports the memory it holds (tracemalloc) next to the same products loaded as
+Product instances, then times SKU lookups and a 50-product API page from the
+snapshot against the equivalent database reads:
+
+    python benchmarks/catalog_snapshot.py --products 100000
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import insert  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.catalog import CatalogSnapshot  # noqa: E402
+from app.models import Product  # noqa: E402
+from app.product_reads import page_result, product_page_query, product_by_sku_query, product_dict  # noqa: E402
+from config import Config  # noqa: E402
+
+CATEGORIES = [f'Category {i}' for i in range(50)]
+
+
+def measure(load):
+    """(result, bytes still allocated by load())."""
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def per_call_us(call, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        call(i)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'catalog.db')}"
+
+    os.environ.pop('FLASK_ENV', None)
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(Product), [{
+            'sku': f'SKU-{i:07d}', 'name': f'Product {i}', 'price': Decimal(i % 10000) / 100,
+            'category': CATEGORIES[i % len(CATEGORIES)], 'stock_quantity': i % 500,
+            'description': f'Description of product {i}', 'image_url': f'https://img.example.com/{i}.jpg',
+        } for i in range(args.products)])
+        db.session.commit()
+
+        snapshot, snapshot_bytes = measure(lambda: (s := CatalogSnapshot(), s.refresh())[0])
+        orm, orm_bytes = measure(lambda: Product.query.all())
+        db.session.expunge_all()
+        del orm
+        scale = 100000 / args.products
+        print(f'{args.products:,} active products')
+        print(f'  snapshot           {snapshot_bytes / 2**20:8.1f} MiB  ({snapshot_bytes * scale / 2**20:.1f} MiB per 100k)')
+        print(f'  Product instances  {orm_bytes / 2**20:8.1f} MiB  ({orm_bytes * scale / 2**20:.1f} MiB per 100k)')
+
+        skus = [f'sku-{i * 7919 % args.products:07d}' for i in range(args.iterations)]
+        from_db = per_call_us(lambda i: product_dict(db.session.execute(product_by_sku_query(skus[i])).first()),
+                              args.iterations)
+        from_orm = per_call_us(lambda i: Product.query.filter(db.func.lower(Product.sku) == skus[i]).first(),
+                               args.iterations)
+        from_snapshot = per_call_us(lambda i: snapshot.get_by_sku(skus[i]).to_dict(), args.iterations)
+        print('\nproduct by SKU, per call')
+        print(f'  Product query      {from_orm:8.1f} us')
+        print(f'  Core row           {from_db:8.1f} us')
+        print(f'  snapshot           {from_snapshot:8.2f} us')
+
+        snapshot.page(limit=50) # Builds the id ordering once
+        pages = max(args.iterations // 10, 1)
+        after = [i * 997 % args.products for i in range(pages)]
+        db_page = per_call_us(lambda i: page_result(db.session.execute(product_page_query(after[i], 50))), pages)
+        snapshot_page = per_call_us(lambda i: [p.to_dict() for p in snapshot.page(after[i], 50)], pages)
+        print('\n50-product API page, per call')
+        print(f'  database           {db_page:8.1f} us')
+        print(f'  snapshot           {snapshot_page:8.1f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Batch ingestion of a catalog's images: `flask images ingest` throughput.
+
+Writes --images synthetic photos (JPEG, --width x --height, with
+--duplicates of them byte-identical copies under other SKUs) and as many
+products to a temporary SQLite database, then runs ingest_directory() once
+per --workers value, each time into an empty image store, and reports
+files/s and MB/s of originals. Each run hashes, stores, and renders every
+IMAGE_SIZES size of each distinct image, then updates the products.
+
+    python benchmarks/images.py --images 1000 --workers 0 1 2 4
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image, ImageDraw  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.images import ingest_directory  # noqa: E402
+from app.models import Product  # noqa: E402
+from config import Config  # noqa: E402
+
+
+def write_photos(directory, args):
+    """Gradients with a few shapes: compress and decode roughly like product photos, unlike noise."""
+    rng = random.Random(42)
+    paths = []
+    for n in range(args.images - args.duplicates):
+        im = Image.linear_gradient('L').resize((args.width, args.height)).convert('RGB')
+        draw = ImageDraw.Draw(im)
+        for _ in range(8):
+            x, y = rng.randrange(args.width), rng.randrange(args.height)
+            draw.ellipse((x, y, x + rng.randrange(50, 600), y + rng.randrange(50, 600)),
+                         fill=tuple(rng.randrange(256) for _ in range(3)))
+        path = os.path.join(directory, f'SKU-{n:06d}.jpg')
+        im.save(path, 'JPEG', quality=90)
+        paths.append(path)
+    for n in range(args.images - args.duplicates, args.images): # Same photo for a second SKU
+        shutil.copyfile(rng.choice(paths), os.path.join(directory, f'SKU-{n:06d}.jpg'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--images', type=int, default=1000)
+    parser.add_argument('--duplicates', type=int, default=100)
+    parser.add_argument('--width', type=int, default=2000)
+    parser.add_argument('--height', type=int, default=1500)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4],
+                        help='Pool sizes to compare; 0 resizes in this process.')
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp()
+    source = os.path.join(work, 'photos')
+    os.makedirs(source)
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(work, 'images.db')}"
+
+    os.environ.pop('FLASK_ENV', None)
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        write_photos(source, args)
+        db.session.add_all(Product(sku=f'SKU-{n:06d}', name=f'Product {n}', price=9.99) for n in range(args.images))
+        db.session.commit()
+        megabytes = sum(entry.stat().st_size for entry in os.scandir(source)) / 1e6
+        print(f'{args.images:,} JPEGs ({args.width}x{args.height}, {args.duplicates} duplicates, '
+              f'{megabytes:.0f} MB); sizes {sorted(app.config["IMAGE_SIZES"].values())}; {os.cpu_count()} CPUs\n')
+        print(f'{"workers":>8} {"seconds":>9} {"files/s":>9} {"MB/s":>7}')
+        for workers in args.workers:
+            store = os.path.join(work, f'store-{workers}')
+            app.config['IMAGE_ROOT'] = store
+            stats = ingest_directory(source, workers=workers)
+            assert stats['linked'] == args.images and stats['failed'] == 0, stats
+            print(f'{workers:>8} {stats["seconds"]:>9.1f} {stats["files"] / stats["seconds"]:>9.1f} '
+                  f'{megabytes / stats["seconds"]:>7.1f}')
+            shutil.rmtree(store)
+    shutil.rmtree(work)
+
+
+if __name__ == '__main__':
+    main()
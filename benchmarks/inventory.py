@@ -0,0 +1,121 @@
+"""Per-location inventory at scale: aggregate reads, allocation and adjustments.
+
+Seeds a SQLite file with --locations stock locations and --products SKUs,
+each stocked at --per-product locations (100 x 1M x 3 by default, about 3M
+location rows), then times:
+
+  - a 50-product page reading the maintained stock_quantity, against the
+    same page summing location_stock on read;
+  - allocate() for --lines-line orders of random SKUs (one statement each);
+  - adjust_location_stock() + commit, the per-location write path.
+
+    python benchmarks/inventory.py --products 1000000 --locations 100
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import select, func  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.inventory import adjust_location_stock, allocate  # noqa: E402
+from app.models import Product, LocationStock  # noqa: E402
+from config import Config  # noqa: E402
+
+
+def per_call_ms(call, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        call(i)
+    return (time.perf_counter() - started) / iterations * 1000
+
+
+def seed(args):
+    connection = db.session.connection()
+    connection.exec_driver_sql(
+        'INSERT INTO stock_locations (id, code, name, priority, is_active) WITH RECURSIVE n(i) AS '
+        '(SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?) '
+        "SELECT i, 'LOC-' || i, 'Location ' || i, i % 10, 1 FROM n", (args.locations,))
+    # Location k of product i is ((i * 7 + k * 31) % locations) + 1: distinct for k < per_product
+    connection.exec_driver_sql(
+        'INSERT INTO location_stock (product_id, location_id, quantity) WITH RECURSIVE n(i) AS '
+        '(SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?), k(j) AS '
+        '(SELECT 0 UNION ALL SELECT j + 1 FROM k WHERE j < ?) '
+        'SELECT i, (i * 7 + j * 31) % ? + 1, (i + j) % 20 FROM n, k',
+        (args.products, args.per_product - 1, args.locations))
+    connection.exec_driver_sql(
+        'INSERT INTO products (id, sku, name, price, stock_quantity, is_active, is_low_stock, '
+        'date_created, date_updated) WITH RECURSIVE n(i) AS '
+        '(SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?) '
+        "SELECT i, printf('SKU-%07d', i), 'Product ' || i, 9.99, "
+        '(SELECT sum(quantity) FROM location_stock WHERE product_id = i), 1, 0, '
+        'CURRENT_TIMESTAMP, CURRENT_TIMESTAMP FROM n', (args.products,))
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--products', type=int, default=1000000)
+    parser.add_argument('--locations', type=int, default=100)
+    parser.add_argument('--per-product', type=int, default=3, help='Locations stocking each product.')
+    parser.add_argument('--lines', type=int, default=5, help='Lines per allocated order.')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'inventory.db')}"
+
+    os.environ.pop('FLASK_ENV', None)
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        seed(args)
+        rows = db.session.scalar(select(func.count()).select_from(LocationStock))
+        print(f'{args.products:,} SKUs x {args.locations} locations: {rows:,} location rows '
+              f'(seeded in {time.perf_counter() - started:.0f}s)')
+
+        rng = random.Random(42)
+        after = [rng.randrange(args.products - 50) for _ in range(args.iterations)]
+        maintained = per_call_ms(lambda i: db.session.execute(
+            select(Product.id, Product.sku, Product.stock_quantity).where(Product.id > after[i])
+            .order_by(Product.id).limit(50)).all(), args.iterations)
+        summed = per_call_ms(lambda i: db.session.execute(
+            select(Product.id, Product.sku, func.coalesce(func.sum(LocationStock.quantity), 0))
+            .outerjoin(LocationStock, LocationStock.product_id == Product.id).where(Product.id > after[i])
+            .group_by(Product.id).order_by(Product.id).limit(50)).all(), args.iterations)
+        print('\n50-product page with availability, per call')
+        print(f'  maintained stock_quantity  {maintained:8.2f} ms')
+        print(f'  SUM(location_stock)        {summed:8.2f} ms')
+
+        orders = [[(f'SKU-{rng.randrange(1, args.products + 1):07d}', rng.randrange(1, 30))
+                   for _ in range(args.lines)] for _ in range(args.iterations)]
+        allocation = per_call_ms(lambda i: allocate(orders[i]), args.iterations)
+        complete = sum(all(line['allocated'] == line['requested'] for line in allocate(order)) for order in orders)
+        print(f'\nallocate(), {args.lines}-line order, one statement')
+        print(f'  per order                  {allocation:8.2f} ms  ({complete}/{len(orders)} fully allocated)')
+
+        targets = db.session.execute(
+            select(LocationStock.product_id, LocationStock.location_id)
+            .where(LocationStock.product_id.in_([rng.randrange(1, args.products + 1)
+                                                 for _ in range(args.iterations)]))).all()
+        products = {p.id: p for p in db.session.scalars(select(Product).where(
+            Product.id.in_({product_id for product_id, _ in targets})))}
+        codes = {location_id: f'LOC-{location_id}' for _, location_id in targets}
+
+        def adjust(i):
+            product_id, location_id = targets[i % len(targets)]
+            adjust_location_stock(products[product_id], codes[location_id], 1)
+            db.session.commit()
+        adjusting = per_call_ms(adjust, args.iterations)
+        print('\nadjust_location_stock() + commit')
+        print(f'  per adjustment             {adjusting:8.2f} ms  ({1000 / adjusting:.0f}/s)')
+
+
+if __name__ == '__main__':
+    main()
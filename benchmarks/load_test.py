@@ -0,0 +1,299 @@
+"""Load generator: a mix of admin and storefront traffic against gunicorn.
+
+Without --url it seeds a fresh SQLite database (benchmarks/seed_data.py) and
+starts gunicorn on it with the production config; with --url it drives an
+already running server seeded with the same --users/--products. Each
+virtual user logs in through auth.login (CSRF token included) and then loops
+over requests drawn from --mix:
+
+    list    GET  /products/?page=&category=&active=    admin product list
+    view    GET  /products/<sku>                       product page
+    browse  GET  /api/products?after=&category=        storefront catalog page (JSON)
+    search  POST /api/products/lookup                  storefront SKU search (JSON)
+    edit    GET + POST /products/<sku>/edit            price change through the form
+    order   GET + POST /products/<sku>/edit            stock decrement through the form
+
+The app has no order endpoint yet, so `order` takes stock off a product the
+way a sale would. Concurrency ramps through --stages, holding each level for
+--stage-seconds, and every stage prints throughput, latency percentiles and
+error rates per request type:
+
+    python benchmarks/load_test.py --stages 5,10,20 --stage-seconds 15 --mix list=30,view=30,browse=15,search=15,edit=5,order=5
+"""
+import argparse
+import asyncio
+import html
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import seed_data  # noqa: E402
+
+DEFAULT_MIX = 'list=30,view=30,browse=15,search=15,edit=5,order=5'
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"|value="([^"]+)"[^>]*name="csrf_token"')
+INPUT_RE = re.compile(r'<input\b([^>]*)>')
+TEXTAREA_RE = re.compile(r'<textarea\b[^>]*name="(\w+)"[^>]*>(.*?)</textarea>', re.S)
+ATTR_RE = re.compile(r'(\w+)="([^"]*)"')
+
+
+class RequestFailed(Exception):
+    pass
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in VirtualUser.ACTIONS:
+            raise argparse.ArgumentTypeError(
+                f'Unknown request type {name!r}; choose from {", ".join(VirtualUser.ACTIONS)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def csrf_token(page):
+    match = CSRF_RE.search(page)
+    if match is None:
+        raise RequestFailed('No CSRF token on the page')
+    return match.group(1) or match.group(2)
+
+
+def form_values(page):
+    """The current values of a rendered WTForms form, as the browser would submit them."""
+    values = {}
+    for attrs in INPUT_RE.findall(page):
+        attrs = dict(ATTR_RE.findall(attrs))
+        name, kind = attrs.get('name'), attrs.get('type', 'text')
+        if not name or kind == 'submit' or (kind == 'checkbox' and 'checked' not in attrs):
+            continue
+        values[name] = html.unescape(attrs.get('value', 'y' if kind == 'checkbox' else ''))
+    for name, text in TEXTAREA_RE.findall(page):
+        values[name] = re.sub(r'^\r?\n', '', html.unescape(text)) # The newline WTForms puts after <textarea>
+    return values
+
+
+class Stats:
+    """Latencies and errors per request type for the current stage."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.started = time.perf_counter()
+
+    def report(self, concurrency):
+        elapsed = time.perf_counter() - self.started
+        names = sorted(set(self.latencies) | set(self.errors))
+        total_ok = sum(len(v) for v in self.latencies.values())
+        total_errors = sum(self.errors.values())
+        print(f'\n{concurrency} users, {elapsed:.1f} s: {total_ok / elapsed:.1f} req/s, '
+              f'{total_errors} errors ({100 * total_errors / max(total_ok + total_errors, 1):.1f}%)')
+        print(f"  {'request':8} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for name in names:
+            latencies = sorted(self.latencies[name])
+            errors = self.errors[name]
+            if latencies:
+                p50, p95, p99 = (latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000
+                                 for q in (0.5, 0.95, 0.99))
+                print(f'  {name:8} {len(latencies):7} {len(latencies) / elapsed:8.1f} {p50:8.1f} {p95:8.1f} '
+                      f'{p99:8.1f} {errors:7}')
+            else:
+                print(f"  {name:8} {0:7} {0:8.1f} {'-':>8} {'-':>8} {'-':>8} {errors:7}")
+
+
+class VirtualUser:
+    ACTIONS = ('list', 'view', 'browse', 'search', 'edit', 'order')
+
+    def __init__(self, index, run):
+        self.run = run
+        self.rng = random.Random(run.seed * 100003 + index)
+        self.username = seed_data.username(index % run.users)
+        self.http = httpx.AsyncClient(base_url=run.url, timeout=run.timeout, follow_redirects=False)
+
+    async def request(self, name, method, path, expect=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.http.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            self.run.stats.errors[name] += 1
+            raise RequestFailed(f'{name}: {e!r}')
+        if response.status_code not in expect:
+            self.run.stats.errors[name] += 1
+            raise RequestFailed(f'{name}: HTTP {response.status_code} for {method} {path}')
+        self.run.stats.latencies[name].append(time.perf_counter() - started)
+        return response
+
+    async def login(self):
+        page = await self.request('login', 'GET', '/auth/login')
+        await self.request('login', 'POST', '/auth/login', expect=(302,), data={
+            'csrf_token': csrf_token(page.text), 'username': self.username, 'password': seed_data.PASSWORD})
+
+    def random_sku(self):
+        return seed_data.sku(self.rng.randrange(self.run.products))
+
+    async def loop(self, stop):
+        try:
+            await self.login()
+        except RequestFailed:
+            return
+        actions, weights = zip(*self.run.mix.items())
+        while not stop.is_set():
+            action = self.rng.choices(actions, weights)[0]
+            try:
+                await getattr(self, action)()
+            except RequestFailed:
+                pass
+            if self.run.think:
+                await asyncio.sleep(self.rng.expovariate(1 / self.run.think))
+
+    async def list(self):
+        params = {'page': self.rng.randint(1, 20)}
+        if self.rng.random() < 0.5:
+            params['category'] = self.rng.choice(seed_data.CATEGORIES)
+        if self.rng.random() < 0.3:
+            params['active'] = 1
+        await self.request('list', 'GET', '/products/', params=params)
+
+    async def view(self):
+        await self.request('view', 'GET', f'/products/{self.random_sku()}')
+
+    async def browse(self):
+        params = {'limit': 50, 'active': 1, 'after': self.rng.randrange(self.run.products)}
+        if self.rng.random() < 0.5:
+            params['category'] = self.rng.choice(seed_data.CATEGORIES[:-1])
+        await self.request('browse', 'GET', '/api/products', params=params)
+
+    async def search(self):
+        skus = [self.random_sku() for _ in range(self.rng.randint(1, 20))]
+        await self.request('search', 'POST', '/api/products/lookup', json={'skus': skus})
+
+    async def edit(self):
+        await self._submit_edit('edit', lambda values: values.update(
+            price=f'{self.rng.randint(99, 99999) / 100:.2f}'))
+
+    async def order(self):
+        def take_stock(values):
+            stock = int(values.get('stock_quantity') or 0)
+            quantity = self.rng.randint(1, 3)
+            values['stock_quantity'] = str(stock - quantity if stock >= quantity else stock + 100) # Restock when out
+        await self._submit_edit('order', take_stock)
+
+    async def _submit_edit(self, name, change):
+        path = f'/products/{self.random_sku()}/edit'
+        page = (await self.request(name, 'GET', path)).text
+        values = form_values(page)
+        change(values)
+        await self.request(name, 'POST', path, expect=(302,), data=values)
+
+
+class LoadTest:
+    def __init__(self, url, users, products, mix, seed=1, think_ms=0, timeout=30):
+        self.url = url
+        self.users = users
+        self.products = products
+        self.mix = mix
+        self.seed = seed
+        self.think = think_ms / 1000
+        self.timeout = timeout
+        self.stats = Stats()
+
+    async def run(self, stages, stage_seconds):
+        stop = asyncio.Event()
+        virtual_users, tasks = [], []
+        try:
+            for concurrency in stages:
+                while len(virtual_users) < concurrency:
+                    user = VirtualUser(len(virtual_users), self)
+                    virtual_users.append(user)
+                    tasks.append(asyncio.create_task(user.loop(stop)))
+                self.stats = Stats()
+                await asyncio.sleep(stage_seconds)
+                self.stats.report(concurrency)
+        finally:
+            stop.set()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for user in virtual_users:
+                await user.http.aclose()
+
+
+# --- Local server -------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server at {url} did not start')
+
+
+def start_server(args):
+    """Seed a fresh SQLite database and serve it with gunicorn; returns (process, base URL)."""
+    workdir = tempfile.mkdtemp(prefix='load-test-')
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'load.db')}",
+               SECRET_KEY='load-test-secret', FLASK_ENV='production', PYTHONPATH=ROOT)
+    subprocess.run([sys.executable, os.path.join(ROOT, 'benchmarks', 'seed_data.py'), '--users', str(args.users),
+                    '--products', str(args.products), '--seed', str(args.seed)], env=env, cwd=ROOT, check=True)
+    port = free_port()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--bind',
+                               f'127.0.0.1:{port}', '--log-level', 'warning', 'run:app'], env=env, cwd=ROOT)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        wait_until_up(url + '/ping')
+    except RuntimeError:
+        server.terminate()
+        raise
+    return server, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default=None, help='Server to test; default: start gunicorn on seeded data.')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers when starting a server.')
+    parser.add_argument('--users', type=int, default=50, help='Seeded users (logins are spread over them).')
+    parser.add_argument('--products', type=int, default=10000, help='Seeded products.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the data and the request sequence.')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'Default: {DEFAULT_MIX}')
+    parser.add_argument('--stages', default='5,10,20', help='Concurrent users per stage, comma-separated.')
+    parser.add_argument('--stage-seconds', type=float, default=15)
+    parser.add_argument('--think-ms', type=float, default=0, help='Mean pause between a user\'s requests.')
+    parser.add_argument('--timeout', type=float, default=30, help='Request timeout in seconds.')
+    args = parser.parse_args()
+    stages = [int(n) for n in args.stages.split(',')]
+
+    server = None
+    url = args.url
+    if url is None:
+        server, url = start_server(args)
+    try:
+        print(f'{url}: stages {stages}, {args.stage_seconds:g} s each, mix '
+              + ', '.join(f'{name}={weight:g}' for name, weight in args.mix.items()))
+        test = LoadTest(url, args.users, args.products, args.mix, seed=args.seed, think_ms=args.think_ms,
+                        timeout=args.timeout)
+        asyncio.run(test.run(stages, args.stage_seconds))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Cold vs warm render of the product templates, and what compression saves.
+
+Renders list_products.html for a page of --rows products and
+view_product.html for one product, first with the fragment cache cleared
+before every render (cold), then with it primed (warm):
+
+    python benchmarks/render_cache.py --rows 100 --iterations 200
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['FLASK_ENV'] = 'testing'
+
+from flask import render_template  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.models import Product  # noqa: E402
+from app import compression  # noqa: E402
+
+
+def timed(render, iterations, before=None):
+    total = 0.0
+    for _ in range(iterations):
+        if before:
+            before()
+        started = time.perf_counter()
+        render()
+        total += time.perf_counter() - started
+    return total / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=100, help='Products on the list page.')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    app = create_app()
+    cache = app.extensions['fragment_cache']
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([
+            Product(sku=f'RENDER-{i}', name=f'Render product {i}', price=Decimal('12.34'), stock_quantity=i,
+                    category='Benchmark', description='A product used to benchmark rendering. ' * 5)
+            for i in range(args.rows)])
+        db.session.commit()
+        products = Product.query.order_by(Product.id).all()
+
+        with app.test_request_context('/products/'):
+            pages = {
+                'list_products': lambda: render_template('list_products.html', products=products, pagination=None,
+                                                         title='Products', facets=[], category=None, active=None),
+                'view_product': lambda: render_template('view_product.html', product=products[0], title='View'),
+            }
+            print(f'{"template":16} {"cold ms":>9} {"warm ms":>9} {"speedup":>8}')
+            for name, render in pages.items():
+                cold = timed(render, args.iterations, before=cache.clear)
+                render()
+                warm = timed(render, args.iterations)
+                print(f'{name:16} {cold:9.3f} {warm:9.3f} {cold / warm:7.1f}x')
+
+            html = pages['list_products']().encode()
+            sizes = [('identity', len(html)), ('gzip', len(gzip.compress(html, compresslevel=6)))]
+            if compression.brotli is not None:
+                sizes.append(('br', len(compression.brotli.compress(html, quality=4))))
+            print(f'\nlist_products.html, {args.rows} rows: ' +
+                  ', '.join(f'{encoding} {size:,} bytes' for encoding, size in sizes))
+
+
+if __name__ == '__main__':
+    main()
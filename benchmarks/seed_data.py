@@ -0,0 +1,114 @@
+"""Reproducible users and products for load tests and benchmarks.
+
+    DATABASE_URL=sqlite:////tmp/load.db python benchmarks/seed_data.py --users 50 --products 10000 --seed 1
+
+Creates the schema if needed, then users loadtest-user-<n> (all with
+PASSWORD) and products LT-<nnnnnn> spread over CATEGORIES. Names, prices,
+stock levels and reorder points come from random.Random(seed), so the same
+arguments always produce the same data. Rows are written with set-based
+inserts; the derived tables (category facets, price history) are filled in
+to match, as if the products had been added through the app.
+"""
+import argparse
+import os
+import random
+import sys
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USER_PREFIX = 'loadtest-user-'
+SKU_PREFIX = 'LT-'
+PASSWORD = 'loadtest-password'
+CATEGORIES = ['Apparel', 'Books', 'Electronics', 'Garden', 'Grocery', 'Health', 'Home', 'Kitchen', 'Music',
+              'Office', 'Outdoors', 'Pets', 'Shoes', 'Sports', 'Tools', 'Toys', 'Travel', 'Video Games',
+              'Watches', '']
+ADJECTIVES = ['Classic', 'Compact', 'Deluxe', 'Eco', 'Essential', 'Heavy-Duty', 'Lightweight', 'Premium',
+              'Portable', 'Smart', 'Ultra', 'Vintage']
+NOUNS = ['Backpack', 'Blender', 'Candle', 'Charger', 'Desk Lamp', 'Headphones', 'Jacket', 'Kettle', 'Mug',
+         'Notebook', 'Speaker', 'Sneakers', 'Tent', 'Umbrella', 'Water Bottle', 'Wrench']
+
+
+def username(i):
+    return f'{USER_PREFIX}{i}'
+
+
+def sku(i):
+    return f'{SKU_PREFIX}{i:06d}'
+
+
+def user_rows(count, password_hash):
+    """Users 0..count-1; they share one password hash, as hashing is deliberately slow."""
+    return [{'username': username(i), 'email': f'{username(i)}@example.com', 'role': 'admin',
+             'password_hash': password_hash, 'is_active': True} for i in range(count)]
+
+
+def product_rows(count, seed):
+    rng = random.Random(seed)
+    for i in range(count):
+        stock = rng.choice([0, rng.randint(1, 20), rng.randint(20, 500)])
+        yield {
+            'sku': sku(i),
+            'name': f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}',
+            'description': f'Load test product {i}. ' * rng.randint(1, 8),
+            'price': Decimal(rng.randint(99, 99999)) / 100,
+            'category': rng.choice(CATEGORIES) or None,
+            'image_url': f'https://img.example.com/products/{i}.jpg' if rng.random() < 0.7 else None,
+            'stock_quantity': stock,
+            'reorder_point': rng.choice([None, 5, 10, 25]),
+            'is_active': rng.random() < 0.9,
+        }
+
+
+def seed(users, products, seed=1, batch_size=5000):
+    """Insert the users and products into the current app's database (inside an app context)."""
+    from sqlalchemy import insert, select
+    from werkzeug.security import generate_password_hash
+    from app import db
+    from app.facets import rebuild_facets
+    from app.models import User, Product, ProductPrice, utcnow
+
+    db.create_all()
+    if db.session.scalar(select(Product.id).where(Product.sku.like(f'{SKU_PREFIX}%')).limit(1)) is not None:
+        raise SystemExit('Load test data already present; use a fresh database (or --reset).')
+    db.session.execute(insert(User), user_rows(users, generate_password_hash(PASSWORD)))
+    batch = []
+    for row in product_rows(products, seed):
+        row['is_low_stock'] = row['reorder_point'] is not None and row['stock_quantity'] <= row['reorder_point']
+        batch.append(row)
+        if len(batch) == batch_size:
+            db.session.execute(insert(Product), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(Product), batch)
+    now = utcnow()
+    db.session.execute(insert(ProductPrice).from_select(
+        ['product_id', 'sku', 'price', 'effective_from'],
+        select(Product.id, db.func.lower(Product.sku), Product.price, db.literal(now))
+        .where(Product.sku.like(f'{SKU_PREFIX}%'))))
+    db.session.commit()
+    rebuild_facets()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reset', action='store_true', help='Drop and recreate all tables first.')
+    args = parser.parse_args()
+
+    from app import create_app, db
+    app = create_app()
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+        seed(args.users, args.products, args.seed)
+    print(f'Seeded {args.users} users ({USER_PREFIX}0..{args.users - 1}, password {PASSWORD!r}) '
+          f'and {args.products} products ({sku(0)}..{sku(args.products - 1)}) into '
+          f"{app.config['SQLALCHEMY_DATABASE_URI']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,18 +9,54 @@ dotenv_path = os.path.join(basedir, '.env')
 # Load the .env file from the specified path
 load_dotenv(dotenv_path=dotenv_path)
 
+# Read replicas: comma-separated database URLs, exposed as binds replica1, replica2, ...
+_replica_urls = [url.strip() for url in (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',') if url.strip()]
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-should-really-change-this' # Change this!
     # Default to SQLite if DATABASE_URL is not set
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'instance', 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_BINDS = {f'replica{i}': url for i, url in enumerate(_replica_urls, 1)}
+    DB_REPLICA_BINDS = list(SQLALCHEMY_BINDS) # GET requests read from these (see app/db_routing.py)
+    # Seconds a client keeps reading from the primary after it writes (read-your-writes)
+    DB_PRIMARY_STICKY_SECONDS = int(os.environ.get('DB_PRIMARY_STICKY_SECONDS') or 5)
+    # Async API (asgi.py): derived from SQLALCHEMY_DATABASE_URI (aiosqlite/asyncpg) unless set
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+    ASYNC_DB_POOL_SIZE = 20
+    ASYNC_DB_MAX_OVERFLOW = 10
+    # Login throttling: 'memory' is per worker, 'database' shares counters across workers
+    LOGIN_RATE_LIMIT_STORAGE = os.environ.get('LOGIN_RATE_LIMIT_STORAGE') or 'memory'
+    # Per-worker in-memory copy of the active catalog for product reads (see app/catalog.py)
+    CATALOG_SNAPSHOT_ENABLED = (os.environ.get('CATALOG_SNAPSHOT_ENABLED') or '').lower() in ('1', 'true', 'yes')
+    CATALOG_SNAPSHOT_MAX_AGE = int(os.environ.get('CATALOG_SNAPSHOT_MAX_AGE') or 5)
+    # Request profiling (see app/profiling.py); off unless PROFILING_ENABLED is set
+    PROFILING_ENABLED = (os.environ.get('PROFILING_ENABLED') or '').lower() in ('1', 'true', 'yes')
+    PROFILING_MODE = os.environ.get('PROFILING_MODE') or 'sampling'
+    PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE') or 0)
+    PROFILING_ENDPOINTS = [e.strip() for e in (os.environ.get('PROFILING_ENDPOINTS') or '').split(',') if e.strip()]
+    # Slow-query log (see app/slow_queries.py)
+    SLOW_QUERY_LOG_ENABLED = (os.environ.get('SLOW_QUERY_LOG_ENABLED') or '').lower() in ('1', 'true', 'yes')
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS') or 200)
+    # Structured JSON logs (see app/logs.py); off unless LOG_ENABLED is set
+    LOG_ENABLED = (os.environ.get('LOG_ENABLED') or '').lower() in ('1', 'true', 'yes')
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
+    LOG_ACCESS_SAMPLE_RATE = float(os.environ.get('LOG_ACCESS_SAMPLE_RATE') or 1.0)
     # Add other configurations here, e.g., mail server, etc.
 
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:' # Use in-memory SQLite for tests
+    SQLALCHEMY_BINDS = {} # No replicas unless a test sets them up
+    DB_REPLICA_BINDS = []
     WTF_CSRF_ENABLED = False # Disable CSRF forms validation in tests
+    AUDIT_BACKGROUND_WRITER = False # Tests drain the audit queue explicitly
+    CATALOG_SNAPSHOT_ENABLED = False # Enabled by tests/test_catalog.py's own app
+    PROFILING_ENABLED = False
+    SLOW_QUERY_LOG_ENABLED = False
+    LOG_ENABLED = False
+    IMAGE_WORKERS = 0 # Render thumbnails in the job's thread; tests/test_images.py starts its own pools
     SECRET_KEY = 'test-secret-key' # Use a fixed key for tests
     SERVER_NAME = 'localhost' # Required for url_for() in tests
     APPLICATION_ROOT = '/' # Required for url_for() in tests
@@ -0,0 +1,95 @@
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from flask import url_for
+from sqlalchemy import delete, func, select, update
+from app import db
+from app.archive import ArchiveError, archive_products, archive_command, restore_product, archive_stats
+from app.change_feed import changes_since
+from app.facets import category_facets
+from app.models import (Product, ProductPrice, StockLocation, LocationStock, archived_products,
+                        archived_product_prices, archived_location_stock, utcnow)
+from app.inventory import adjust_location_stock
+from tests.test_auth import test_user  # Import the test_user fixture
+from tests.test_products import logged_in_client
+
+
+@pytest.fixture(scope='function')
+def catalog(app_context):
+    db.session.add(StockLocation(code='ARC', name='Archive test', priority=1))
+    db.session.commit()
+    yield
+    for table in (LocationStock.__table__, ProductPrice.__table__, Product.__table__, StockLocation.__table__,
+                  archived_products, archived_product_prices, archived_location_stock):
+        db.session.execute(delete(table))
+    db.session.commit()
+
+
+def add(sku, age_days=0, is_active=False, stock=0):
+    product = Product(sku=sku, name=sku, price=Decimal('2.00'), category='Old', is_active=is_active)
+    db.session.add(product)
+    db.session.commit()
+    if stock:
+        adjust_location_stock(product, 'ARC', stock)
+        db.session.commit()
+    # Backdate without touching the change listeners
+    db.session.execute(update(Product).where(Product.id == product.id)
+                       .values(date_updated=utcnow() - timedelta(days=age_days)))
+    db.session.commit()
+    return product
+
+
+def count(table, **where):
+    return db.session.scalar(select(func.count()).select_from(table)
+                             .where(*(table.c[k] == v for k, v in where.items())))
+
+
+def test_archives_in_chunks_with_history(catalog):
+    old_ids = [add(f'ARC-{n}', age_days=400, stock=n + 1).id for n in range(5)]
+    add('ARC-RECENT', age_days=10)
+    add('ARC-LIVE', age_days=400, is_active=True)
+    assert {f['category']: f['total'] for f in category_facets()} == {'Old': 7}
+    cursor = changes_since()['cursor']
+
+    older_than = utcnow() - timedelta(days=365)
+    assert archive_products(older_than, chunk_size=2, max_chunks=2) == 4
+    assert archive_products(older_than, chunk_size=2) == 1
+    assert archive_stats() == (2, 5)
+    assert {p.sku for p in Product.query} == {'ARC-RECENT', 'ARC-LIVE'}
+    assert count(archived_product_prices) == 5 and count(archived_location_stock) == 5
+    assert count(ProductPrice.__table__, product_id=old_ids[0]) == 0
+    assert count(LocationStock.__table__) == 0
+    assert {f['category']: f['total'] for f in category_facets()} == {'Old': 2}
+    assert [(c['op'], c['sku']) for c in changes_since(cursor)['changes']] == \
+        [('delete', f'ARC-{n}') for n in range(5)]
+
+def test_restore(catalog, logged_in_client):
+    product = add('ARC-BACK', age_days=400, stock=3)
+    product_id = product.id
+    archive_products(utcnow() - timedelta(days=365))
+
+    response = logged_in_client.get(url_for('products.view_product', sku='arc-back'))
+    assert response.status_code == 200
+    assert b'flask products restore ARC-BACK' in response.data
+    assert b'/edit' not in response.data
+
+    assert restore_product('arc-back') == product_id
+    restored = db.session.get(Product, product_id)
+    assert (restored.sku, restored.is_active, restored.stock_quantity) == ('ARC-BACK', False, 3)
+    assert count(LocationStock.__table__, product_id=product_id) == 1
+    assert count(ProductPrice.__table__, product_id=product_id) == 1
+    assert archive_stats() == (1, 0)
+    assert archive_products(utcnow() - timedelta(days=365)) == 0 # Fresh date_updated
+    with pytest.raises(ArchiveError, match='No archived product'):
+        restore_product('ARC-BACK')
+
+def test_restore_refuses_a_taken_sku(catalog, test_app):
+    add('ARC-SKU', age_days=400)
+    archive_products(utcnow() - timedelta(days=365))
+    add('arc-sku', is_active=True)
+    runner = test_app.test_cli_runner()
+    result = runner.invoke(archive_command, ['--dry-run', '--older-than-days', '0'])
+    assert result.output.strip() == '0 products would be archived.' # The new one is active
+    with pytest.raises(ArchiveError, match='now has its SKU'):
+        restore_product('ARC-SKU')
+    assert archive_stats() == (1, 1)
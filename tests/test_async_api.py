@@ -0,0 +1,118 @@
+import asyncio
+import os
+import pytest
+import httpx
+from decimal import Decimal
+from flask import url_for
+from app import create_app, db
+from app.models import User, Product
+from app.async_api import create_asgi_app, async_database_url
+from config import TestingConfig
+
+
+@pytest.fixture(scope='module')
+def test_app(tmp_path_factory):
+    """The async engine needs a database file it can open too, not the in-memory one."""
+    path = tmp_path_factory.mktemp('async') / 'app.db'
+
+    class FileConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+
+    flask_env = os.environ.pop('FLASK_ENV', None)
+    try:
+        app = create_app(FileConfig)
+    finally:
+        if flask_env is not None:
+            os.environ['FLASK_ENV'] = flask_env
+    with app.app_context():
+        db.create_all()
+        user = User(username='asyncuser', email='async@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.add_all([
+            Product(sku='ASYNC-1', name='One', price=Decimal('1.50'), category='Async'),
+            Product(sku='ASYNC-2', name='Two', price=Decimal('2.50'), category='Async', is_active=False),
+            Product(sku='OTHER-1', name='Other', price=Decimal('3.00')),
+        ])
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture(scope='module')
+def session_cookie(test_app):
+    client = test_app.test_client()
+    client.post(url_for('auth.login'), data={'username': 'asyncuser', 'password': 'password'})
+    return client.get_cookie(test_app.config['SESSION_COOKIE_NAME']).value
+
+
+@pytest.fixture(scope='function')
+def sync_client(test_app, session_cookie):
+    client = test_app.test_client()
+    client.set_cookie(test_app.config['SESSION_COOKIE_NAME'], session_cookie)
+    return client
+
+
+def call_async(test_app, cookie, *requests):
+    """Issue (method, path, json) requests concurrently against the ASGI app."""
+    async def run():
+        asgi = create_asgi_app(test_app)
+        cookies = {test_app.config['SESSION_COOKIE_NAME']: cookie} if cookie else {}
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi), base_url='http://test',
+                                         cookies=cookies) as client:
+                return await asyncio.gather(*(client.request(method, path, json=body)
+                                              for method, path, body in requests))
+        finally:
+            await asgi.dispose()
+    return asyncio.run(run())
+
+
+def test_async_url_mapping():
+    assert async_database_url('sqlite:////tmp/x.db').drivername == 'sqlite+aiosqlite'
+    assert async_database_url('postgresql://u:p@h/db').drivername == 'postgresql+asyncpg'
+    with pytest.raises(ValueError):
+        async_database_url('mysql://u:p@h/db')
+
+def test_async_matches_sync(test_app, sync_client, session_cookie):
+    requests = [
+        ('GET', '/api/async/products?category=Async', None),
+        ('GET', '/api/async/products/async-1', None),
+        ('POST', '/api/async/products/lookup', {'skus': ['ASYNC-1', 'other-1', 'nope']}),
+    ]
+    page, product, lookup = call_async(test_app, session_cookie, *requests)
+    assert all(r.status_code == 200 for r in (page, product, lookup))
+
+    assert page.json() == sync_client.get(url_for('api.list_products', category='Async')).json
+    assert [p['sku'] for p in page.json()['products']] == ['ASYNC-1', 'ASYNC-2']
+    assert product.json() == sync_client.get(url_for('api.get_product', sku='async-1')).json
+    assert product.json()['product']['price'] == '1.50'
+    assert lookup.json() == sync_client.post(url_for('api.lookup_products'),
+                                             json={'skus': ['ASYNC-1', 'other-1', 'nope']}).json
+    assert lookup.json()['missing'] == ['nope']
+
+def test_async_pagination_and_filters(test_app, session_cookie):
+    first, = call_async(test_app, session_cookie, ('GET', '/api/async/products?limit=2', None))
+    after = first.json()['next_after']
+    second, inactive = call_async(test_app, session_cookie, ('GET', f'/api/async/products?after={after}', None),
+                                  ('GET', '/api/async/products?active=false', None))
+    assert [p['sku'] for p in second.json()['products']] == ['OTHER-1']
+    assert [p['sku'] for p in inactive.json()['products']] == ['ASYNC-2']
+
+def test_async_errors(test_app, session_cookie):
+    missing, bad_limit, bad_skus, wrong_method, unknown = call_async(
+        test_app, session_cookie,
+        ('GET', '/api/async/products/NOPE', None),
+        ('GET', '/api/async/products?limit=x', None),
+        ('POST', '/api/async/products/lookup', {'skus': 'ASYNC-1'}),
+        ('DELETE', '/api/async/products', None),
+        ('GET', '/api/async/nothing', None))
+    assert [r.status_code for r in (missing, bad_limit, bad_skus, wrong_method, unknown)] == [
+        404, 400, 400, 405, 404]
+
+def test_async_requires_login(test_app):
+    [anonymous] = call_async(test_app, None, ('GET', '/api/async/products', None))
+    [forged] = call_async(test_app, 'not-a-session', ('GET', '/api/async/products', None))
+    assert anonymous.status_code == 401
+    assert forged.status_code == 401
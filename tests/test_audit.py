@@ -0,0 +1,124 @@
+import pytest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from flask import url_for
+from sqlalchemy import inspect
+from app import db
+from app.models import Product
+from app.audit import query_audit_log, partition_name
+from app.bulk_update import BulkUpdate
+from tests.test_auth import test_user  # Import the test_user fixture
+from tests.test_products import logged_in_client
+
+
+@pytest.fixture(scope='function')
+def writer(test_app):
+    writer = test_app.extensions['audit']
+    writer.flush() # Start each test with an empty queue
+    yield writer
+
+
+def test_create_update_delete_are_logged(app_context, writer):
+    p = Product(sku='AUD-1', name='Audited', price=Decimal('10.00'), stock_quantity=3)
+    db.session.add(p)
+    db.session.commit()
+    p.price = Decimal('12.50')
+    p.name = 'Audited' # Same value: not a change
+    db.session.commit()
+    db.session.delete(p)
+    db.session.commit()
+    assert writer.flush() == 3
+
+    entries = query_audit_log(sku='AUD-1')
+    assert [e['op'] for e in entries] == ['delete', 'update', 'create']
+    assert entries[1]['changes'] == {'price': ['10.00', '12.50']}
+    assert entries[2]['changes']['name'] == [None, 'Audited']
+    assert entries[2]['product_id'] == entries[1]['product_id'] is not None
+    assert entries[0]['changes']['stock_quantity'] == [3, None]
+    assert query_audit_log(sku='aud-1') == entries
+    assert {e['sku'] for e in entries} == {'aud-1'}
+
+def test_rolled_back_changes_are_not_logged(app_context, writer):
+    db.session.add(Product(sku='AUD-RB', name='Never', price=Decimal('1.00')))
+    db.session.flush()
+    db.session.rollback()
+    assert writer.flush() == 0
+
+def test_writes_go_to_monthly_partition(app_context, writer):
+    db.session.add(Product(sku='AUD-PART', name='Partitioned', price=Decimal('1.00')))
+    db.session.commit()
+    writer.flush()
+    assert partition_name(datetime.utcnow()) in inspect(db.engine).get_table_names()
+
+def test_bulk_updates_are_logged(app_context, writer):
+    db.session.add(Product(sku='AUD-BULK', name='Bulk', price=Decimal('5.00'), category='AuditBulk'))
+    db.session.commit()
+    BulkUpdate('price', 'delta', '1', category='AuditBulk').run()
+    writer.flush()
+    assert query_audit_log(sku='AUD-BULK')[0]['changes'] == {'price': ['5.00', '6.00']}
+
+def test_time_range_filter(app_context, writer):
+    db.session.add(Product(sku='AUD-TIME', name='Timed', price=Decimal('1.00')))
+    db.session.commit()
+    writer.flush()
+    future = datetime.utcnow() + timedelta(days=1)
+    assert query_audit_log(sku='AUD-TIME', since=future, until=future + timedelta(days=1)) == []
+    assert len(query_audit_log(sku='AUD-TIME', since=datetime.utcnow() - timedelta(days=400))) == 1
+
+def test_queue_overflow_writes_inline(test_app, app_context, writer, monkeypatch):
+    monkeypatch.setattr(writer, 'batch_size', 2)
+    writer.queue.maxsize = 2
+    try:
+        for i in range(5):
+            db.session.add(Product(sku=f'AUD-Q{i}', name='Queued', price=Decimal('1.00')))
+        db.session.commit()
+        assert writer.queue.qsize() <= 2
+    finally:
+        writer.queue.maxsize = test_app.config['AUDIT_QUEUE_SIZE']
+    writer.flush()
+    assert len(query_audit_log(sku='AUD-Q4')) == 1
+
+def test_background_thread_writes(test_app, app_context, writer, monkeypatch):
+    monkeypatch.setattr(writer, 'background', True)
+    monkeypatch.setattr(writer, 'flush_interval', 0.05)
+    try:
+        db.session.add(Product(sku='AUD-BG', name='Background', price=Decimal('1.00')))
+        db.session.commit()
+        for _ in range(100):
+            if writer.queue.empty():
+                break
+            writer._stopping.wait(0.05)
+    finally:
+        writer.stop()
+        writer._thread = None
+    assert len(query_audit_log(sku='AUD-BG')) == 1
+
+def test_audit_api_records_user(logged_in_client, test_user, writer):
+    response = logged_in_client.post(url_for('products.add_product'), data={
+        'sku': 'AUD-API', 'name': 'Via Form', 'price': '3.00', 'stock_quantity': '1', 'is_active': 'y'})
+    assert response.status_code == 302
+    writer.flush()
+    response = logged_in_client.get(url_for('api.audit_log', sku='Aud-Api'))
+    assert response.status_code == 200
+    [entry] = response.json['entries']
+    assert entry['op'] == 'create'
+    assert entry['user_id'] == test_user.id
+
+    response = logged_in_client.get(url_for('api.audit_log', user_id=test_user.id, since='not-a-date'))
+    assert response.status_code == 400
+
+def test_audit_api_accepts_utc_offsets(logged_in_client, writer):
+    logged_in_client.post(url_for('products.add_product'), data={
+        'sku': 'AUD-TZ', 'name': 'Offsets', 'price': '3.00', 'stock_quantity': '1', 'is_active': 'y'})
+    writer.flush()
+    now = datetime.utcnow()
+    # The same instant written three ways: an hour ago in UTC, with Z, and at +02:00
+    for since in ((now - timedelta(hours=1)).isoformat() + '+00:00',
+                  (now - timedelta(hours=1)).isoformat() + 'Z',
+                  (now + timedelta(hours=1)).isoformat() + '+02:00'):
+        response = logged_in_client.get(url_for('api.audit_log', sku='AUD-TZ', since=since))
+        assert response.status_code == 200, since
+        assert [e['op'] for e in response.json['entries']] == ['create'], since
+    response = logged_in_client.get(url_for('api.audit_log', sku='AUD-TZ',
+                                            since=(now + timedelta(minutes=30)).isoformat() + 'Z'))
+    assert response.json['entries'] == []
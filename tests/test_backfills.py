@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+import pytest
+import sqlalchemy as sa
+from decimal import Decimal
+from app import create_app, db
+from app.backfills import backfill, BackfillRunner, BackfillBusy, backfill_cli
+from app.models import BackfillProgress, Product
+from config import TestingConfig
+
+ROWS = 1_000_000
+
+# Stands in for a big table that just got a new, empty column
+metadata = sa.MetaData()
+synthetic = sa.Table('backfill_synthetic', metadata,
+                     sa.Column('id', sa.Integer, primary_key=True),
+                     sa.Column('sku', sa.String(80), nullable=False),
+                     sa.Column('sku_normalized', sa.String(80), nullable=True))
+
+
+@backfill('test.sku_normalized', synthetic)
+def normalize_skus(start_id, end_id):
+    """Lower-case SKUs into sku_normalized."""
+    return db.session.execute(
+        synthetic.update().where(synthetic.c.id.between(start_id, end_id), synthetic.c.sku_normalized.is_(None))
+        .values(sku_normalized=sa.func.lower(synthetic.c.sku))).rowcount
+
+
+@pytest.fixture(scope='module')
+def test_app(tmp_path_factory):
+    class BackfillConfig(TestingConfig):
+        # A file, so the reader thread below has a connection of its own
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path_factory.mktemp('backfill') / 'backfill.db')
+        BACKFILL_PAUSE = 0.005
+
+    flask_env = os.environ.pop('FLASK_ENV', None)
+    try:
+        app = create_app(BackfillConfig)
+    finally:
+        if flask_env is not None:
+            os.environ['FLASK_ENV'] = flask_env
+    with app.app_context():
+        db.create_all()
+        metadata.create_all(db.engine)
+        yield app
+        db.session.remove()
+        metadata.drop_all(db.engine)
+        db.drop_all()
+
+
+@pytest.fixture(scope='function')
+def rows(app_context):
+    def fill(count):
+        with db.engine.begin() as connection:
+            connection.execute(synthetic.delete())
+            connection.execute(BackfillProgress.__table__.delete())
+            connection.exec_driver_sql(
+                'INSERT INTO backfill_synthetic (id, sku) WITH RECURSIVE n(i) AS '
+                '(SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?) '
+                "SELECT i, 'SKU-' || i FROM n", (count,))
+    return fill
+
+
+def missing():
+    return db.session.scalar(sa.select(sa.func.count()).where(synthetic.c.sku_normalized.is_(None)))
+
+
+def test_backfills_a_million_rows_while_reads_continue(test_app, rows):
+    rows(ROWS)
+    stop, reads, errors, seen = threading.Event(), [], [], set()
+    engine = db.engine
+
+    def reader():
+        with engine.connect() as connection:
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    row_id = len(reads) * 7919 % ROWS + 1
+                    row = connection.execute(sa.select(synthetic).where(synthetic.c.id == row_id)).one()
+                    done = connection.scalar(sa.select(sa.func.count(synthetic.c.sku_normalized))
+                                             .where(synthetic.c.id <= 200_000))
+                    connection.rollback()
+                except Exception as e:
+                    errors.append(e)
+                    break
+                reads.append(time.perf_counter() - started)
+                seen.add(done)
+                if row.sku_normalized not in (None, row.sku.lower()):
+                    errors.append(row)
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    try:
+        runner = BackfillRunner(test_app, 'test.sku_normalized', batch_size=1000)
+        state = runner.run()
+    finally:
+        stop.set()
+        thread.join()
+
+    assert errors == []
+    assert (state.status, state.last_id, state.max_id, state.rows_updated) == ('done', ROWS, ROWS, ROWS)
+    assert missing() == 0
+    assert runner.batch_size > 1000 # Grew while batches stayed fast
+    assert runner.stats['batches'] == state.batches
+    # Reads ran throughout and saw the table part-way through the backfill
+    assert len(reads) > runner.stats['batches']
+    assert any(0 < done < 200_000 for done in seen)
+    assert max(reads) < 2
+
+def test_resumes_from_checkpoint(test_app, rows):
+    rows(10_000)
+    runner = BackfillRunner(test_app, 'test.sku_normalized', batch_size=1000, max_batch_size=1000, pause=0)
+    state = runner.run(max_batches=3)
+    assert (state.status, state.last_id, state.rows_updated, state.locked_by) == ('paused', 3000, 3000, None)
+    assert missing() == 7000
+
+    runner = BackfillRunner(test_app, 'test.sku_normalized', batch_size=1000, max_batch_size=1000, pause=0)
+    state = runner.run()
+    assert (state.status, state.batches, state.rows_updated) == ('done', 10, 10_000)
+    assert runner.stats['batches'] == 7 # Only the remaining batches
+    assert missing() == 0
+    # Done backfills are not run again unless restarted
+    assert BackfillRunner(test_app, 'test.sku_normalized').run().batches == 10
+
+def test_failed_batch_is_rolled_back_and_recorded(test_app, rows, monkeypatch):
+    rows(5000)
+    runner = BackfillRunner(test_app, 'test.sku_normalized', batch_size=1000, max_batch_size=1000, pause=0)
+    calls = []
+    def flaky(start_id, end_id):
+        calls.append(start_id)
+        updated = normalize_skus(start_id, end_id)
+        if len(calls) == 3:
+            raise RuntimeError('boom')
+        return updated
+    monkeypatch.setattr(runner, 'func', flaky)
+    with pytest.raises(RuntimeError):
+        runner.run()
+    state = runner.progress()
+    assert (state.status, state.last_id) == ('failed', 2000)
+    assert 'RuntimeError: boom' in state.last_error
+    assert missing() == 3000 # The failed batch's rows were rolled back with its checkpoint
+
+    state = BackfillRunner(test_app, 'test.sku_normalized', pause=0).run()
+    assert (state.status, state.rows_updated) == ('done', 5000)
+
+def test_one_runner_at_a_time(test_app, rows):
+    rows(100)
+    first = BackfillRunner(test_app, 'test.sku_normalized')
+    assert first.claim()
+    with pytest.raises(BackfillBusy):
+        BackfillRunner(test_app, 'test.sku_normalized').claim()
+    # A runner that stopped heartbeating is taken over
+    db.session.execute(sa.update(BackfillProgress).values(heartbeat_at=sa.func.datetime('now', '-1 hour')))
+    db.session.commit()
+    assert BackfillRunner(test_app, 'test.sku_normalized').claim()
+    with pytest.raises(BackfillBusy):
+        first.run_batch(0, 100)
+
+def test_low_stock_backfill(test_app, app_context):
+    db.session.add_all([Product(sku='BF-1', name='Low', price=Decimal('1.00'), stock_quantity=1, reorder_point=5),
+                        Product(sku='BF-2', name='Fine', price=Decimal('1.00'), stock_quantity=9, reorder_point=5)])
+    db.session.commit()
+    db.session.execute(sa.update(Product).values(is_low_stock=False)) # As if the flag were added just now
+    db.session.commit()
+    result = test_app.test_cli_runner().invoke(backfill_cli, ['run', 'products.is_low_stock', '--restart'])
+    assert result.exit_code == 0, result.output
+    assert 'products.is_low_stock: done, 1 rows in 1 batches' in result.output
+    assert [p.sku for p in Product.query.filter_by(is_low_stock=True)] == ['BF-1']
+
+    listing = test_app.test_cli_runner().invoke(backfill_cli, ['list']).output
+    assert 'products.is_low_stock' in listing and 'done' in listing
+    assert 'test.sku_normalized' in listing
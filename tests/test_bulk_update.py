@@ -0,0 +1,116 @@
+import io
+import pytest
+from decimal import Decimal
+from flask import url_for
+from app import db
+from app.models import Product
+from app.bulk_update import BulkUpdate, BulkUpdateError, bulk_update_command
+from tests.test_auth import test_user  # Import the test_user fixture
+from tests.test_products import logged_in_client
+
+
+@pytest.fixture(scope='function')
+def catalog(test_app):
+    with test_app.app_context():
+        products = [
+            Product(sku='SHOE-1', name='Runner', price=Decimal('100.00'), category='Shoes', stock_quantity=10),
+            Product(sku='SHOE-2', name='Walker', price=Decimal('50.00'), category='Shoes', stock_quantity=2),
+            Product(sku='SHOE-3', name='Old Boot', price=Decimal('20.00'), category='Shoes', stock_quantity=0,
+                    is_active=False),
+            Product(sku='HAT-1', name='Cap', price=Decimal('15.00'), category='Hats', stock_quantity=5),
+        ]
+        db.session.add_all(products)
+        db.session.commit()
+        yield products
+        Product.query.delete()
+        db.session.commit()
+
+
+def prices():
+    return {p.sku: p.price for p in Product.query.all()}
+
+
+def test_percent_price_change_for_category(app_context, catalog):
+    report = BulkUpdate('price', 'percent', '-10', category='Shoes', chunk_size=2).run()
+    assert report['updated'] == 3
+    assert report['chunks'] == 2
+    db.session.expire_all()
+    assert prices() == {'SHOE-1': Decimal('90.00'), 'SHOE-2': Decimal('45.00'),
+                        'SHOE-3': Decimal('18.00'), 'HAT-1': Decimal('15.00')}
+
+def test_delta_skips_rows_that_would_go_negative(app_context, catalog):
+    report = BulkUpdate('stock_quantity', 'delta', -3, category='Shoes', is_active=True).run()
+    assert report['matched'] == 2
+    assert report['updated'] == 1 # SHOE-2 only has 2 in stock
+    assert report['skipped'] == 1
+    db.session.expire_all()
+    assert db.session.get(Product, catalog[0].id).stock_quantity == 7
+    assert db.session.get(Product, catalog[1].id).stock_quantity == 2
+
+def test_set_by_sku_list_reports_missing(app_context, catalog):
+    report = BulkUpdate('is_active', 'set', 'false', skus=['shoe-1', 'HAT-1', 'NOPE']).run()
+    assert report['updated'] == 2
+    assert report['missing_skus'] == ['nope']
+    db.session.expire_all()
+    assert Product.query.filter_by(is_active=True).count() == 1
+
+def test_dry_run_changes_nothing(app_context, catalog):
+    report = BulkUpdate('price', 'delta', '-60', category='Shoes').preview()
+    assert report['matched'] == 3
+    assert report['would_update'] == 1
+    assert report['would_skip'] == 2
+    assert report['preview'][0] == {'sku': 'SHOE-1', 'old': Decimal('100.00'), 'new': Decimal('40.00'),
+                                    'skipped': False}
+    assert report['preview'][1]['skipped'] is True
+    db.session.expire_all()
+    assert prices()['SHOE-1'] == Decimal('100.00')
+
+def test_invalid_specs_rejected(app_context):
+    with pytest.raises(BulkUpdateError):
+        BulkUpdate('name', 'set', 'x')
+    with pytest.raises(BulkUpdateError):
+        BulkUpdate('category', 'percent', '10')
+    with pytest.raises(BulkUpdateError):
+        BulkUpdate('price', 'set', '5').validate() # No filter: would touch every product
+
+def test_bulk_update_api(logged_in_client, catalog):
+    response = logged_in_client.post(url_for('api.bulk_update_products'), json={
+        'field': 'category', 'operation': 'set', 'value': 'Headwear', 'category': 'Hats'})
+    assert response.status_code == 200
+    assert response.json['updated'] == 1
+    with logged_in_client.application.app_context():
+        assert Product.query.filter_by(category='Headwear').count() == 1
+
+def test_bulk_update_api_sku_upload_dry_run(logged_in_client, catalog):
+    response = logged_in_client.post(url_for('api.bulk_update_products'), data={
+        'field': 'price', 'operation': 'set', 'value': '9.99', 'dry_run': 'true',
+        'sku_file': (io.BytesIO(b'sku\nSHOE-1\nHAT-1\n'), 'skus.csv'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.json['matched'] == 2
+    assert response.json['dry_run'] is True
+
+def test_bulk_update_api_bad_request(logged_in_client):
+    response = logged_in_client.post(url_for('api.bulk_update_products'), json={'field': 'price'})
+    assert response.status_code == 400
+    response = logged_in_client.post(url_for('api.bulk_update_products'), json=['price', 'set', '1'])
+    assert response.status_code == 400
+    assert response.json['error'] == 'Expected a JSON object'
+
+def test_bulk_update_api_rejects_a_sku_string(logged_in_client, catalog):
+    for skus in ('HAT-1', ['HAT-1', 7]):
+        response = logged_in_client.post(url_for('api.bulk_update_products'), json={
+            'field': 'price', 'operation': 'set', 'value': '1.00', 'skus': skus})
+        assert response.status_code == 400
+        assert response.json['error'] == "'skus' must be a list of strings"
+    with logged_in_client.application.app_context():
+        assert Product.query.filter_by(price=1).count() == 0
+
+def test_bulk_update_cli(test_app, catalog):
+    runner = test_app.test_cli_runner()
+    result = runner.invoke(bulk_update_command, ['--field', 'price', '--op', 'percent', '--value', '100',
+                                                 '--category', 'Hats'])
+    assert result.exit_code == 0, result.output
+    assert 'Done: 1 updated' in result.output
+    with test_app.app_context():
+        assert Product.query.filter_by(sku='HAT-1').one().price == Decimal('30.00')
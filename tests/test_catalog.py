@@ -0,0 +1,151 @@
+import os
+import pytest
+from decimal import Decimal
+from flask import url_for
+from datetime import timedelta
+from sqlalchemy import delete, insert, select, update
+from app import create_app, db
+from app.catalog import catalog_snapshot
+from app.change_feed import UPSERT, _allocate
+from app.models import User, Product, ProductChange, ChangeSequence, utcnow
+from app.product_reads import page_result, product_page_query, lookup_result, sku_lookup_query
+from config import TestingConfig
+
+
+@pytest.fixture(scope='module')
+def test_app():
+    class SnapshotConfig(TestingConfig):
+        CATALOG_SNAPSHOT_ENABLED = True
+
+    flask_env = os.environ.pop('FLASK_ENV', None)
+    try:
+        app = create_app(SnapshotConfig) # No tables yet, so the snapshot loads on first use
+    finally:
+        if flask_env is not None:
+            os.environ['FLASK_ENV'] = flask_env
+    with app.app_context():
+        db.create_all()
+        user = User(username='snapuser', email='snap@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture(scope='function')
+def client(test_app):
+    client = test_app.test_client()
+    client.post(url_for('auth.login'), data={'username': 'snapuser', 'password': 'password'})
+    return client
+
+
+@pytest.fixture(scope='function')
+def snapshot(test_app):
+    db.session.add_all([
+        Product(sku='SNAP-1', name='Bravo', price=Decimal('1.50'), category='Snap', stock_quantity=3),
+        Product(sku='SNAP-2', name='Alpha', price=Decimal('12.00'), category='Snap'),
+        Product(sku='SNAP-3', name='Charlie', price=Decimal('0.99')),
+        Product(sku='SNAP-4', name='Hidden', price=Decimal('5.00'), category='Snap', is_active=False),
+    ])
+    db.session.commit()
+    snapshot = test_app.extensions['catalog_snapshot']
+    snapshot.refresh(full=True)
+    yield snapshot
+    db.session.execute(delete(Product))
+    db.session.commit()
+
+
+def other_worker_update(sku='SNAP-1', **values):
+    """A change this worker's session listeners don't see, like one committed by another worker.
+
+    Only its change feed entry, written in the same transaction, tells the snapshot about it.
+    """
+    product_id = db.session.scalar(select(Product.id).where(Product.sku == sku))
+    db.session.execute(update(Product).where(Product.id == product_id).values(**values))
+    seq = _allocate(db.session.connection(), 1)
+    db.session.execute(insert(ProductChange).values(seq=seq, product_id=product_id, op=UPSERT, changed_at=utcnow()))
+    db.session.commit()
+
+
+def expire(snapshot):
+    snapshot.refreshed_at -= snapshot.max_age + 1
+
+
+def test_holds_active_products(snapshot):
+    assert len(snapshot) == 3
+    product = snapshot.get_by_sku('snap-1')
+    assert (product.price_cents, product.price, product.stock_quantity) == (150, Decimal('1.50'), 3)
+    assert product.date_updated == Product.query.filter_by(sku='SNAP-1').one().date_updated
+    assert snapshot.get_by_sku('SNAP-4') is None
+    assert [p.name for p in snapshot.by_name('Snap')] == ['Alpha', 'Bravo']
+    assert [p.name for p in snapshot.by_name('')] == ['Charlie']
+    assert [p.sku for p in snapshot.page(after_id=snapshot.get_by_sku('SNAP-1').id, limit=10)] == ['SNAP-2', 'SNAP-3']
+
+def test_refreshes_from_the_change_feed(snapshot):
+    other_worker_update(price=Decimal('2.25'))
+    catalog_snapshot()
+    assert snapshot.get_by_sku('SNAP-1').price_cents == 150 # Not due yet
+    expire(snapshot)
+    catalog_snapshot()
+    assert snapshot.get_by_sku('SNAP-1').price_cents == 225
+
+    other_worker_update(is_active=False)
+    snapshot.refresh()
+    assert snapshot.get_by_sku('SNAP-1') is None
+    assert [p.name for p in snapshot.by_name('Snap')] == ['Alpha']
+    other_worker_update(is_active=True)
+    snapshot.refresh()
+    assert [p.name for p in snapshot.by_name('Snap')] == ['Alpha', 'Bravo']
+
+def test_late_commit_with_an_old_date_updated(snapshot):
+    # E.g. a bulk update or archive chunk that set date_updated long before it committed
+    other_worker_update(name='Committed late', date_updated=utcnow() - timedelta(hours=1))
+    snapshot.refresh()
+    assert snapshot.get_by_sku('SNAP-1').name == 'Committed late'
+
+def test_cursor_behind_compaction_reloads(snapshot):
+    other_worker_update(name='After compaction')
+    db.session.execute(update(ChangeSequence).values(compacted_seq=ChangeSequence.last_seq))
+    db.session.execute(delete(ProductChange)) # Tombstones it may have needed are gone
+    db.session.commit()
+    snapshot.refresh()
+    assert snapshot.get_by_sku('SNAP-1').name == 'After compaction'
+    assert snapshot.cursor == db.session.scalar(select(ChangeSequence.last_seq))
+
+def test_notices_deleted_rows(snapshot):
+    db.session.execute(delete(Product).where(Product.sku == 'SNAP-2'))
+    db.session.commit()
+    snapshot.refresh()
+    assert snapshot.get_by_sku('SNAP-2') is None
+    assert len(snapshot) == 2
+
+def test_own_commits_are_read_immediately(snapshot, client):
+    product = Product.query.filter_by(sku='SNAP-1').one()
+    product.name = 'Renamed'
+    db.session.commit()
+    assert snapshot.stale
+    assert b'Renamed' in client.get(url_for('products.view_product', sku='snap-1')).data
+
+def test_read_routes_use_snapshot(snapshot, client):
+    other_worker_update(name='Changed elsewhere')
+    assert b'Bravo' in client.get(url_for('products.view_product', sku='SNAP-1')).data
+    assert client.get(url_for('api.get_product', sku='SNAP-1')).json['product']['name'] == 'Bravo'
+    response = client.get(url_for('products.list_products', active=1, category='Snap'))
+    assert response.data.index(b'Alpha') < response.data.index(b'Bravo')
+    assert b'Hidden' not in response.data
+    # Inactive products are still found, in the database
+    assert b'Hidden' in client.get(url_for('products.view_product', sku='SNAP-4')).data
+
+    expire(snapshot)
+    assert b'Changed elsewhere' in client.get(url_for('products.view_product', sku='SNAP-1')).data
+
+def test_api_matches_database(snapshot, client):
+    skus = ['snap-1', 'SNAP-4', 'SNAP-3', 'missing']
+    assert client.post(url_for('api.lookup_products'), json={'skus': skus}).json == \
+        lookup_result(skus, db.session.execute(sku_lookup_query(skus)))
+    for args in ({'active': '1'}, {'active': '1', 'category': 'Snap', 'limit': 1}, {}):
+        expected = page_result(db.session.execute(product_page_query(
+            after_id=None, limit=args.get('limit'), category=args.get('category'), active=args.get('active'))))
+        assert client.get(url_for('api.list_products', **args)).json == expected
@@ -0,0 +1,134 @@
+import json
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from flask import url_for
+from sqlalchemy import delete, update
+from app import db
+from app.models import Product, ProductChange, ChangeSequence, utcnow
+from app.bulk_update import BulkUpdate
+from app.change_feed import changes_since, compact_changes, feed_head, changes_command, CursorExpired
+from tests.test_auth import test_user  # Import the test_user fixture
+from tests.test_products import logged_in_client
+
+
+@pytest.fixture(scope='function')
+def feed(app_context):
+    db.session.execute(delete(ProductChange))
+    db.session.execute(delete(ChangeSequence))
+    db.session.commit()
+    yield
+    db.session.execute(delete(Product))
+    db.session.commit()
+
+
+def add(sku, **values):
+    product = Product(sku=sku, name=values.pop('name', sku), price=values.pop('price', Decimal('1.00')), **values)
+    db.session.add(product)
+    db.session.commit()
+    return product
+
+
+def ops(page):
+    return [(c['op'], c['product']['sku'] if c['op'] == 'upsert' else c['sku']) for c in page['changes']]
+
+
+def test_records_changes_in_commit_order(feed, logged_in_client):
+    first, second = add('FEED-1'), add('FEED-2')
+    first.price = Decimal('2.00')
+    db.session.commit()
+    second.name = second.name # No net change: nothing recorded
+    db.session.commit()
+    assert logged_in_client.post(url_for('products.delete_product', sku='feed-2')).status_code == 302
+    db.session.add(Product(sku='FEED-3', name='Rolled back', price=Decimal('1.00')))
+    db.session.flush()
+    db.session.rollback()
+
+    entries = [(c.seq, c.product_id, c.op, c.sku) for c in ProductChange.query.order_by(ProductChange.seq)]
+    assert entries == [(1, first.id, 'U', None), (2, second.id, 'U', None), (3, first.id, 'U', None),
+                       (4, second.id, 'D', 'FEED-2')]
+    assert feed_head() == (4, 0)
+
+def test_pages_return_current_state_of_changed_products(feed):
+    products = [add(f'FEED-{n}') for n in range(5)]
+    cursor = changes_since()['cursor']
+    products[1].price = Decimal('9.99')
+    db.session.commit()
+    products[1].name = 'Renamed'
+    db.session.commit()
+    BulkUpdate('stock_quantity', 'set', 7, skus=['feed-3']).run()
+    db.session.delete(products[4])
+    db.session.commit()
+
+    page = changes_since(cursor, limit=3)
+    assert ops(page) == [('upsert', 'FEED-1'), ('upsert', 'FEED-3')] # Two updates of FEED-1, one returned
+    assert page['changes'][0]['product']['price'] == '9.99'
+    assert page['changes'][0]['product']['name'] == 'Renamed'
+    assert page['changes'][1]['product']['stock_quantity'] == 7
+    assert page['has_more']
+    page = changes_since(page['cursor'], limit=3)
+    assert ops(page) == [('delete', 'FEED-4')]
+    assert (page['has_more'], page['cursor']) == (False, feed_head()[0])
+    assert changes_since(page['cursor']) == {'changes': [], 'cursor': page['cursor'], 'has_more': False}
+
+def test_deleted_products_only_get_their_tombstone(feed):
+    product = add('FEED-GONE')
+    db.session.delete(product)
+    db.session.commit()
+    assert ops(changes_since(0)) == [('delete', 'FEED-GONE')]
+
+def age_entries():
+    db.session.execute(update(ProductChange).values(changed_at=utcnow() - timedelta(days=30)))
+    db.session.commit()
+
+
+def test_compaction_keeps_latest_state_for_every_cursor(feed):
+    kept, gone = add('FEED-KEEP'), add('FEED-GONE')
+    for price in ('2.00', '3.00'):
+        kept.price = Decimal(price)
+        db.session.commit()
+    age_entries()
+    recent = add('FEED-NEW')
+    recent.price = Decimal('5.00')
+    db.session.commit()
+
+    assert compact_changes(utcnow() - timedelta(days=7), chunk_size=2) == (2, 0) # FEED-KEEP's first two
+    assert [(c.product_id, c.op) for c in ProductChange.query.order_by(ProductChange.seq)] == \
+        [(gone.id, 'U'), (kept.id, 'U'), (recent.id, 'U'), (recent.id, 'U')] # Recent entries are all kept
+    page = changes_since(0) # A cursor from before the compaction still syncs everything
+    assert ops(page) == [('upsert', 'FEED-GONE'), ('upsert', 'FEED-KEEP'), ('upsert', 'FEED-NEW')]
+    assert page['changes'][1]['product']['price'] == '3.00'
+
+    db.session.delete(gone)
+    db.session.commit()
+    age_entries()
+    assert compact_changes(utcnow() - timedelta(days=7)) == (2, 1) # Superseded upserts of FEED-GONE and FEED-NEW; the tombstone
+    last_seq, compacted = feed_head()
+    assert compacted == last_seq
+    assert changes_since(compacted)['changes'] == []
+    with pytest.raises(CursorExpired):
+        changes_since(compacted - 1) # Could have missed FEED-GONE's deletion
+
+def test_api(feed, logged_in_client):
+    add('FEED-API')
+    response = logged_in_client.get(url_for('api.product_changes', since=0))
+    assert response.status_code == 200
+    assert ops(response.json) == [('upsert', 'FEED-API')]
+    assert response.json['cursor'] == 1
+    assert logged_in_client.get(url_for('api.product_changes', since='x')).status_code == 400
+
+    db.session.execute(update(ChangeSequence).values(compacted_seq=1))
+    db.session.commit()
+    response = logged_in_client.get(url_for('api.product_changes', since=0))
+    assert response.status_code == 410
+    assert (response.json['resync'], response.json['cursor']) == (True, 1)
+
+def test_cli_streams_batches(feed, test_app):
+    for n in range(5):
+        add(f'FEED-{n}')
+    runner = test_app.test_cli_runner(mix_stderr=False)
+    result = runner.invoke(changes_command, ['--since', '1', '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line)['product']['sku'] for line in result.stdout.splitlines()] == \
+        ['FEED-1', 'FEED-2', 'FEED-3', 'FEED-4']
+    assert result.stderr.strip() == 'cursor: 5'
@@ -0,0 +1,48 @@
+import gzip
+import pytest
+from flask import Response
+from app import compression
+
+
+@pytest.fixture(scope='module')
+def compressed_app(test_app):
+    # Registered before this module's first request; Flask refuses new routes after that
+    @test_app.route('/_compress/<kind>')
+    def compress_test_view(kind):
+        if kind == 'big':
+            return Response('x' * 2000, mimetype='text/html')
+        if kind == 'small':
+            return Response('tiny', mimetype='text/html')
+        if kind == 'binary':
+            return Response(b'\0' * 2000, mimetype='application/octet-stream')
+        if kind == 'stream':
+            return Response((c for c in 'x' * 2000), mimetype='text/html')
+        return Response('x' * 2000, mimetype='text/html', headers={'Cache-Control': 'no-transform'})
+    return test_app
+
+
+@pytest.fixture(scope='function')
+def gzip_only(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+
+
+def test_gzip_when_accepted(compressed_app, gzip_only):
+    response = compressed_app.test_client().get('/_compress/big', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert int(response.headers['Content-Length']) < 100
+    assert gzip.decompress(response.data) == b'x' * 2000
+
+@pytest.mark.parametrize('kind, accept', [
+    ('big', ''), ('big', 'gzip;q=0'), ('small', 'gzip'), ('binary', 'gzip'), ('stream', 'gzip'),
+    ('no-transform', 'gzip'),
+])
+def test_left_uncompressed(compressed_app, gzip_only, kind, accept):
+    response = compressed_app.test_client().get(f'/_compress/{kind}', headers={'Accept-Encoding': accept})
+    assert 'Content-Encoding' not in response.headers
+
+def test_brotli_preferred_when_installed(compressed_app):
+    brotli = pytest.importorskip('brotli')
+    response = compressed_app.test_client().get('/_compress/big', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == b'x' * 2000
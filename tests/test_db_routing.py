@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import pytest
+from decimal import Decimal
+from flask import url_for
+from sqlalchemy import event, select, update
+from app import create_app, db
+from app.models import User, Product
+from app.db_routing import STICKY_KEY
+from config import TestingConfig
+
+
+@pytest.fixture(scope='module')
+def test_app(tmp_path_factory):
+    """An app whose primary and replica are two SQLite files; replicate() copies one onto the other."""
+    path = tmp_path_factory.mktemp('replica')
+
+    class ReplicaConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{path / 'primary.db'}"
+        SQLALCHEMY_BINDS = {'replica1': f"sqlite:///{path / 'replica.db'}"}
+        DB_REPLICA_BINDS = ['replica1']
+
+    flask_env = os.environ.pop('FLASK_ENV', None)
+    try:
+        app = create_app(ReplicaConfig)
+    finally:
+        if flask_env is not None:
+            os.environ['FLASK_ENV'] = flask_env
+    with app.app_context():
+        db.create_all()
+        user = User(username='replicauser', email='replica@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        replicate()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        # Flask-SQLAlchemy registers a metadata per bind key on the shared `db`;
+        # drop it so other test apps don't look for a replica1 engine
+        db.metadatas.pop('replica1', None)
+
+
+def replicate():
+    """Stand-in for replication: copy the primary database file over the replica."""
+    db.session.commit()
+    db.engines['replica1'].dispose()
+    primary = sqlite3.connect(db.engines[None].url.database)
+    replica = sqlite3.connect(db.engines['replica1'].url.database)
+    primary.backup(replica)
+    primary.close()
+    replica.close()
+
+
+@pytest.fixture(scope='function')
+def client(test_app):
+    client = test_app.test_client()
+    client.post(url_for('auth.login'), data={'username': 'replicauser', 'password': 'password'})
+    with client.session_transaction() as session:
+        session.pop(STICKY_KEY, None)
+    yield client
+    Product.query.delete()
+    db.session.commit()
+    replicate()
+
+
+@pytest.fixture(scope='function')
+def replica_statements(test_app):
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engines['replica1'], 'before_cursor_execute', record)
+    yield statements
+    event.remove(db.engines['replica1'], 'before_cursor_execute', record)
+
+
+def test_get_requests_read_from_replica(client):
+    db.session.add(Product(sku='REPL-1', name='Not replicated yet', price=Decimal('1.00')))
+    db.session.commit()
+    assert b'REPL-1' not in client.get(url_for('products.list_products')).data
+    replicate()
+    assert b'REPL-1' in client.get(url_for('products.list_products')).data
+
+def test_reads_stick_to_primary_after_write(client):
+    response = client.post(url_for('products.add_product'), data={
+        'sku': 'REPL-2', 'name': 'Written', 'price': '2.00', 'stock_quantity': 1, 'is_active': 'y'})
+    assert response.status_code == 302
+    assert b'REPL-2' in client.get(url_for('products.list_products')).data # Replica doesn't have it yet
+
+    with client.session_transaction() as session:
+        session[STICKY_KEY] = 0 # Window over
+    assert b'REPL-2' not in client.get(url_for('products.list_products')).data
+
+def test_read_only_post_uses_replica(client, replica_statements):
+    client.post(url_for('api.product_prices_as_of'), json={'as_of': '2024-01-01T00:00:00', 'skus': ['x']})
+    assert any('product_prices' in s for s in replica_statements)
+
+def test_use_primary_view_skips_replica(client, replica_statements):
+    db.session.add(Product(sku='REPL-3', name='Edit me', price=Decimal('3.00')))
+    db.session.commit()
+    replicate()
+    replica_statements.clear()
+    assert client.get(url_for('products.edit_product', sku='REPL-3')).status_code == 200
+    assert not any('products' in s for s in replica_statements)
+
+def test_writes_and_locking_reads_go_to_primary(test_app):
+    primary, replica = db.engines[None], db.engines['replica1']
+    with test_app.test_request_context('/', method='GET'):
+        test_app.preprocess_request()
+        assert db.session.get_bind(clause=select(Product)) is replica
+        assert db.session.get_bind(clause=select(Product).with_for_update()) is primary
+        assert db.session.get_bind(clause=update(Product).values(name='x')) is primary
+        # After a write the request reads its own writes
+        assert db.session.get_bind(clause=select(Product)) is primary
+    # Outside requests (CLI, worker) everything uses the primary
+    assert db.session.get_bind(clause=select(Product)) is primary
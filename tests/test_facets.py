@@ -0,0 +1,87 @@
+import pytest
+from decimal import Decimal
+from flask import url_for
+from app import db
+from app.models import Product, CategoryFacet
+from app.bulk_update import BulkUpdate
+from app.facets import category_facets, rebuild_facets, rebuild_facets_command
+from tests.test_auth import test_user  # Import the test_user fixture
+from tests.test_products import logged_in_client
+
+
+@pytest.fixture(scope='function')
+def catalog(test_app):
+    with test_app.app_context():
+        products = [
+            Product(sku='BOOK-1', name='Novel', price=Decimal('10.00'), category='Books'),
+            Product(sku='BOOK-2', name='Atlas', price=Decimal('30.00'), category='Books', is_active=False),
+            Product(sku='TOY-1', name='Robot', price=Decimal('25.00'), category='Toys'),
+            Product(sku='MISC-1', name='Thing', price=Decimal('1.00')),
+        ]
+        db.session.add_all(products)
+        db.session.commit()
+        yield products
+        for p in Product.query.all():
+            db.session.delete(p)
+        db.session.commit()
+
+
+def facet_map():
+    return {f['category']: (f['active'], f['inactive']) for f in category_facets()}
+
+
+def test_counts_follow_inserts(app_context, catalog):
+    assert facet_map() == {None: (1, 0), 'Books': (1, 1), 'Toys': (1, 0)}
+
+def test_counts_follow_updates_and_deletes(app_context, catalog):
+    novel, atlas, robot, thing = catalog
+    novel.category = 'Toys'
+    atlas.is_active = True
+    thing.name = 'Renamed' # Not a facet field: no change
+    db.session.delete(robot)
+    db.session.commit()
+    assert facet_map() == {None: (1, 0), 'Books': (1, 0), 'Toys': (1, 0)}
+
+def test_category_change_keeps_expired_status(app_context, catalog):
+    atlas = catalog[1] # Inactive; all attributes expired after the fixture's commit
+    atlas.category = 'Maps'
+    db.session.commit()
+    assert facet_map()['Maps'] == (0, 1)
+    assert facet_map()['Books'] == (1, 0)
+
+def test_counts_follow_bulk_updates(app_context, catalog):
+    BulkUpdate('category', 'set', 'Games', category='Toys').run()
+    BulkUpdate('is_active', 'set', False, category='Books').run()
+    assert facet_map() == {None: (1, 0), 'Books': (0, 2), 'Games': (1, 0)}
+
+def test_rollback_discards_deltas(app_context, catalog):
+    catalog[0].category = 'Toys'
+    db.session.flush()
+    db.session.rollback()
+    assert facet_map()['Books'] == (1, 1)
+
+def test_rebuild_repairs_drift(test_app, app_context, catalog):
+    db.session.execute(CategoryFacet.__table__.update().values(product_count=99))
+    db.session.commit()
+    result = test_app.test_cli_runner().invoke(rebuild_facets_command)
+    assert result.exit_code == 0
+    assert 'Rebuilt 4 category facet rows' in result.output
+    assert facet_map() == {None: (1, 0), 'Books': (1, 1), 'Toys': (1, 0)}
+
+def test_list_products_filters_by_facet(logged_in_client, catalog):
+    response = logged_in_client.get(url_for('products.list_products', category='Books', active=1))
+    assert response.status_code == 200
+    assert b'BOOK-1' in response.data
+    assert b'BOOK-2' not in response.data
+    assert b'TOY-1' not in response.data
+    assert b'Uncategorized' in response.data # Facet sidebar
+
+    response = logged_in_client.get(url_for('products.list_products', category=''))
+    assert b'MISC-1' in response.data
+    assert b'BOOK-1' not in response.data
+
+def test_facets_api(logged_in_client, catalog):
+    response = logged_in_client.get(url_for('api.product_facets'))
+    assert response.status_code == 200
+    books = next(f for f in response.json['facets'] if f['category'] == 'Books')
+    assert books == {'category': 'Books', 'active': 1, 'inactive': 1, 'total': 2}
@@ -0,0 +1,77 @@
+import pytest
+from decimal import Decimal
+from flask import url_for, render_template_string
+from app import db
+from app.models import Product
+from app.bulk_update import BulkUpdate
+from app.fragment_cache import FragmentCache
+from tests.test_auth import test_user  # Import the test_user fixture
+from tests.test_products import logged_in_client
+
+
+@pytest.fixture(scope='function')
+def cache(test_app):
+    cache = test_app.extensions['fragment_cache']
+    cache.clear()
+    return cache
+
+
+@pytest.fixture(scope='function')
+def cached_product(test_app, cache):
+    with test_app.app_context():
+        p = Product(sku='FRAG-1', name='Cached Name', price=Decimal('4.00'), category='Fragments')
+        db.session.add(p)
+        db.session.commit()
+        yield p
+        Product.query.filter(Product.sku.like('FRAG-%')).delete()
+        db.session.commit()
+
+
+def test_cache_tag_renders_once(app_context, cache):
+    template = "{% cache 'test', n %}{{ calls.append(n) or n }}{% endcache %}"
+    calls = []
+    assert [render_template_string(template, n=n, calls=calls) for n in (1, 1, 2)] == ['1', '1', '2']
+    assert calls == [1, 2]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_lru_evicts_and_invalidates():
+    cache = FragmentCache(max_entries=2)
+    cache.set(('row', 1, 'v1'), 'a')
+    cache.set(('row', 2, 'v1'), 'b')
+    cache.get(('row', 1, 'v1'))
+    cache.set(('row', 3, 'v1'), 'c') # Evicts row 2, the least recently used
+    assert cache.get(('row', 2, 'v1')) is None
+    cache.invalidate('row', 1)
+    assert cache.get(('row', 1, 'v1')) is None
+    assert len(cache) == 1
+
+def test_list_rows_cached_and_invalidated_on_edit(logged_in_client, cached_product, cache):
+    assert b'Cached Name' in logged_in_client.get(url_for('products.list_products')).data
+    assert len(cache) == 1
+    logged_in_client.get(url_for('products.list_products'))
+    assert cache.hits == 1
+
+    cached_product.name = 'Renamed'
+    db.session.commit()
+    assert len(cache) == 0 # Dropped on commit
+    response = logged_in_client.get(url_for('products.list_products'))
+    assert b'Renamed' in response.data
+    assert b'Cached Name' not in response.data
+
+def test_rolled_back_change_keeps_fragments(logged_in_client, cached_product, cache):
+    logged_in_client.get(url_for('products.view_product', sku='FRAG-1'))
+    cached_product.name = 'Never committed'
+    db.session.flush()
+    db.session.rollback()
+    assert len(cache) == 1
+
+def test_bulk_update_invalidates(logged_in_client, cached_product, cache):
+    logged_in_client.get(url_for('products.view_product', sku='FRAG-1'))
+    BulkUpdate('price', 'set', '9.50', category='Fragments').run()
+    assert len(cache) == 0
+    assert b'9.50' in logged_in_client.get(url_for('products.view_product', sku='FRAG-1')).data
+
+def test_csrf_token_not_cached(logged_in_client, cached_product, cache):
+    first = logged_in_client.get(url_for('products.list_products')).data
+    assert cache.misses == 1
+    assert b'name="csrf_token"' in first # Rendered outside the cached row fragment
@@ -0,0 +1,105 @@
+import io
+import os
+import pytest
+from decimal import Decimal
+from flask import url_for
+from PIL import Image
+from app import db
+from app.images import images_cli, image_dir, parse_image_url, rebuild_sizes
+from app.jobs import Worker
+from app.models import OutboxJob, Product
+from tests.test_auth import test_user  # Import the test_user fixture
+from tests.test_products import logged_in_client
+
+
+@pytest.fixture(scope='function')
+def image_root(test_app, tmp_path, monkeypatch):
+    monkeypatch.setitem(test_app.config, 'IMAGE_ROOT', str(tmp_path / 'images'))
+    yield tmp_path / 'images'
+    Product.query.delete()
+    OutboxJob.query.delete()
+    db.session.commit()
+
+
+def image_bytes(size=(640, 480), color=(200, 30, 30), image_format='PNG'):
+    out = io.BytesIO()
+    Image.new('RGB', size, color).save(out, image_format)
+    return out.getvalue()
+
+
+def form_data(sku, **values):
+    return {'sku': sku, 'name': 'Image test', 'price': '3.00', 'stock_quantity': '4', 'is_active': 'y', **values}
+
+
+def test_upload_is_stored_once_and_resized_by_a_job(logged_in_client, image_root):
+    png = image_bytes()
+    response = logged_in_client.post(url_for('products.add_product'), content_type='multipart/form-data',
+                                     data=form_data('IMG-1', image_file=(io.BytesIO(png), 'photo.png')))
+    assert response.status_code == 302
+    product = Product.query.filter_by(sku='IMG-1').one()
+    digest, ext = parse_image_url(product.image_url)
+    assert ext == 'png'
+    assert [j.topic for j in OutboxJob.query] == ['images.derive']
+
+    thumb_url = f'/images/{digest}/96x96.webp'
+    pending = logged_in_client.get(thumb_url)
+    assert (pending.status_code, pending.headers['Cache-Control']) == (302, 'no-store')
+    assert pending.headers['Location'].endswith(product.image_url)
+
+    Worker(logged_in_client.application, concurrency=1).run(once=True)
+    response = logged_in_client.get(thumb_url)
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control'] and 'max-age=31536000' in response.headers['Cache-Control']
+    assert Image.open(io.BytesIO(response.data)).size == (96, 96)
+    response.close()
+    listing = logged_in_client.get(url_for('products.list_products'))
+    assert f'<img src="{thumb_url}" alt="" width="96" height="96"'.encode() in listing.data
+
+    # Same bytes for another product: same files, nothing left to resize
+    OutboxJob.query.delete()
+    logged_in_client.post(url_for('products.add_product'), content_type='multipart/form-data',
+                          data=form_data('IMG-2', image_file=(io.BytesIO(png), 'copy.png')))
+    assert Product.query.filter_by(sku='IMG-2').one().image_url == product.image_url
+    assert OutboxJob.query.count() == 0
+    assert sorted(os.listdir(image_dir(str(image_root), digest))) == ['480x480.webp', '96x96.webp', 'original.png']
+
+    # The stored URL passes the form's validation when the product is edited
+    response = logged_in_client.post(url_for('products.edit_product', sku='IMG-2'),
+                                     data=form_data('IMG-2', image_url=product.image_url, name='Renamed'))
+    assert response.status_code == 302
+
+def test_rejects_files_that_are_not_images(logged_in_client, image_root):
+    response = logged_in_client.post(url_for('products.add_product'), content_type='multipart/form-data',
+                                     data=form_data('IMG-BAD', image_file=(io.BytesIO(b'%PDF-1.4'), 'a.png')))
+    assert response.status_code == 200
+    assert b'Not an image file' in response.data
+    assert Product.query.count() == 0
+    assert not image_root.exists()
+    assert logged_in_client.get(f"/images/{'0' * 64}/96x96.webp").status_code == 404
+    assert logged_in_client.get(f"/images/{'0' * 64}/../../app.db").status_code == 404
+
+def test_batch_ingest_in_a_process_pool(test_app, image_root, tmp_path, monkeypatch):
+    for sku in ('ING-1', 'ING-2', 'ING-3'):
+        db.session.add(Product(sku=sku, name=sku, price=Decimal('1.00')))
+    db.session.commit()
+    source = tmp_path / 'catalog'
+    source.mkdir()
+    (source / 'ing-1.jpg').write_bytes(image_bytes((1200, 800), image_format='JPEG'))
+    (source / 'ING-2.png').write_bytes(image_bytes((300, 900), color=(0, 90, 0)))
+    (source / 'ING-3.png').write_bytes(image_bytes((300, 900), color=(0, 90, 0))) # Same image as ING-2
+    (source / 'UNKNOWN.png').write_bytes(image_bytes((50, 50)))
+    (source / 'ING-4.jpg').write_bytes(b'not really a jpeg')
+
+    runner = test_app.test_cli_runner()
+    result = runner.invoke(images_cli, ['ingest', str(source), '--workers', '2', '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert ('5 files (3 distinct images)' in result.output
+            and '3 products updated, 1 without a matching SKU, 1 failed.' in result.output)
+    urls = {p.sku: p.image_url for p in Product.query}
+    assert urls['ING-2'] == urls['ING-3'] != urls['ING-1']
+    with Image.open(image_dir(str(image_root), parse_image_url(urls['ING-1'])[0]) + '/480x480.webp') as im:
+        assert im.size == (480, 480)
+
+    monkeypatch.setitem(test_app.config, 'IMAGE_SIZES', {**test_app.config['IMAGE_SIZES'], 'zoom': (800, 800)})
+    assert rebuild_sizes(workers=0) == (2, 2) # Only the new size is written
+    assert rebuild_sizes(workers=0) == (2, 0)
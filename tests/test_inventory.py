@@ -0,0 +1,167 @@
+import pytest
+from decimal import Decimal
+from flask import url_for
+from sqlalchemy import delete, event, update
+from app import db
+from app.models import Product, StockLocation, LocationStock
+from app.bulk_update import BulkUpdate
+from app.inventory import InventoryError, adjust_location_stock, allocate, location_stock, inventory_cli
+from app.reporting import record_sale
+from app.signals import products_bulk_updating
+from tests.test_auth import test_user  # Import the test_user fixture
+from tests.test_products import logged_in_client
+
+
+@pytest.fixture(scope='function')
+def locations(app_context):
+    found = {code: StockLocation(code=code, name=f'Warehouse {code}', priority=priority)
+             for code, priority in (('EAST', 10), ('WEST', 20), ('NORTH', 30))}
+    db.session.add_all(found.values())
+    db.session.commit()
+    yield found
+    db.session.execute(delete(LocationStock))
+    db.session.execute(delete(Product))
+    db.session.execute(delete(StockLocation))
+    db.session.commit()
+
+
+def stocked(sku, **at):
+    product = Product(sku=sku, name=sku, price=Decimal('1.00'))
+    db.session.add(product)
+    db.session.commit()
+    for code, quantity in at.items():
+        adjust_location_stock(product, code, quantity)
+    db.session.commit()
+    return product
+
+
+def quantities(product):
+    return {code: quantity for code, _, quantity in location_stock(product.id)}
+
+
+def test_adjust_keeps_total_in_step(locations):
+    product = stocked('INV-1', EAST=5, WEST=3)
+    assert (product.stock_quantity, quantities(product)) == (8, {'EAST': 5, 'WEST': 3})
+    adjust_location_stock(product, 'WEST', -3)
+    db.session.commit()
+    assert (product.stock_quantity, quantities(product)) == (5, {'EAST': 5, 'WEST': 0})
+    with pytest.raises(InventoryError):
+        adjust_location_stock(product, 'WEST', -1)
+    with pytest.raises(InventoryError):
+        adjust_location_stock(product, 'SOUTH', 1)
+    db.session.rollback()
+    assert product.stock_quantity == 5
+
+    legacy = Product(sku='INV-OLD', name='Unlocated', price=Decimal('1.00'), stock_quantity=4)
+    db.session.add(legacy)
+    db.session.commit()
+    with pytest.raises(InventoryError, match='assign-unlocated'):
+        adjust_location_stock(legacy, 'EAST', 1)
+
+def test_other_stock_changes_are_spread_over_locations(locations, logged_in_client):
+    product = stocked('INV-2', EAST=2, WEST=5)
+    record_sale(product, 4) # Taken from EAST first (lower priority number), then WEST
+    db.session.commit()
+    assert (product.stock_quantity, quantities(product)) == (3, {'EAST': 0, 'WEST': 3})
+
+    response = logged_in_client.post(url_for('products.edit_product', sku=product.sku), data={
+        'sku': product.sku, 'name': product.name, 'price': '1.00', 'stock_quantity': '10', 'is_active': 'y'})
+    assert response.status_code == 302
+    assert quantities(product) == {'EAST': 7, 'WEST': 3} # Additions go to the first location
+
+    logged_in_client.application.config['INVENTORY_DEFAULT_LOCATION'] = 'WEST'
+    try:
+        BulkUpdate('stock_quantity', 'delta', 2, skus=[product.sku]).run()
+    finally:
+        logged_in_client.application.config['INVENTORY_DEFAULT_LOCATION'] = None
+    db.session.refresh(product)
+    assert (product.stock_quantity, quantities(product)) == (12, {'EAST': 7, 'WEST': 5})
+
+def test_bulk_update_spreads_only_its_own_change(locations):
+    product = stocked('INV-RACE', EAST=2, WEST=5)
+    east = locations['EAST'].id
+
+    def adjusted_meanwhile(sender, session, ids, fields, **kwargs):
+        # Another worker's adjust_location_stock(product, 'EAST', 5), committed just before the UPDATE
+        session.execute(update(LocationStock).where(LocationStock.product_id == product.id,
+                                                    LocationStock.location_id == east)
+                        .values(quantity=LocationStock.quantity + 5))
+        session.execute(update(Product).where(Product.id == product.id)
+                        .values(stock_quantity=Product.stock_quantity + 5))
+
+    with products_bulk_updating.connected_to(adjusted_meanwhile):
+        BulkUpdate('stock_quantity', 'delta', 2, skus=[product.sku]).run()
+    db.session.refresh(product)
+    assert (product.stock_quantity, quantities(product)) == (14, {'EAST': 9, 'WEST': 5})
+
+def test_deleting_product_removes_its_rows(locations):
+    product = stocked('INV-3', NORTH=1)
+    db.session.delete(product)
+    db.session.commit()
+    assert LocationStock.query.count() == 0
+
+def test_allocation_prefers_fewest_locations_in_one_query(locations):
+    stocked('INV-A', EAST=2, WEST=5, NORTH=5)
+    stocked('INV-B', EAST=9, NORTH=4)
+    stocked('INV-C', WEST=1)
+    db.session.execute(update(StockLocation).where(StockLocation.code == 'WEST').values(is_active=False))
+    db.session.commit()
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        result = allocate([('inv-a', 4), ('INV-B', 3), ('INV-C', 1)])
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert len(statements) == 1
+    # NORTH ships all of INV-A and INV-B; EAST has the higher priority but too few of INV-A
+    assert result[0] == {'sku': 'inv-a', 'requested': 4, 'allocated': 4,
+                         'locations': [{'location': 'NORTH', 'quantity': 4}]}
+    assert result[1]['locations'] == [{'location': 'NORTH', 'quantity': 3}]
+    assert result[2]['allocated'] == 0 # Only at an inactive location
+    with pytest.raises(InventoryError):
+        allocate([('INV-A', 0)])
+
+def test_allocation_merges_lines_of_one_sku(locations):
+    stocked('INV-D', EAST=3, WEST=2)
+    stocked('INV-E', WEST=1)
+    result = allocate([('INV-D', 2), ('INV-E', 1), ('inv-d', 4)])
+    assert [(line['sku'], line['requested'], line['allocated']) for line in result] == [
+        ('INV-D', 2, 2), ('INV-E', 1, 1), ('inv-d', 4, 3)] # 5 in stock, not 2 + 4
+    # WEST ships INV-E complete, so INV-D comes from there first
+    assert result[0]['locations'] == [{'location': 'WEST', 'quantity': 2}]
+    assert result[2]['locations'] == [{'location': 'EAST', 'quantity': 3}]
+
+def test_api(locations, logged_in_client):
+    stocked('INV-API', EAST=1, WEST=2)
+    response = logged_in_client.get(url_for('api.product_stock', sku='inv-api'))
+    assert response.json['stock_quantity'] == 3
+    assert [(l['location'], l['quantity']) for l in response.json['locations']] == [('EAST', 1), ('WEST', 2)]
+    assert logged_in_client.get(url_for('api.product_stock', sku='NONE')).status_code == 404
+
+    response = logged_in_client.post(url_for('api.allocate_order'),
+                                     json={'lines': [{'sku': 'INV-API', 'quantity': 2}]})
+    assert response.status_code == 200
+    assert response.json['complete'] is True
+    assert response.json['lines'][0]['locations'] == [{'location': 'WEST', 'quantity': 2}]
+    assert logged_in_client.post(url_for('api.allocate_order'), json={'lines': 'x'}).status_code == 400
+
+def test_cli(locations, test_app):
+    legacy = Product(sku='INV-CLI', name='Unlocated', price=Decimal('1.00'), stock_quantity=6)
+    db.session.add(legacy)
+    db.session.commit()
+    runner = test_app.test_cli_runner()
+    assert '1 products assigned to WEST' in runner.invoke(inventory_cli, ['assign-unlocated', 'WEST']).output
+    result = runner.invoke(inventory_cli, ['adjust', 'inv-cli', 'EAST', '4'])
+    assert result.exit_code == 0, result.output
+    assert 'INV-CLI: 10 in stock.' in result.output
+    assert runner.invoke(inventory_cli, ['adjust', 'INV-CLI', 'EAST', '--', '-5']).exit_code == 1
+
+    db.session.execute(update(Product).values(stock_quantity=1)) # Drifted behind the application's back
+    db.session.commit()
+    assert 'INV-CLI: stock_quantity 1, locations 10' in runner.invoke(inventory_cli, ['check', '--fix']).output
+    db.session.refresh(legacy)
+    assert (legacy.stock_quantity, quantities(legacy)) == (10, {'EAST': 4, 'WEST': 6})
+    assert '0 products out of sync' in runner.invoke(inventory_cli, ['check']).output
+    assert 'WEST' in runner.invoke(inventory_cli, ['locations']).output
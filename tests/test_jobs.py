@@ -0,0 +1,131 @@
+import pytest
+from datetime import timedelta
+from sqlalchemy import update
+from decimal import Decimal
+from app import db
+from app.models import OutboxJob, Product, utcnow
+from app.jobs import job, enqueue, Worker, UnknownJobTopic, retry_delay, worker_command
+
+calls = []
+
+
+@job('test.record')
+def record(payload):
+    calls.append(payload)
+
+
+@job('test.rename')
+def rename(payload):
+    product = Product.query.filter_by(sku=payload['sku']).one()
+    product.name = payload['name']
+
+
+@job('test.overtaken')
+def overtaken(payload):
+    # Released as stale and claimed by another worker while this one still runs it
+    with db.engine.begin() as conn:
+        conn.execute(update(OutboxJob).values(status='running', locked_by='other:claim', locked_at=utcnow()))
+    Product.query.filter_by(sku='JOB-2').one().name = 'Overwritten'
+    if payload.get('fail'):
+        raise RuntimeError('late failure')
+
+
+@job('test.flaky', max_attempts=2)
+def flaky(payload):
+    raise RuntimeError('boom')
+
+
+@pytest.fixture(scope='function')
+def worker(test_app):
+    calls.clear()
+    with test_app.app_context():
+        OutboxJob.query.delete()
+        db.session.commit()
+    return Worker(test_app, concurrency=1, batch_size=2, poll_interval=0)
+
+
+def test_job_runs_only_after_commit(app_context, worker):
+    enqueue('test.record', {'n': 1})
+    db.session.rollback() # Rolled back with the "domain change": never runs
+    enqueue('test.record', {'n': 2})
+    db.session.commit()
+    stats = worker.run(once=True)
+    assert calls == [{'n': 2}]
+    assert stats['done'] == 1
+    assert OutboxJob.query.one().status == 'done'
+
+def test_claims_in_batches(app_context, worker):
+    for n in range(5):
+        enqueue('test.record', {'n': n})
+    db.session.commit()
+    claimed = worker.claim()
+    assert [j.id for j in claimed] == sorted(j.id for j in claimed)
+    assert len(claimed) == 2
+    assert {j.status for j in claimed} == {'running'}
+    # A second claim never returns jobs that are already running
+    assert not {j.id for j in worker.claim()} & {j.id for j in claimed}
+
+def test_handler_writes_commit_with_job(app_context, worker):
+    db.session.add(Product(sku='JOB-1', name='Before', price=Decimal('1.00')))
+    enqueue('test.rename', {'sku': 'JOB-1', 'name': 'After'})
+    db.session.commit()
+    worker.run(once=True)
+    db.session.expire_all()
+    assert Product.query.filter_by(sku='JOB-1').one().name == 'After'
+
+def test_failed_job_is_retried_then_marked_failed(app_context, worker):
+    enqueue('test.flaky')
+    db.session.commit()
+    worker.run(once=True)
+    db.session.expire_all()
+    outbox_job = OutboxJob.query.one()
+    assert outbox_job.status == 'pending'
+    assert outbox_job.attempts == 1
+    assert 'RuntimeError: boom' in outbox_job.last_error
+
+    outbox_job.run_after = utcnow() # Skip the backoff delay
+    db.session.commit()
+    worker.run(once=True)
+    db.session.expire_all()
+    assert OutboxJob.query.one().status == 'failed'
+    assert worker.stats == {'done': 0, 'retried': 1, 'failed': 1, 'lost': 0}
+
+def test_stale_running_jobs_are_released(app_context, worker):
+    enqueue('test.record')
+    db.session.commit()
+    worker.claim()
+    OutboxJob.query.update({'locked_at': utcnow() - timedelta(hours=1)})
+    db.session.commit()
+    assert worker.release_stale() == 1
+    assert OutboxJob.query.one().status == 'pending'
+
+@pytest.mark.parametrize('fail', [False, True])
+def test_a_released_job_cannot_finish_the_new_claim(app_context, worker, fail):
+    db.session.add(Product(sku='JOB-2', name='Before', price=Decimal('1.00')))
+    enqueue('test.overtaken', {'fail': fail})
+    db.session.commit()
+    worker.run(once=True)
+    db.session.expire_all()
+    outbox_job = OutboxJob.query.one()
+    assert (outbox_job.status, outbox_job.locked_by, outbox_job.attempts) == ('running', 'other:claim', 0)
+    assert outbox_job.last_error is None
+    assert Product.query.filter_by(sku='JOB-2').one().name == 'Before' # The handler's writes rolled back
+    assert worker.stats == {'done': 0, 'retried': 0, 'failed': 0, 'lost': 1}
+    Product.query.delete()
+    db.session.commit()
+
+def test_unknown_topic_rejected(app_context):
+    with pytest.raises(UnknownJobTopic):
+        enqueue('test.nope')
+
+def test_retry_delay_is_capped():
+    assert all(0 <= retry_delay(n, 5, 60) <= 60 for n in range(1, 20))
+
+def test_worker_command_once(test_app, worker):
+    with test_app.app_context():
+        enqueue('test.record', {'n': 'cli'})
+        db.session.commit()
+    result = test_app.test_cli_runner().invoke(worker_command, ['--once', '--concurrency', '1'])
+    assert result.exit_code == 0, result.output
+    assert '1 done' in result.output
+    assert calls == [{'n': 'cli'}]
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import queue
+import pytest
+from decimal import Decimal
+from flask import url_for
+from app import create_app, db
+from app.jobs import Worker
+from app.logs import LogQueueHandler
+from app.models import OutboxJob, Product
+from app.slow_queries import read_entries
+from config import TestingConfig
+from tests.test_auth import test_user  # Import the test_user fixture
+from tests.test_products import logged_in_client
+
+
+@pytest.fixture(scope='module')
+def test_app(tmp_path_factory):
+    logs = tmp_path_factory.mktemp('logs')
+
+    class LoggingConfig(TestingConfig):
+        LOG_ENABLED = True
+        LOG_STDERR = False
+        LOG_FILE = str(logs / 'app.log')
+        SLOW_QUERY_LOG_ENABLED = True
+        SLOW_QUERY_THRESHOLD_MS = 0 # Log every statement
+        SLOW_QUERY_EXPLAIN = False
+        SLOW_QUERY_LOG_FILE = str(logs / 'slow_queries.log')
+
+    flask_env = os.environ.pop('FLASK_ENV', None)
+    try:
+        app = create_app(LoggingConfig)
+    finally:
+        if flask_env is not None:
+            os.environ['FLASK_ENV'] = flask_env
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        app.extensions['log_pipeline'].close()
+        app.extensions['slow_query_log'].close()
+
+
+@pytest.fixture(scope='function')
+def log_lines(test_app):
+    path = test_app.config['LOG_FILE']
+    open(path, 'w').close()
+
+    def read(logger=None):
+        test_app.extensions['log_pipeline'].flush()
+        with open(path, encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f]
+        return [entry for entry in entries if logger is None or entry['logger'] == logger]
+    return read
+
+
+def test_request_ids_and_access_log(test_app, test_client, log_lines):
+    response = test_client.get(url_for('auth.login'), headers={'X-Request-ID': 'lb-1234'})
+    assert response.headers['X-Request-ID'] == 'lb-1234'
+    generated = test_client.get(url_for('auth.login'), headers={'X-Request-ID': 'not a token; <script>'})
+    assert len(generated.headers['X-Request-ID']) == 32
+
+    access = log_lines('app.access')
+    assert [(e['request_id'], e['status'], e['endpoint'], e['sample_rate']) for e in access] == [
+        ('lb-1234', 200, 'auth.login', 1.0), (generated.headers['X-Request-ID'], 200, 'auth.login', 1.0)]
+    assert access[0]['message'] == 'GET /auth/login 200'
+    assert access[0]['level'] == 'INFO' and access[0]['duration_ms'] >= 0
+
+def test_access_log_sampling(test_app, test_client, log_lines):
+    test_app.config['LOG_ACCESS_SAMPLE_RATE'] = 0
+    try:
+        test_client.get(url_for('auth.login'))
+        assert log_lines('app.access') == []
+        test_app.config['LOG_ACCESS_SLOW_MS'] = 0 # Every request counts as slow: always logged
+        test_client.get(url_for('auth.login'))
+        assert [e['sample_rate'] for e in log_lines('app.access')] == [1.0]
+    finally:
+        test_app.config.update(LOG_ACCESS_SAMPLE_RATE=1.0, LOG_ACCESS_SLOW_MS=1000)
+
+def test_errors_are_logged_with_the_request_id(logged_in_client, log_lines, monkeypatch):
+    db.session.add(Product(sku='LOG-1', name='Undeletable', price=Decimal('1.00')))
+    db.session.commit()
+    def fail():
+        raise RuntimeError('disk on fire')
+    monkeypatch.setattr(db.session, 'commit', fail)
+    response = logged_in_client.post(url_for('products.delete_product', sku='LOG-1'),
+                                     headers={'X-Request-ID': 'req-delete'}, follow_redirects=True)
+    monkeypatch.undo()
+    assert b'Could not delete product LOG-1' in response.data
+    assert b'quote reference req-delete' in response.data
+    assert b'disk on fire' not in response.data # Details go to the log, not to the user
+
+    error, = [e for e in log_lines('app') if e['level'] == 'ERROR']
+    assert (error['message'], error['request_id']) == ('Could not delete product LOG-1', 'req-delete')
+    assert 'RuntimeError: disk on fire' in error['exception']
+    db.session.delete(Product.query.filter_by(sku='LOG-1').one())
+    db.session.commit()
+
+def test_request_id_reaches_jobs_and_slow_query_log(test_app, logged_in_client, log_lines):
+    OutboxJob.query.delete()
+    db.session.commit()
+    response = logged_in_client.post(url_for('products.add_product'), headers={'X-Request-ID': 'req-job'}, data={
+        'sku': 'LOG-LOW', 'name': 'Nearly gone', 'price': '1.00', 'stock_quantity': '1', 'reorder_point': '5'})
+    assert response.status_code == 302
+    assert [(j.topic, j.request_id) for j in OutboxJob.query] == [('stock.low', 'req-job')]
+    test_app.extensions['slow_query_log'].flush()
+    assert any(e['request_id'] == 'req-job' and e['statement'].startswith('INSERT INTO products')
+               for e in read_entries(test_app.config['SLOW_QUERY_LOG_FILE']))
+
+    Worker(test_app, concurrency=1).run(once=True)
+    notice, = [e for e in log_lines('app') if e['message'].startswith('Low stock: LOG-LOW')]
+    assert notice['request_id'] == 'req-job'
+    Product.query.delete()
+    OutboxJob.query.delete()
+    db.session.commit()
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = LogQueueHandler(queue.Queue(1))
+    logger = logging.Logger('test-queue')
+    logger.addHandler(handler)
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        logger.exception('first %s', 'record', extra={'sku': 'X'})
+    logger.warning('second')
+    logger.warning('third')
+    assert handler.dropped == 2
+    record = handler.queue.get_nowait()
+    assert (record.msg, record.args, record.sku, record.exc_info) == ('first record', None, 'X', None)
+    assert 'ValueError: boom' in record.exc_text
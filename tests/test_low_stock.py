@@ -0,0 +1,100 @@
+import json
+import pytest
+from decimal import Decimal
+from flask import url_for
+from sqlalchemy import text
+from app import db
+from app.models import Product, OutboxJob
+from app.bulk_update import BulkUpdate
+from app.low_stock import low_stock_query
+from tests.test_auth import test_user  # Import the test_user fixture
+from tests.test_products import logged_in_client
+
+
+@pytest.fixture(scope='function')
+def stocked(test_app):
+    with test_app.app_context():
+        OutboxJob.query.delete()
+        p = Product(sku='LOW-1', name='Widget', price=Decimal('2.00'), stock_quantity=10, reorder_point=5,
+                    category='LowStock')
+        db.session.add(p)
+        db.session.commit()
+        yield p
+        db.session.delete(p)
+        OutboxJob.query.delete()
+        db.session.commit()
+
+
+def events():
+    return [(j.topic, json.loads(j.payload)['stock_quantity']) for j in OutboxJob.query.order_by(OutboxJob.id)]
+
+
+def test_crossing_emits_one_event(app_context, stocked):
+    stocked.adjust_stock(-3) # 7: still above
+    db.session.commit()
+    assert events() == []
+    stocked.adjust_stock(-2) # 5: at the reorder point
+    db.session.commit()
+    stocked.adjust_stock(-1) # Already low: no new event
+    db.session.commit()
+    assert stocked.is_low_stock is True
+    assert events() == [('stock.low', 5)]
+    assert low_stock_query().all() == [stocked]
+
+    stocked.stock_quantity = 20
+    db.session.commit()
+    assert stocked.is_low_stock is False
+    assert events()[-1] == ('stock.replenished', 20)
+    assert low_stock_query().all() == []
+
+def test_raising_reorder_point_flags_product(app_context, stocked):
+    stocked.reorder_point = 15
+    db.session.commit()
+    assert stocked.is_low_stock is True
+    assert events() == [('stock.low', 10)]
+
+def test_new_product_below_threshold(app_context):
+    p = Product(sku='LOW-NEW', name='Fresh', price=Decimal('1.00'), stock_quantity=0, reorder_point=1)
+    db.session.add(p)
+    db.session.commit()
+    assert p.is_low_stock is True
+    assert OutboxJob.query.filter_by(topic='stock.low').count() == 1
+    db.session.delete(p)
+    OutboxJob.query.delete()
+    db.session.commit()
+
+def test_bulk_update_flips_flags(app_context, stocked):
+    BulkUpdate('stock_quantity', 'set', 1, category='LowStock').run()
+    db.session.expire_all()
+    assert stocked.is_low_stock is True
+    assert events() == [('stock.low', 1)]
+
+def test_adjust_stock_below_zero(app_context, stocked):
+    with pytest.raises(ValueError):
+        stocked.adjust_stock(-11)
+    assert stocked.stock_quantity == 10
+
+def test_dashboard_query_uses_partial_index(app_context):
+    plan = db.session.execute(text(
+        'EXPLAIN QUERY PLAN SELECT id FROM products WHERE is_low_stock = 1 ORDER BY stock_quantity')).all()
+    assert 'ix_products_low_stock' in ' '.join(str(row[-1]) for row in plan)
+
+def test_low_stock_page_and_api(logged_in_client, stocked):
+    stocked.stock_quantity = 2
+    db.session.commit()
+    response = logged_in_client.get(url_for('products.low_stock'))
+    assert response.status_code == 200
+    assert b'LOW-1' in response.data
+    response = logged_in_client.get(url_for('api.low_stock_products'))
+    assert response.json['products'] == [
+        {'sku': 'LOW-1', 'name': 'Widget', 'stock_quantity': 2, 'reorder_point': 5}]
+
+def test_edit_form_sets_reorder_point(logged_in_client, stocked):
+    response = logged_in_client.post(url_for('products.edit_product', sku='LOW-1'), data={
+        'sku': 'LOW-1', 'name': 'Widget', 'price': '2.00', 'stock_quantity': '10', 'reorder_point': '12',
+        'is_active': 'y'})
+    assert response.status_code == 302
+    with logged_in_client.application.app_context():
+        product = db.session.get(Product, stocked.id)
+        assert product.reorder_point == 12
+        assert product.is_low_stock is True
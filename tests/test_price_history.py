@@ -0,0 +1,135 @@
+import pytest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from flask import url_for
+from sqlalchemy import event, insert
+from app import db
+from app.models import Product, ProductPrice, utcnow
+from app.bulk_update import BulkUpdate
+from app.price_history import prices_as_of, price_history, compact_price_history
+from tests.test_auth import test_user  # Import the test_user fixture
+from tests.test_products import logged_in_client
+
+
+@pytest.fixture(scope='function')
+def priced(test_app):
+    with test_app.app_context():
+        p = Product(sku='Price-1', name='Priced', price=Decimal('10.00'), category='PriceHistory')
+        db.session.add(p)
+        db.session.commit()
+        yield p
+        Product.query.delete()
+        ProductPrice.query.delete()
+        db.session.commit()
+
+
+def test_changes_open_and_close_rows(app_context, priced):
+    created = utcnow()
+    priced.price = Decimal('12.00')
+    db.session.commit()
+    changed = utcnow()
+    priced.name = 'Renamed' # Not a price change
+    db.session.commit()
+
+    rows = price_history('PRICE-1')
+    assert [(r.price, r.effective_to is None) for r in rows] == [(Decimal('10.00'), False),
+                                                                 (Decimal('12.00'), True)]
+    assert rows[0].effective_to == rows[1].effective_from
+    assert prices_as_of(created, ['price-1']) == {'price-1': Decimal('10.00')}
+    assert prices_as_of(changed, ['PRICE-1']) == {'price-1': Decimal('12.00')}
+    assert prices_as_of(created - timedelta(days=1), ['price-1']) == {}
+
+def test_delete_keeps_history(app_context, priced):
+    db.session.delete(priced)
+    db.session.commit()
+    [row] = price_history('price-1')
+    assert row.effective_to is not None
+    assert prices_as_of(row.effective_from, ['price-1']) == {'price-1': Decimal('10.00')}
+
+def test_sku_rename_keeps_the_sku_in_effect(app_context, priced):
+    before = utcnow()
+    priced.sku = 'PRICE-2'
+    db.session.commit()
+    renamed = utcnow()
+    db.session.add(Product(sku='PRICE-1', name='Reused SKU', price=Decimal('20.00')))
+    db.session.commit()
+    reused = utcnow()
+
+    assert prices_as_of(before, ['price-1', 'price-2']) == {'price-1': Decimal('10.00')}
+    assert prices_as_of(renamed, ['price-1', 'price-2']) == {'price-2': Decimal('10.00')}
+    assert prices_as_of(reused, ['price-1', 'price-2']) == {'price-1': Decimal('20.00'),
+                                                            'price-2': Decimal('10.00')}
+    # The renamed product keeps its whole history; the new one doesn't inherit it
+    assert [(r.sku, r.price) for r in price_history('PRICE-2')] == [('price-1', Decimal('10.00')),
+                                                                   ('price-2', Decimal('10.00'))]
+    assert [r.price for r in price_history('price-1')] == [Decimal('20.00')]
+
+    priced.price = Decimal('11.00') # Closes the 'price-2' row
+    db.session.commit()
+    assert compact_price_history() == 0 # Same price, but the rename boundary stays
+
+def test_bulk_price_update_recorded(app_context, priced):
+    BulkUpdate('price', 'percent', '50', category='PriceHistory').run()
+    assert [r.price for r in price_history('price-1')] == [Decimal('10.00'), Decimal('15.00')]
+
+def test_compaction_merges_redundant_rows(app_context, priced):
+    t = datetime(2024, 1, 1)
+    db.session.execute(insert(ProductPrice), [
+        {'product_id': 999, 'sku': 'old', 'price': Decimal('5.00'), 'effective_from': t,
+         'effective_to': t + timedelta(days=1)},
+        {'product_id': 999, 'sku': 'old', 'price': Decimal('9.00'), 'effective_from': t + timedelta(days=1),
+         'effective_to': t + timedelta(days=1)}, # Zero-length
+        {'product_id': 999, 'sku': 'old', 'price': Decimal('5.00'), 'effective_from': t + timedelta(days=1),
+         'effective_to': t + timedelta(days=2)},
+        {'product_id': 999, 'sku': 'old', 'price': Decimal('6.00'), 'effective_from': t + timedelta(days=2),
+         'effective_to': t + timedelta(days=3)},
+    ])
+    db.session.commit()
+    assert compact_price_history(chunk_size=1) == 2
+    rows = price_history('old')
+    assert [(r.price, r.effective_from, r.effective_to) for r in rows] == [
+        (Decimal('5.00'), t, t + timedelta(days=2)),
+        (Decimal('6.00'), t + timedelta(days=2), t + timedelta(days=3))]
+    assert prices_as_of(t + timedelta(hours=36), ['old']) == {'old': Decimal('5.00')}
+
+def test_ten_thousand_skus_in_one_query(test_app, app_context):
+    t = datetime(2024, 6, 1)
+    db.session.execute(insert(ProductPrice), [
+        {'product_id': 100000 + i, 'sku': f'bulk-{i}', 'price': Decimal(i % 100), 'effective_from': t}
+        for i in range(10000)])
+    db.session.commit()
+
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        prices = prices_as_of(t + timedelta(days=1), [f'BULK-{i}' for i in range(10000)])
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    assert len(prices) == 10000
+    assert prices['bulk-1234'] == Decimal('34')
+    assert len(statements) == 1
+    ProductPrice.query.filter(ProductPrice.product_id >= 100000).delete()
+    db.session.commit()
+
+def test_price_api(logged_in_client, priced):
+    as_of = (utcnow() + timedelta(seconds=1)).isoformat()
+    response = logged_in_client.post(url_for('api.product_prices_as_of'),
+                                     json={'as_of': as_of, 'skus': ['PRICE-1', 'nope']})
+    assert response.status_code == 200
+    assert response.json['prices'] == {'price-1': '10.00'}
+    assert response.json['missing'] == ['nope']
+
+    response = logged_in_client.get(url_for('api.product_price_history', sku='PRICE-1'))
+    assert response.json['history'][0]['price'] == '10.00'
+    assert response.json['history'][0]['effective_to'] is None
+
+    response = logged_in_client.post(url_for('api.product_prices_as_of'), json={'as_of': as_of})
+    assert (response.status_code, response.json) == (400, {'error': "'as_of' and a list of 'skus' are required"})
+
+def test_price_api_needs_no_csrf_token(test_app, logged_in_client, priced, monkeypatch):
+    monkeypatch.setitem(test_app.config, 'WTF_CSRF_ENABLED', True) # As in production: API clients send none
+    response = logged_in_client.post(url_for('api.product_prices_as_of'),
+                                     json={'as_of': utcnow().isoformat(), 'skus': ['PRICE-1']})
+    assert response.status_code == 200
@@ -0,0 +1,115 @@
+import re
+import pytest
+from decimal import Decimal
+from flask import url_for
+from types import SimpleNamespace
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Product
+from app.bulk_update import BulkUpdate
+from app.products import _sku_taken
+from tests.test_auth import test_user  # Import the test_user fixture
+from tests.test_products import logged_in_client
+
+
+@pytest.fixture(scope='function')
+def statements(test_app):
+    """Every statement run during a test, the change listeners' included."""
+    seen = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+    with test_app.app_context():
+        # Warm-up, so the change feed's sequence row exists whatever ran before
+        db.session.add(Product(sku='WARM-UP', name='Warm-up', price=Decimal('1.00')))
+        db.session.commit()
+        Product.query.delete()
+        db.session.commit()
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        yield seen
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        Product.query.delete()
+        db.session.commit()
+
+
+def on_products(statements):
+    """The verbs of the statements that touch the products table."""
+    return [s.split()[0] for s in statements
+            if re.match(r'(SELECT products\.|INSERT INTO products |UPDATE products |DELETE FROM products )', s)]
+
+
+def form_data(sku='WRITE-1', **values):
+    return {'sku': sku, 'name': 'Write test', 'price': '3.00', 'stock_quantity': '4', 'is_active': 'y', **values}
+
+
+def loaded_version(response):
+    return int(re.search(rb'id="version" name="version" type="hidden" value="(\d+)"', response.data).group(1))
+
+
+def test_create_round_trips(logged_in_client, statements):
+    response = logged_in_client.post(url_for('products.add_product'), data=form_data())
+    assert response.status_code == 302
+    assert on_products(statements) == ['INSERT'] # No SKU pre-check, no reload for the flash message
+    # The logged-in user, then facets, price history, stock movement, two rollups and the change feed (3),
+    # then the user again after the commit expired it
+    assert len(statements) == 11, statements
+
+    statements.clear()
+    response = logged_in_client.post(url_for('products.add_product'), data=form_data(sku='write-1'))
+    assert response.status_code == 200
+    assert b'This SKU is already taken' in response.data # From the unique index on lower(sku)
+    assert on_products(statements) == ['INSERT']
+    assert len(statements) == 3, statements # The user, facets, the failed INSERT; then a rollback
+    assert Product.query.count() == 1
+
+def test_edit_round_trips(logged_in_client, statements):
+    logged_in_client.post(url_for('products.add_product'), data=form_data())
+    edit_url = url_for('products.edit_product', sku='WRITE-1')
+    version = loaded_version(logged_in_client.get(edit_url))
+    statements.clear()
+
+    response = logged_in_client.post(edit_url, data=form_data(name='Renamed', version=version))
+    assert response.status_code == 302
+    assert on_products(statements) == ['SELECT', 'UPDATE']
+    assert len(statements) == 6, statements # The user, then the change feed (3)
+    product = Product.query.one()
+    assert (product.name, product.version) == ('Renamed', version + 1)
+
+    logged_in_client.post(url_for('products.add_product'), data=form_data(sku='WRITE-2'))
+    response = logged_in_client.post(url_for('products.edit_product', sku='WRITE-2'),
+                                     data=form_data(sku='Write-1'))
+    assert response.status_code == 200
+    assert b'This SKU is already taken' in response.data
+
+def test_stale_edit_is_a_conflict(logged_in_client, statements):
+    logged_in_client.post(url_for('products.add_product'), data=form_data())
+    edit_url = url_for('products.edit_product', sku='WRITE-1')
+    stale = loaded_version(logged_in_client.get(edit_url))
+    BulkUpdate('price', 'set', '9.00', skus=['WRITE-1']).run() # Another admin's change
+
+    response = logged_in_client.post(edit_url, data=form_data(name='Mine', version=stale))
+    assert response.status_code == 409
+    assert b'Someone else changed this product' in response.data
+    product = Product.query.one()
+    db.session.refresh(product)
+    assert (product.name, product.price) == ('Write test', Decimal('9.00'))
+
+    # The re-rendered form carries the current version: saving again is a deliberate overwrite
+    response = logged_in_client.post(edit_url, data=form_data(name='Mine', version=loaded_version(response)))
+    assert response.status_code == 302
+    db.session.refresh(product)
+    assert (product.name, product.price) == ('Mine', Decimal('3.00'))
+
+def test_only_the_sku_indexes_mean_taken():
+    def error(message, constraint_name=None):
+        orig = Exception(message)
+        if constraint_name:
+            orig.diag = SimpleNamespace(constraint_name=constraint_name) # As psycopg2 reports it
+        return IntegrityError('INSERT ...', {}, orig)
+
+    assert _sku_taken(error("UNIQUE constraint failed: index 'ix_products_sku_lower'"))
+    assert _sku_taken(error('UNIQUE constraint failed: products.sku'))
+    assert not _sku_taken(error('NOT NULL constraint failed: product_prices.sku'))
+    assert not _sku_taken(error('UNIQUE constraint failed: archived_products.sku'))
+    assert _sku_taken(error('duplicate key value', 'ix_products_sku_lower'))
+    assert not _sku_taken(error('duplicate key value violates unique constraint on sku', 'product_prices_pkey'))
@@ -140,6 +140,14 @@ def test_edit_product_success(logged_in_client, test_product):
         assert updated_prod.price == Decimal('25.50')
         assert updated_prod.stock_quantity == 55
 
+def test_edit_product_to_zero_stock_and_price(logged_in_client, test_product):
+    response = logged_in_client.post(url_for('products.edit_product', sku=test_product.sku), data={
+        'sku': test_product.sku, 'name': test_product.name, 'price': '0.00', 'stock_quantity': '0',
+        'is_active': 'y'})
+    assert response.status_code == 302
+    updated_prod = db.session.get(Product, test_product.id)
+    assert (updated_prod.price, updated_prod.stock_quantity) == (Decimal('0.00'), 0)
+
 def test_delete_product_success(logged_in_client, test_product):
     delete_url = url_for('products.delete_product', sku=test_product.sku)
     product_id = test_product.id # Get ID before potential deletion
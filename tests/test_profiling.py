@@ -0,0 +1,116 @@
+import os
+import time
+import pytest
+from flask import g, url_for
+from app import create_app, db
+from app.models import User
+from app import profiling
+from app.profiling import list_profiles, profiles_cli, _start_profiling, _finish_profiling
+from config import TestingConfig
+
+
+@pytest.fixture(scope='module')
+def test_app(tmp_path_factory):
+    class ProfilingConfig(TestingConfig):
+        PROFILING_ENABLED = True
+        PROFILING_DIR = str(tmp_path_factory.mktemp('profiles'))
+        PROFILING_ENDPOINTS = ['main.ping']
+
+    flask_env = os.environ.pop('FLASK_ENV', None)
+    try:
+        app = create_app(ProfilingConfig)
+    finally:
+        if flask_env is not None:
+            os.environ['FLASK_ENV'] = flask_env
+
+    @app.route('/_profiling/slow')
+    def slow_view():
+        time.sleep(0.1)
+        return 'done'
+
+    with app.app_context():
+        db.create_all()
+        for username, role in (('profadmin', 'admin'), ('profviewer', 'viewer')):
+            user = User(username=username, role=role)
+            user.set_password('password')
+            db.session.add(user)
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture(scope='function')
+def profiles(test_app):
+    directory = test_app.config['PROFILING_DIR']
+    test_app.config.update(PROFILING_MODE='sampling', PROFILING_SAMPLE_RATE=0.0)
+    yield lambda: list_profiles(directory)
+    test_app.test_cli_runner().invoke(profiles_cli, ['purge'])
+
+
+def login(test_app, username):
+    g.pop('_login_user', None) # Requests share the test's app context, so Flask-Login's cached user too
+    client = test_app.test_client()
+    client.post(url_for('auth.login'), data={'username': username, 'password': 'password'})
+    return client
+
+
+def test_no_hooks_when_disabled():
+    os.environ['FLASK_ENV'] = 'testing'
+    app = create_app()
+    assert _start_profiling not in app.before_request_funcs.get(None, [])
+    assert _finish_profiling not in app.teardown_request_funcs.get(None, [])
+
+def test_configured_endpoint_profiled_with_cprofile(test_app, profiles):
+    test_app.config['PROFILING_MODE'] = 'cprofile'
+    client = test_app.test_client()
+    assert client.get(url_for('main.ping')).status_code == 200
+    client.get(url_for('main.index'))
+    [profile] = profiles()
+    assert (profile['endpoint'], profile['mode'], profile['status']) == ('main.ping', 'cprofile', 200)
+    assert profile['file'].endswith('.prof')
+
+    runner = test_app.test_cli_runner()
+    assert 'main.ping' in runner.invoke(profiles_cli, ['list']).output
+    result = runner.invoke(profiles_cli, ['show', profile['name'], '--limit', '5'])
+    assert result.exit_code == 0
+    assert 'function calls' in result.output
+
+def test_overlapping_cprofile_requests_are_skipped(test_app, profiles):
+    test_app.config['PROFILING_MODE'] = 'cprofile'
+    client = test_app.test_client()
+    with profiling._cprofile_lock: # As if another thread's request were being profiled
+        assert client.get(url_for('main.ping')).status_code == 200
+    assert profiles() == []
+    client.get(url_for('main.ping'))
+    assert len(profiles()) == 1 # The lock was free again
+
+def test_sampling_writes_collapsed_stacks(test_app, profiles):
+    test_app.config['PROFILING_SAMPLE_RATE'] = 1.0
+    login(test_app, 'profviewer').get('/_profiling/slow')
+    [profile] = [p for p in profiles() if p['endpoint'] == 'slow_view']
+    assert profile['duration_ms'] >= 100
+    with open(profile['file']) as f:
+        stacks = f.read().splitlines()
+    assert any(';slow_view (' in line.rpartition(' ')[0] for line in stacks)
+    result = test_app.test_cli_runner().invoke(profiles_cli, ['show', profile['name']])
+    assert 'slow_view' in result.output
+
+def test_header_flag_is_admin_only(test_app, profiles):
+    login(test_app, 'profviewer').get(url_for('main.index'), headers={'X-Profile': '1'})
+    assert profiles() == []
+    admin = login(test_app, 'profadmin')
+    admin.get(url_for('main.index'), headers={'X-Profile': '1'})
+    admin.get(url_for('main.index', _profile=1))
+    assert [p['endpoint'] for p in profiles()] == ['main.index', 'main.index']
+
+def test_oldest_profiles_pruned(test_app, profiles):
+    test_app.config['PROFILING_MAX_FILES'] = 2
+    client = test_app.test_client()
+    try:
+        for _ in range(4):
+            client.get(url_for('main.ping'))
+    finally:
+        test_app.config['PROFILING_MAX_FILES'] = 500
+    assert len(profiles()) == 2
+    assert len(os.listdir(test_app.config['PROFILING_DIR'])) == 4 # .collapsed + .json each
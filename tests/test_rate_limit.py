@@ -0,0 +1,130 @@
+import pytest
+from flask import url_for
+from sqlalchemy import event, select
+from app import db, login_limiter
+from app.models import User
+from app.rate_limit import MemoryStorage, DatabaseStorage
+
+
+@pytest.fixture(scope='function')
+def throttled_user(test_app):
+    with test_app.app_context():
+        u = User(username='throttled', email='throttled@example.com')
+        u.set_password('password')
+        db.session.add(u)
+        db.session.commit()
+        yield u
+        db.session.delete(u)
+        db.session.commit()
+        test_app.extensions['login_limiter'] = None # Fresh counters for the next test
+
+
+@pytest.fixture(scope='function')
+def statements(test_app):
+    """Collect SQL statements executed during a test."""
+    seen = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+    with test_app.app_context():
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        yield seen
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+# --- Storage unit tests ---
+def test_memory_storage_sliding_window():
+    storage = MemoryStorage()
+    for _ in range(4):
+        storage.hit('k', 100, 150)
+    assert storage.get('k', 100, 150) == 4
+    # Halfway through the next window, half of the previous window still counts
+    assert storage.get('k', 100, 250) == pytest.approx(2)
+    # Two windows later everything has expired
+    assert storage.get('k', 100, 400) == 0
+
+def test_memory_storage_ttl_eviction():
+    storage = MemoryStorage(sweep_interval=0)
+    storage.hit('old', 100, 10)
+    storage.hit('new', 100, 350)
+    assert len(storage) == 1 # 'old' was untouched for two windows and got evicted
+    assert storage.get('new', 100, 350) == 1
+
+def test_memory_storage_reset():
+    storage = MemoryStorage()
+    storage.hit('k', 100, 10)
+    storage.reset('k')
+    assert storage.get('k', 100, 10) == 0
+
+def test_database_storage_shared_counter(test_app):
+    with test_app.app_context():
+        storage = DatabaseStorage(db.engine)
+        storage.hit('user:bob', 100, 150)
+        storage.hit('user:bob', 100, 160)
+        # A second storage object (i.e. another worker) sees the same count
+        assert DatabaseStorage(db.engine).get('user:bob', 100, 170) == 2
+        assert storage.evict_expired(1000) == 1
+        assert storage.get('user:bob', 100, 170) == 0
+
+def test_database_storage_ttl_eviction(test_app):
+    with test_app.app_context():
+        storage = DatabaseStorage(db.engine, sweep_interval=300)
+        storage.hit('ip:10.0.0.1', 100, 10) # Sweeps (nothing to delete) and schedules the next at 310
+        storage.hit('ip:10.0.0.2', 100, 250)
+        assert DatabaseStorage(db.engine).get('ip:10.0.0.1', 100, 10) == 1 # Not swept yet
+        storage.hit('ip:10.0.0.3', 100, 350)
+        with db.engine.connect() as conn:
+            keys = sorted(conn.scalars(select(storage.table.c.key)))
+        assert keys == ['ip:10.0.0.2', 'ip:10.0.0.3'] # ip:10.0.0.1 expired at 200
+        storage.evict_expired(1000)
+
+
+# --- Login route tests ---
+def test_login_locked_after_repeated_failures(test_client, throttled_user, app_context):
+    limit = app_context.config['LOGIN_RATE_LIMIT_PER_USER']
+    for _ in range(limit):
+        response = test_client.post(url_for('auth.login'), data={
+            'username': throttled_user.username, 'password': 'wrong'})
+        assert response.status_code == 200
+
+    # Even the correct password is refused while the account is throttled
+    response = test_client.post(url_for('auth.login'), data={
+        'username': throttled_user.username, 'password': 'password'})
+    assert response.status_code == 429
+    assert b'Too many failed login attempts' in response.data
+    assert 'Retry-After' in response.headers
+
+def test_throttled_login_skips_user_lookup(test_client, throttled_user, app_context, statements):
+    limit = app_context.config['LOGIN_RATE_LIMIT_PER_USER']
+    for _ in range(limit):
+        test_client.post(url_for('auth.login'), data={
+            'username': throttled_user.username, 'password': 'wrong'})
+    statements.clear()
+
+    response = test_client.post(url_for('auth.login'), data={
+        'username': throttled_user.username, 'password': 'wrong'})
+    assert response.status_code == 429
+    assert not any('FROM users' in s for s in statements)
+
+def test_successful_login_resets_user_counter(test_client, throttled_user, app_context):
+    limit = app_context.config['LOGIN_RATE_LIMIT_PER_USER']
+    for _ in range(limit - 1):
+        test_client.post(url_for('auth.login'), data={
+            'username': throttled_user.username, 'password': 'wrong'})
+    response = test_client.post(url_for('auth.login'), data={
+        'username': throttled_user.username, 'password': 'password'})
+    assert response.status_code == 302
+    test_client.get(url_for('auth.logout'))
+
+    response = test_client.post(url_for('auth.login'), data={
+        'username': throttled_user.username, 'password': 'wrong'})
+    assert response.status_code == 200 # Counter started over after the success
+
+def test_unknown_user_still_hashes(test_client, app_context, monkeypatch):
+    calls = []
+    monkeypatch.setattr(User, 'check_dummy_password', staticmethod(lambda pw: calls.append(pw) or False))
+    response = test_client.post(url_for('auth.login'), data={
+        'username': 'nobody-here', 'password': 'secret'})
+    assert response.status_code == 200
+    assert calls == ['secret']
+    login_limiter.storage.reset('user:nobody-here')
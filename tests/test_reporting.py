@@ -0,0 +1,137 @@
+import pytest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from flask import url_for
+from sqlalchemy import insert
+from app import db
+from app.models import Product, StockMovement, ProductRollup, CategoryRollup, utcnow
+from app.bulk_update import BulkUpdate
+from app import reporting
+from app.reporting import record_sale, activity_report, stock_turnover, rebuild_rollups, bucket_start
+from tests.test_auth import test_user  # Import the test_user fixture
+from tests.test_products import logged_in_client
+
+
+@pytest.fixture(scope='function')
+def stocked(test_app):
+    with test_app.app_context():
+        p = Product(sku='REP-1', name='Reported', price=Decimal('2.50'), category='Reports', stock_quantity=10)
+        db.session.add(p)
+        db.session.commit()
+        yield p
+        for model in (Product, StockMovement, ProductRollup, CategoryRollup):
+            model.query.delete()
+        db.session.commit()
+
+
+def _today():
+    now = utcnow()
+    return bucket_start(now, 'day'), bucket_start(now, 'day') + timedelta(days=1)
+
+
+def _category_totals(period='day'):
+    start, end = _today()
+    return {row.category: row for row in activity_report(start, end, period=period)}
+
+
+def test_sales_and_adjustments_roll_up(app_context, stocked):
+    record_sale(stocked, 3)
+    db.session.commit()
+    stocked.stock_quantity = 20 # Receipt of 13
+    db.session.commit()
+    stocked.adjust_stock(-1) # Shrinkage
+    db.session.commit()
+
+    row = _category_totals()['Reports']
+    assert (row.units_sold, row.revenue, row.units_in, row.units_out) == (3, Decimal('7.50'), 23, 1)
+    hourly = _category_totals('hour')['Reports']
+    assert hourly.units_in == 23 # Includes the initial stock of 10
+    assert [m.kind for m in StockMovement.query.order_by(StockMovement.id)] == [
+        'adjustment', 'sale', 'adjustment', 'adjustment']
+
+def test_rolled_back_sale_is_not_reported(app_context, stocked):
+    record_sale(stocked, 2)
+    db.session.flush()
+    db.session.rollback()
+    assert _category_totals()['Reports'].units_sold == 0
+    assert StockMovement.query.filter_by(kind='sale').count() == 0
+
+def test_bulk_stock_update_rolls_up(app_context, stocked):
+    BulkUpdate('stock_quantity', 'delta', '-4', category='Reports').run()
+    assert _category_totals()['Reports'].units_out == 4
+
+def test_rebuild_matches_incremental(app_context, stocked):
+    record_sale(stocked, 5, amount=Decimal('10.00'))
+    db.session.commit()
+    t = datetime(2024, 3, 1, 9, 30)
+    db.session.execute(insert(StockMovement), [
+        {'product_id': stocked.id, 'category': 'Reports', 'kind': 'sale', 'quantity': -1,
+         'amount': Decimal('2.50'), 'created_at': t},
+        {'product_id': stocked.id, 'category': 'Reports', 'kind': 'sale', 'quantity': -2,
+         'amount': Decimal('5.00'), 'created_at': t + timedelta(days=3)},
+    ])
+    db.session.commit()
+    incremental = {(r.period, r.bucket, r.units_sold) for r in CategoryRollup.query}
+
+    assert rebuild_rollups() == 3
+    rebuilt = {(r.period, r.bucket, r.units_sold) for r in CategoryRollup.query}
+    assert incremental <= rebuilt
+    assert ('day', datetime(2024, 3, 1), 1) in rebuilt
+    assert ('hour', datetime(2024, 3, 1, 9), 1) in rebuilt
+    assert ('day', datetime(2024, 3, 4), 2) in rebuilt
+
+    # A partial rebuild leaves earlier buckets alone
+    assert rebuild_rollups(since=datetime(2024, 3, 2)) == 2
+    assert ('day', datetime(2024, 3, 1), 1) in {(r.period, r.bucket, r.units_sold) for r in CategoryRollup.query}
+
+def test_sale_during_rebuild_is_counted_once(app_context, stocked, monkeypatch):
+    db.session.execute(insert(StockMovement), [
+        {'product_id': stocked.id, 'category': 'Reports', 'kind': 'sale', 'quantity': -1,
+         'amount': Decimal('2.50'), 'created_at': datetime(2024, 3, 1, 9, 30)}])
+    db.session.commit()
+    rebuild_day = reporting._rebuild_day
+    def rebuild_day_then_sell(day):
+        replayed = rebuild_day(day)
+        if day == datetime(2024, 3, 1): # Committed while today is still to be rebuilt
+            record_sale(stocked, 4)
+            db.session.commit()
+        return replayed
+    monkeypatch.setattr(reporting, '_rebuild_day', rebuild_day_then_sell)
+
+    assert rebuild_rollups() == 2
+    assert _category_totals()['Reports'].units_sold == 4
+    assert _category_totals('hour')['Reports'].units_sold == 4
+
+def test_turnover(app_context, stocked):
+    record_sale(stocked, 4)
+    db.session.commit()
+    start, end = _today()
+    [row] = stock_turnover(start, end)
+    assert (row['sku'], row['units_sold'], row['stock_quantity']) == ('REP-1', 4, 6)
+    assert row['days_of_cover'] == 1.5
+
+def test_report_api(logged_in_client, stocked):
+    record_sale(stocked, 1)
+    db.session.commit()
+    start, end = _today()
+    args = {'start': start.isoformat(), 'end': end.isoformat()}
+
+    response = logged_in_client.get(url_for('api.report_activity', **args))
+    assert response.status_code == 200
+    assert response.json['rows'] == [{'bucket': start.isoformat(), 'category': 'Reports', 'units_sold': 1,
+                                      'revenue': '2.50', 'units_in': 10, 'units_out': 0}]
+
+    response = logged_in_client.get(url_for('api.report_activity', by='product', format='csv', **args))
+    assert response.mimetype == 'text/csv'
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0] == 'bucket,product_id,units_sold,revenue,units_in,units_out'
+    assert lines[1].endswith(f',{stocked.id},1,2.50,10,0')
+
+    response = logged_in_client.get(url_for('api.report_turnover', **args))
+    assert response.json['products'][0]['units_sold'] == 1
+    response = logged_in_client.get(url_for('api.report_turnover', start=start.isoformat() + 'Z',
+                                            end=end.isoformat() + '+00:00'))
+    assert response.json['products'][0]['units_sold'] == 1
+
+    response = logged_in_client.get(url_for('api.report_activity', period='week'))
+    assert response.status_code == 400
@@ -0,0 +1,119 @@
+import os
+import threading
+import pytest
+from decimal import Decimal
+from flask import url_for
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User, Product
+from app.slow_queries import normalize, redact_parameters, read_entries, slow_queries_cli
+from config import TestingConfig
+
+
+@pytest.fixture(scope='module')
+def test_app(tmp_path_factory):
+    class SlowQueryConfig(TestingConfig):
+        SLOW_QUERY_LOG_ENABLED = True
+        SLOW_QUERY_THRESHOLD_MS = 0 # Log everything
+        SLOW_QUERY_LOG_FILE = str(tmp_path_factory.mktemp('logs') / 'slow_queries.log')
+
+    flask_env = os.environ.pop('FLASK_ENV', None)
+    try:
+        app = create_app(SlowQueryConfig)
+    finally:
+        if flask_env is not None:
+            os.environ['FLASK_ENV'] = flask_env
+    with app.app_context():
+        db.create_all()
+        user = User(username='slowuser', email='slow@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.add(Product(sku='SLOW-1', name='Slow', price=Decimal('1.00')))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        app.extensions['slow_query_log'].close()
+
+
+@pytest.fixture(scope='function')
+def entries(test_app):
+    path = test_app.config['SLOW_QUERY_LOG_FILE']
+    open(path, 'w').close()
+
+    def read():
+        test_app.extensions['slow_query_log'].flush()
+        return list(read_entries(path))
+    return read
+
+
+def test_normalize():
+    assert normalize("SELECT *\n  FROM t WHERE sku IN (?, ?, ?) AND name = 'it''s' AND qty > 10") == \
+        'SELECT * FROM t WHERE sku IN (?, ...) AND name = ? AND qty > ?'
+    assert normalize('INSERT INTO t (a, b) VALUES (%(a_0)s, %(b_0)s), (%(a_1)s, %(b_1)s)') == \
+        'INSERT INTO t (a, b) VALUES (?, ...), ...'
+    assert normalize('SELECT audit_log_202601.id::text FROM audit_log_202601 WHERE id = $1') == \
+        'SELECT audit_log_202601.id::text FROM audit_log_202601 WHERE id = ?'
+    assert redact_parameters(('secret', 5, None, b'xy', Decimal('1.5'))) == \
+        ['<str:6>', 5, None, '<bytes:2>', '<Decimal>']
+
+def test_request_queries_logged_with_call_site(test_app, entries):
+    client = test_app.test_client()
+    client.post(url_for('auth.login'), data={'username': 'slowuser', 'password': 'password'})
+    open(test_app.config['SLOW_QUERY_LOG_FILE'], 'w').close() # Only the request below
+    client.get(url_for('products.view_product', sku='slow-1'))
+
+    [lookup] = [e for e in entries() if 'FROM products' in e['statement']]
+    assert lookup['endpoint'] == 'products.view_product'
+    assert lookup['blueprint'] == 'products'
+    assert lookup['call_site'].startswith('app/products.py:')
+    assert lookup['parameters'] == ['<str:6>', 1, 0] # sku redacted; LIMIT/OFFSET kept
+    assert 'lower(products.sku) = lower(?)' in lookup['statement']
+
+def test_request_thread_only_queues(test_app, entries, monkeypatch):
+    [file_handler] = test_app.extensions['slow_query_log'].pipeline.listener.handlers
+    writers = []
+    emit = file_handler.emit
+    monkeypatch.setattr(file_handler, 'emit', lambda record: (writers.append(threading.get_ident()), emit(record)))
+    test_app.test_client().get(url_for('products.view_product', sku='slow-1'))
+    assert any('FROM products' in e['statement'] for e in entries())
+    assert writers and threading.get_ident() not in writers
+
+def test_plan_captured_once_per_shape(test_app, entries):
+    for sku in ('SLOW-1', 'OTHER'):
+        Product.query.filter_by(sku=sku).first()
+    first, second = [e for e in entries() if 'FROM products' in e['statement']]
+    assert first['fingerprint'] == second['fingerprint']
+    assert first['endpoint'] == 'cli'
+    assert any('products' in line for line in first['plan'])
+    assert 'plan' not in second
+
+def test_threshold(test_app, entries):
+    log = test_app.extensions['slow_query_log']
+    log.threshold = 10
+    try:
+        Product.query.count()
+    finally:
+        log.threshold = 0
+    assert entries() == []
+
+def test_report(test_app, entries):
+    for _ in range(3):
+        Product.query.filter_by(sku='SLOW-1').all()
+    db.session.query(User).all()
+    result = test_app.test_cli_runner().invoke(slow_queries_cli, ['report', '--sort', 'count', '--top', '1',
+                                                                  '--plans'])
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert lines[1].split()[0] == '3'
+    assert 'FROM products WHERE products.sku = ?' in lines[2]
+    assert 'FROM users' not in result.output
+    assert any('plan:' in line for line in lines)
+
+def test_no_listeners_when_disabled(test_app):
+    os.environ['FLASK_ENV'] = 'testing'
+    app = create_app()
+    log = test_app.extensions['slow_query_log']
+    assert 'slow_query_log' not in app.extensions
+    with app.app_context():
+        assert not event.contains(db.engine, 'after_cursor_execute', log._after)
@@ -0,0 +1,93 @@
+import io
+import pytest
+from sqlalchemy import event
+from app import db
+from app.models import User
+from app.user_import import import_users, UserImportError
+
+
+CSV = '''username,email,password,role
+alice,alice@example.com,correct-horse,admin
+bob,,battery-staple,
+ab,short@example.com,long-enough-1,
+carol,not-an-email,long-enough-2,
+dave,dave@example.com,short,
+alice,alice2@example.com,long-enough-3,
+erin,ALICE@example.com,long-enough-4,
+existing,existing2@example.com,long-enough-5,
+frank,Existing@Example.com,long-enough-6,
+'''
+
+
+@pytest.fixture(scope='function')
+def existing_user(test_app):
+    user = User(username='existing', email='existing@example.com')
+    user.set_password('password')
+    db.session.add(user)
+    db.session.commit()
+    yield user
+    db.session.execute(User.__table__.delete())
+    db.session.commit()
+
+
+def test_import_reports_rejected_rows(app_context, existing_user):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        report = import_users(io.StringIO(CSV), batch_size=4, workers=2)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    assert report['created'] == 2
+    assert [(e['line'], e['username'], e['error']) for e in report['errors']] == [
+        (4, 'ab', 'username must be 3-64 characters'),
+        (5, 'carol', 'invalid email address'),
+        (6, 'dave', 'password must be at least 8 characters'),
+        (7, 'alice', 'username already exists'), # Earlier in the file
+        (8, 'erin', 'email already exists'),
+        (9, 'existing', 'username already exists'),
+        (10, 'frank', 'email already exists'),
+    ]
+    # One lookup of existing users for the whole file, one INSERT per batch with valid rows
+    assert sum(s.lstrip().startswith('SELECT') and 'FROM users' in s for s in statements) == 1
+    assert sum(s.startswith('INSERT INTO users') for s in statements) == 1
+
+    alice = User.query.filter_by(username='alice').one()
+    assert alice.check_password('correct-horse')
+    assert (alice.email, alice.role) == ('alice@example.com', 'admin')
+    assert User.query.filter_by(username='bob').one().email is None
+
+def test_dry_run_creates_nobody(app_context, existing_user):
+    report = import_users(io.StringIO(CSV), dry_run=True)
+    assert (report['created'], report['failed']) == (2, 7)
+    assert User.query.count() == 1
+
+def test_missing_columns(app_context):
+    with pytest.raises(UserImportError):
+        import_users(io.StringIO('username,email\nzed,zed@example.com\n'))
+
+def test_batch_conflict_retried_row_by_row(app_context, existing_user, monkeypatch):
+    # Simulate a user created by someone else after the existing names were fetched
+    original = db.session.execute
+    def execute(statement, *args, **kwargs):
+        result = original(statement, *args, **kwargs)
+        if getattr(statement, 'is_select', False) and 'users' in str(statement):
+            result = result.all() # Read before the insert, as another process's commit would land
+            original(User.__table__.insert(), [{'username': 'gina', 'password_hash': 'x', 'role': 'admin'}])
+            db.session.commit()
+        return result
+    monkeypatch.setattr(db.session, 'execute', execute)
+    report = import_users(io.StringIO('username,password\ngina,long-enough\nhank,long-enough\n'), workers=1)
+    assert report['created'] == 1
+    assert report['errors'] == [{'line': 2, 'username': 'gina', 'error': 'username or email already exists'}]
+    assert User.query.filter_by(username='hank').count() == 1
+
+def test_cli(test_app, existing_user, tmp_path):
+    source, errors = tmp_path / 'users.csv', tmp_path / 'errors.csv'
+    source.write_text(CSV)
+    result = test_app.test_cli_runner().invoke(args=['auth', 'import-users', str(source), '--errors', str(errors),
+                                                     '--workers', '1'])
+    assert result.exit_code == 0, result.output
+    assert 'Done: 2 created, 7 rejected' in result.output
+    assert errors.read_text().splitlines()[:2] == ['line,username,error', '4,ab,username must be 3-64 characters']